@@ -0,0 +1,444 @@
+import sys
+import os
+import io
+import time
+import contextlib
+from antlr4 import InputStream, FileStream
+from Driver import analyze, parse_options
+from MipsGenerator import MipsGenerator
+from InstructionSelector import PATTERN_GROUPS, RULES
+from MipsSimulator import MipsSimulator, SimulationError
+from TimingModel import PipelineModel
+from TacInterpreter import TacInterpreter, TacRuntimeError
+from Bytecode import BytecodeCompiler, BytecodeVM, VMError
+from PythonGenerator import PythonGenerator, PythonRuntimeError
+from PureCalls import memoizable_functions
+
+ALLOCATOR_NAMES = ["graph", "linear"]
+REPEAT = 3
+
+def synthetic_program(size):
+    # Straight-line arithmetic with 'size' long-lived variables inside a loop,
+    # big enough for the allocator to dominate compile time
+    lines = ["function big(n: integer): integer {"]
+    for i in range(size):
+        lines.append(f"  let v{i}: integer = n + {i};")
+    lines.append("  let total: integer = 0;")
+    lines.append("  let k: integer = 0;")
+    lines.append("  while (k < 3) {")
+    for i in range(size):
+        lines.append(f"    total = total + v{i} * v{(i * 7) % size};")
+    lines.append("    k = k + 1;")
+    lines.append("  }")
+    lines.append("  return total;")
+    lines.append("}")
+    lines.append("print(big(1));")
+    return "\n".join(lines)
+
+def load_programs(directories, size):
+    programs = []
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".cps"):
+                programs.append((os.path.join(directory, name), FileStream(os.path.join(directory, name), encoding="utf-8")))
+    programs.append((f"synthetic({size})", InputStream(synthetic_program(size))))
+    return programs
+
+def measure(visitor, regalloc):
+    # Best of REPEAT backend runs, each one on a fresh generator
+    best, generator, assembly = None, None, None
+    for _ in range(REPEAT):
+        generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, regalloc)
+        start = time.perf_counter()
+        assembly = generator.generate()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    totals = {"spilled": 0, "rematerialized": 0, "coalesced": 0}
+    for data in generator.stats.values():
+        for key in totals:
+            totals[key] += data[key]
+    instructions = sum(1 for line in assembly.splitlines() if line.startswith("    "))
+    return best, totals, instructions, generator.errors
+
+RULE_COSTS = {rule.name: rule.cost for rule in RULES}
+
+def selection_cost(visitor, disabled_patterns):
+    # Instructions emitted and the selector's own cycle estimate for the code it matched
+    generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, "linear", disabled_patterns)
+    assembly = generator.generate()
+    if generator.errors:
+        return None
+    instructions = sum(1 for line in assembly.splitlines() if line.startswith("    "))
+    cycles = sum(RULE_COSTS[name] * count for name, count in generator.selection_stats.items())
+    return instructions, cycles
+
+def selection_report(programs):
+    # Instructions/cycles with every pattern, with none of them (one template per TAC line),
+    # and what each pattern group saves when it is the only one switched off
+    groups = list(PATTERN_GROUPS)
+    header = f"{'program':<28}{'naive':>12}{'trees':>12}" + "".join(f"{name:>20}" for name in groups)
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        best = selection_cost(visitor, ())
+        if best is None:
+            print(f"{os.path.basename(name):<28}unsupported")
+            continue
+        naive = selection_cost(visitor, ["trees"] + groups)
+        row = f"{os.path.basename(name):<28}{naive[0]:>6}/{naive[1]:<5}{best[0]:>6}/{best[1]:<5}"
+        for group in groups:
+            instructions, cycles = selection_cost(visitor, [group])
+            row += f"{instructions - best[0]:>+13}/{cycles - best[1]:<+6}"
+        print(row)
+
+def simulated_cycles(visitor, regalloc, **options):
+    # Timing model results for one allocator, or None when the program cannot run
+    generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, regalloc,
+                              source_lines=visitor.source_lines, **options)
+    assembly = generator.generate()
+    if generator.errors:
+        return None
+    simulator = MipsSimulator(assembly)
+    simulator.timing = PipelineModel(simulator.program)
+    try:
+        simulator.run()
+    except SimulationError:
+        return None
+    return simulator.timing
+
+def cycles_report(programs):
+    # Simulated cycles of every program with each allocator, with the stalls behind them
+    header = f"{'program':<28}" + "".join(f"{name + ' cycles':>16}{'instr':>10}{'CPI':>6}{'stalls':>9}"
+                                          for name in ALLOCATOR_NAMES)
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        row = f"{os.path.basename(name):<28}"
+        for regalloc in ALLOCATOR_NAMES:
+            timing = simulated_cycles(visitor, regalloc)
+            if timing is None:
+                row += f"{'unsupported':>41}"
+                continue
+            stalls = sum(timing.stalls.values())
+            row += f"{timing.cycle:>16}{timing.instructions:>10}{timing.cycle / timing.instructions:>6.2f}{stalls:>9}"
+        print(row)
+
+def executed_instructions(visitor, strength_reduction):
+    # Instructions the simulator runs, with the generator's reduction counts, or None
+    generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, "graph",
+                              source_lines=visitor.source_lines, strength_reduction=strength_reduction)
+    assembly = generator.generate()
+    if generator.errors:
+        return None
+    simulator = MipsSimulator(assembly)
+    try:
+        simulator.run()
+    except SimulationError:
+        return None
+    return simulator.steps, generator.reduction_stats
+
+def strength_report(programs):
+    # Dynamic instruction counts with and without induction-variable strength reduction
+    header = f"{'program':<28}{'before':>12}{'after':>12}{'saved':>8}{'pointers':>10}{'tests':>7}"
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        before = executed_instructions(visitor, False)
+        after = executed_instructions(visitor, True)
+        if before is None or after is None:
+            print(f"{os.path.basename(name):<28}{'unsupported':>12}")
+            continue
+        (steps_before, _), (steps_after, stats) = before, after
+        saved = (steps_before - steps_after) / steps_before * 100
+        print(f"{os.path.basename(name):<28}{steps_before:>12}{steps_after:>12}{saved:>7.1f}%"
+              f"{stats['pointers']:>10}{stats['tests']:>7}")
+
+def unroll_report(programs):
+    # Simulated cycles without unrolling, with full unrolling only and with full and
+    # partial unrolling, plus the code size each one takes
+    settings = [("none", {"unroll_budget": 0}), ("full", {"unroll_factor": 1}), ("partial", {})]
+    header = f"{'program':<28}" + "".join(f"{name + ' cycles':>16}{'size':>7}" for name, _ in settings)
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        row = f"{os.path.basename(name):<28}"
+        for _, options in settings:
+            timing = simulated_cycles(visitor, "graph", **options)
+            if timing is None:
+                row += f"{'unsupported':>23}"
+                continue
+            row += f"{timing.cycle:>16}{len(timing.program):>7}"
+        print(row)
+
+def pairs_report(programs, top=15):
+    # Instruction pairs that run back to back in the TAC interpreter, as a share of each
+    # program's instructions summed over programs, so no single long loop dominates
+    totals = {}
+    for _, visitor in programs:
+        pairs = {}
+        try:
+            TacInterpreter(visitor.generated_code, visitor.symbol_table, pair_counts=pairs).run()
+        except TacRuntimeError:
+            continue
+        executed = sum(pairs.values())
+        for pair, count in pairs.items():
+            totals[pair] = totals.get(pair, 0) + count / executed
+
+    print(f"{'first':<22}{'second':<22}{'share':>8}")
+    print("-" * 52)
+    for (first, second), share in sorted(totals.items(), key=lambda item: -item[1])[:top]:
+        print(f"{first or 'start':<22}{second:<22}{share:>8.3f}")
+
+def best_time(make):
+    # Best of REPEAT runs on fresh interpreters; setting one up is not timed
+    best = None
+    for _ in range(REPEAT):
+        interpreter = make()
+        start = time.perf_counter()
+        output = interpreter.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+def compiled_python(code, table, vectorize=True):
+    generator = PythonGenerator(code, table, vectorize=vectorize)
+    generator.compile()
+    return generator
+
+def interpreters_report(programs):
+    # Run time of the TAC interpreter against the bytecode VM's dispatch loop and its
+    # translated regions, without and with superinstructions, and against the functions
+    # compiled to Python
+    header = (f"{'program':<28}{'tac ms':>10}{'dispatch ms':>13}{'bytecode ms':>13}{'super ms':>10}"
+              f"{'python ms':>11}{'super':>8}{'python':>8}{'size':>11}")
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        code, table = visitor.generated_code, visitor.symbol_table
+        plain = BytecodeCompiler(code, table, superinstructions=False).compile()
+        fused = BytecodeCompiler(code, table).compile()
+        try:
+            tac_time, expected = best_time(lambda: TacInterpreter(code, table))
+            dispatch_time, dispatch_output = best_time(lambda: BytecodeVM(fused, translate=False))
+            plain_time, plain_output = best_time(lambda: BytecodeVM(plain))
+            fused_time, fused_output = best_time(lambda: BytecodeVM(fused))
+            python_time, python_output = best_time(lambda: compiled_python(code, table))
+        except (TacRuntimeError, VMError, PythonRuntimeError):
+            print(f"{os.path.basename(name):<28}runtime error")
+            continue
+        if len({expected, dispatch_output, plain_output, fused_output, python_output}) > 1:
+            print(f"{os.path.basename(name):<28}output differs from the TAC interpreter")
+            continue
+        size = f"{len(plain.code) // 4}/{len(fused.code) // 4}"
+        print(f"{os.path.basename(name):<28}{tac_time * 1000:>10.2f}{dispatch_time * 1000:>13.2f}"
+              f"{plain_time * 1000:>13.2f}"
+              f"{fused_time * 1000:>10.2f}{python_time * 1000:>11.2f}"
+              f"{tac_time / fused_time:>7.2f}x{tac_time / python_time:>7.2f}x{size:>11}")
+
+# Loops for the exceptions report: the same statement bare and inside a try, then tries
+# that fail every tenth iteration, directly and three calls down
+EXCEPTION_LOOPS = [
+    ("no try", "total = (total + data[i % 10] * i) % 1000003;", False),
+    ("try, no error", "total = (total + data[i % 10] * i) % 1000003;", True),
+    ("try, 10% errors", "total = total + 1000 / (i % 10);", True),
+    ("try, 10% errors 3 deep", "total = total + first(i);", True),
+]
+
+def exception_program(statement, guarded, iterations):
+    lines = ["let data: integer[] = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3];",
+             "function third(k: integer): integer { return 1000 / (k % 10); }",
+             "function second(k: integer): integer { return third(k) + 1; }",
+             "function first(k: integer): integer { return second(k) + 1; }",
+             "let total: integer = 0;",
+             "let errors: integer = 0;",
+             "let i: integer = 0;",
+             f"while (i < {iterations}) {{"]
+    if guarded:
+        lines += ["  try {", f"    {statement}", "  } catch (e) {", "    errors = errors + 1;", "  }"]
+    else:
+        lines.append(f"  {statement}")
+    lines += ["  i = i + 1;", "}", "print(total);", "print(errors);"]
+    return "\n".join(lines)
+
+def exceptions_report(iterations):
+    # Entering a try executes nothing, so the first two rows run the same instructions;
+    # only failures pay, for the table lookup and the unwinding
+    header = f"{'loop':<28}{'tac instr':>12}{'tac ms':>10}{'bytecode ms':>13}{'python ms':>11}"
+    print(header)
+    print("-" * len(header))
+
+    for name, statement, guarded in EXCEPTION_LOOPS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, _, visitor = analyze(InputStream(exception_program(statement, guarded, iterations)))
+        code, table = visitor.generated_code, visitor.symbol_table
+        program = BytecodeCompiler(code, table).compile()
+        interpreter = TacInterpreter(code, table)
+        interpreter.run()
+        tac_time, _ = best_time(lambda: TacInterpreter(code, table))
+        bytecode_time, _ = best_time(lambda: BytecodeVM(program))
+        python_time, _ = best_time(lambda: compiled_python(code, table))
+        print(f"{name:<28}{interpreter.steps:>12}{tac_time * 1000:>10.2f}{bytecode_time * 1000:>13.2f}"
+              f"{python_time * 1000:>11.2f}")
+
+# Loops for the bounds-check report, each run inside a repeat loop over a 16-element array
+BOUNDS_LOOPS = [
+    ("foreach sum", "foreach (x in data) { total = (total + x) % 1000003; }"),
+    ("range index sum", "foreach (k in range(16)) { total = (total + data[k]) % 1000003; }"),
+    ("while index sum", "let k: integer = 0; while (k < 16) { total = (total + data[k]) % 1000003; k = k + 1; }"),
+    ("range index scale", "foreach (k in range(16)) { data[k] = data[k] * 3 % 1000; }"),
+]
+
+def bounds_program(loop, repeats):
+    lines = ["let data: integer[] = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8, 9, 7, 9, 3];",
+             "let total: integer = 0;",
+             "let r: integer = 0;",
+             f"while (r < {repeats}) {{",
+             f"  {loop}",
+             "  r = r + 1;",
+             "}",
+             "print(total);",
+             "print(data[0]);"]
+    return "\n".join(lines)
+
+def bounds_report(iterations):
+    # Each loop compiled with and without bounds-check elimination; the Python backend
+    # runs without NumPy so both versions execute the same scalar loop
+    header = f"{'loop':<22}{'unchecked':>11}{'tac ms':>16}{'bytecode ms':>16}{'python ms':>16}"
+    print(header)
+    print(f"{'':<33}" + f"{'checked/elim':>16}" * 3)
+    print("-" * len(header))
+
+    for name, loop in BOUNDS_LOOPS:
+        source = bounds_program(loop, iterations // 16)
+        times = {}
+        for eliminate in [False, True]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, _, _, visitor = analyze(InputStream(source), eliminate)
+            code, table = visitor.generated_code, visitor.symbol_table
+            program = BytecodeCompiler(code, table).compile()
+            times[eliminate] = [best_time(lambda: TacInterpreter(code, table)),
+                                best_time(lambda: BytecodeVM(program)),
+                                best_time(lambda: compiled_python(code, table, vectorize=False))]
+            stats = visitor.bounds_checks
+        if len({output for row in times.values() for _, output in row}) > 1:
+            print(f"{name:<22}output differs between the checked and unchecked code")
+            continue
+        row = f"{name:<22}{stats['unchecked']:>7}/{stats['accesses']:<3}"
+        for checked, eliminated in zip(times[False], times[True]):
+            row += f"{checked[0] * 1000:>8.1f}/{eliminated[0] * 1000:<7.1f}"
+        print(row)
+
+# Recursive functions for the memoization report: (name, function, call with n)
+MEMO_FUNCTIONS = [
+    ("fib", "function fib(n: integer): integer { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }",
+     "fib(n)"),
+    ("binomial", "function choose(n: integer, k: integer): integer { if (k == 0 || k == n) { return 1; } "
+                 "return (choose(n - 1, k - 1) + choose(n - 1, k)) % 1000003; }", "choose(n, n / 2)"),
+    ("grid paths", "function paths(r: integer, c: integer): integer { if (r == 0 || c == 0) { return 1; } "
+                   "return (paths(r - 1, c) + paths(r, c - 1)) % 1000003; }", "paths(n / 2, n / 2)"),
+]
+
+def memo_program(function, call, n):
+    # n is a variable so the compiler cannot evaluate the call itself
+    return "\n".join([function, f"let n: integer = {n};", f"print({call});"])
+
+def memo_report(sizes):
+    # TAC instructions and run time of each function without and with memoization, for
+    # growing n: the plain calls grow exponentially, the memoized ones about linearly
+    header = f"{'function':<14}{'n':>4}{'tac instr':>24}{'tac ms':>20}{'hit rate':>10}"
+    print(header)
+    print(f"{'':<18}" + f"{'plain/memo':>20}" * 2)
+    print("-" * len(header))
+
+    for name, function, call in MEMO_FUNCTIONS:
+        for n in sizes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, _, _, visitor = analyze(InputStream(memo_program(function, call, n)))
+            code, table = visitor.generated_code, visitor.symbol_table
+            memoized = memoizable_functions(code, table)
+            # One run each: the plain one takes exponential time
+            runs = []
+            for interpreter in [TacInterpreter(code, table), TacInterpreter(code, table, memoize=memoized)]:
+                start = time.perf_counter()
+                output = interpreter.run()
+                runs.append((interpreter, time.perf_counter() - start, output))
+            (plain, plain_time, plain_output), (memo, memo_time, memo_output) = runs
+            if plain_output != memo_output:
+                print(f"{name:<14}{n:>4}  output differs with memoization")
+                continue
+            stats = memo.memo_stats
+            rate = 100 * stats["hits"] / max(1, stats["hits"] + stats["misses"])
+            print(f"{name:<14}{n:>4}{plain.steps:>14}/{memo.steps:<9}{plain_time * 1000:>11.1f}/"
+                  f"{memo_time * 1000:<8.2f}{rate:>9.1f}%")
+
+def analyze_programs(programs):
+    analyzed = []
+    for name, input_stream in programs:
+        # The visitor prints the TAC; keep the table readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, syntax_errors, visitor = analyze(input_stream)
+        if syntax_errors or visitor.errors:
+            print(f"{os.path.basename(name):<28}skipped (front end errors)")
+            continue
+        analyzed.append((name, visitor))
+    return analyzed
+
+def main(argv):
+    options, arguments = parse_options(argv)
+    size = int(options.get("size", "200"))
+    if options.get("report") == "exceptions":
+        exceptions_report(int(options.get("iterations", "100000")))
+        return
+    if options.get("report") == "bounds":
+        bounds_report(int(options.get("iterations", "200000")))
+        return
+    if options.get("report") == "memo":
+        memo_report([int(n) for n in options.get("sizes", "8,12,16,20").split(",")])
+        return
+    base = os.path.dirname(os.path.abspath(__file__))
+    directories = arguments or [os.path.join(base, "tests"), os.path.join(base, "benchmarks")]
+    programs = analyze_programs(load_programs(directories, size))
+
+    if options.get("report") == "selection":
+        selection_report(programs)
+        return
+    if options.get("report") == "cycles":
+        cycles_report(programs)
+        return
+    if options.get("report") == "unroll":
+        unroll_report(programs)
+        return
+    if options.get("report") == "strength":
+        strength_report(programs)
+        return
+    if options.get("report") == "pairs":
+        pairs_report(programs)
+        return
+    if options.get("report") == "interpreters":
+        interpreters_report(programs)
+        return
+
+    header = f"{'program':<28}" + "".join(f"{name + ' ms':>12}{'spills':>8}{'remat':>7}{'moves':>7}{'instr':>7}"
+                                          for name in ALLOCATOR_NAMES)
+    print(header)
+    print("-" * len(header))
+
+    for name, visitor in programs:
+        row = f"{os.path.basename(name):<28}"
+        for regalloc in ALLOCATOR_NAMES:
+            elapsed, totals, instructions, errors = measure(visitor, regalloc)
+            if errors:
+                row += f"{'unsupported':>41}"
+                continue
+            row += (f"{elapsed * 1000:>12.2f}{totals['spilled']:>8}{totals['rematerialized']:>7}"
+                    f"{totals['coalesced']:>7}{instructions:>7}")
+        print(row)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,282 @@
+import re
+from CodeFragment import TacLine
+from ControlFlowGraph import ControlFlowGraph
+from ThreeAddressCode import parse_line, is_temp
+
+# Bounds-check elimination over the visitor's TAC. In a loop, an index that counts up
+# from a non-negative constant and that the loop has just tested against the length of
+# the array cannot be out of bounds, so its load or store is marked unchecked. The
+# length is a len(a) computed in the loop or before it, or a constant no larger than the
+# literal a was initialized with. Arrays never shrink, so pushes after the test are
+# harmless. A len(a) at the top of a loop that cannot push or reassign anything is
+# moved in front of the loop.
+
+INTEGER = re.compile(r"\d+")
+
+
+class FunctionCode:
+    # The instructions of main or of one function, each with the index of its line
+    def __init__(self, name):
+        self.name = name
+        self.lines = []         # Line index of every instruction
+        self.instructions = []
+        self.handlers = []      # (start, end) labels of every protected range
+
+
+def split_functions(code):
+    main = FunctionCode(None)
+    functions = [main]
+    stack = [main]
+    for index, line in enumerate(code):
+        instruction = parse_line(line)
+        if instruction.op == "begin_func":
+            function = FunctionCode(instruction.target)
+            functions.append(function)
+            stack.append(function)
+        elif instruction.op == "end_func":
+            stack.pop()
+        elif instruction.op == "handler":
+            stack[-1].handlers.append(instruction.protected)
+        elif instruction.op != "class":
+            stack[-1].lines.append(index)
+            stack[-1].instructions.append(instruction)
+    return functions
+
+
+class BoundsCheckElimination:
+    def __init__(self, code, symbol_table):
+        self.code = code
+        self.symbol_table = symbol_table
+        self.functions = split_functions(code)
+        self.unchecked = set()  # Line indices of loads and stores proven in bounds
+        self.hoisted = {}       # Line index of a loop header label -> line indices of the len moved before it
+        self.stats = {"accesses": 0, "unchecked": 0, "hoisted": 0}
+
+    def run(self):
+        self.globals = self.global_names()
+        for function in self.functions:
+            self.optimize(function)
+
+        self.stats["unchecked"] = len(self.unchecked)
+        moved = {index for indices in self.hoisted.values() for index in indices}
+        result = []
+        for index, line in enumerate(self.code):
+            for hoisted in self.hoisted.get(index, []):
+                result.append(self.code[hoisted])
+            if index in moved:
+                continue
+            if index in self.unchecked:
+                instruction = parse_line(line)
+                instruction.checked = False
+                line = TacLine(str(instruction), line.line) if isinstance(line, TacLine) else str(instruction)
+            result.append(line)
+        return result
+
+    def global_names(self):
+        # Names a function reads or writes without declaring them
+        names = set()
+        for function in self.functions[1:]:
+            info = self.symbol_table.get(function.name, {})
+            own = set(info.get("params", {})) | set(info.get("locals", []))
+            for instruction in function.instructions:
+                names |= {name for name in instruction.uses() + instruction.defs()
+                          if not is_temp(name) and name not in own}
+        return names
+
+    def is_global(self, function, name):
+        if INTEGER.fullmatch(name):
+            return False
+        if function.name is None:
+            return name in self.globals
+        info = self.symbol_table.get(function.name, {})
+        return not is_temp(name) and name not in info.get("params", {}) and name not in info.get("locals", [])
+
+    # ******************************
+    # *** Loops                  ***
+    # ******************************
+
+    def optimize(self, function):
+        instructions = function.instructions
+        self.stats["accesses"] += sum(1 for instruction in instructions if instruction.op in ["load", "store"])
+        cfg = ControlFlowGraph(instructions)
+        dominators = cfg.dominators()
+        position = {id(instruction): index for index, instruction in enumerate(instructions)}
+        self.block_of = {id(instruction): block for block in cfg.blocks for instruction in block.instructions}
+
+        # A failure inside a try may leave the loop halfway through an iteration and come
+        # back through the catch block, so loops holding protected code are left alone
+        labels = {instruction.target: index for index, instruction in enumerate(instructions)
+                  if instruction.op == "label"}
+        protected = set()
+        for start, end in function.handlers:
+            protected |= set(range(labels[start], labels[end]))
+
+        self.definitions = {}
+        for instruction in instructions:
+            for name in instruction.defs():
+                self.definitions.setdefault(name, []).append(instruction)
+
+        for header, body in cfg.loops:
+            blocks = [cfg.blocks[index] for index in sorted(body)]
+            loop = [instruction for block in blocks for instruction in block.instructions]
+            outside = [block for block in header.predecessors if block.index not in body]
+            if len(outside) != 1 or any(position[id(instruction)] in protected for instruction in loop):
+                continue
+            preheader = outside[0]
+            defined = {}
+            for instruction in loop:
+                for name in instruction.defs():
+                    defined.setdefault(name, []).append(instruction)
+            calls = any(instruction.op in ["call", "callvirt"] for instruction in loop)
+
+            # A call may change any global the loop relies on
+            counters = {name for name, definitions in defined.items()
+                        if not (calls and self.is_global(function, name))
+                        and self.is_counter(cfg, header, preheader, name, definitions)}
+            tests = self.exit_tests(cfg, body, blocks, counters, dominators)
+            for block in blocks:
+                for offset, instruction in enumerate(block.instructions):
+                    if instruction.op not in ["load", "store"]:
+                        continue
+                    array, index = instruction.args[0], instruction.args[1]
+                    if array in defined:
+                        continue
+                    if calls and any(self.is_global(function, name) for name in [array, index]):
+                        continue
+                    if any(self.covers(test, block, offset, array, index, defined, preheader, dominators, function)
+                           for test in tests if not (calls and self.is_global(function, test[1]))):
+                        self.unchecked.add(function.lines[position[id(instruction)]])
+
+            if not calls and not any(instruction.op == "push" for instruction in loop):
+                self.hoist(function, cfg, header, preheader, defined, position)
+
+    def is_counter(self, cfg, header, preheader, name, definitions):
+        # Starts at a non-negative constant in the preheader and only ever grows by a
+        # positive constant right before the jump back to the header
+        initial = self.last_definition(preheader, name)
+        if initial is None or initial.op != "copy" or not INTEGER.fullmatch(initial.args[0]):
+            return False
+        for definition in definitions:
+            block = self.block_of[id(definition)]
+            offset = block.instructions.index(definition)
+            tail = block.instructions[offset + 1:]
+            if len(tail) != 1 or tail[0].op != "goto" or tail[0].target != header.label():
+                return False
+            step = definition
+            if step.op == "copy" and is_temp(step.args[0]) and offset > 0:
+                step = block.instructions[offset - 1]
+                if step.dest != definition.args[0]:
+                    return False
+            if not (step.op == "binary" and step.operator == "+" and step.args[0] == name
+                    and INTEGER.fullmatch(step.args[1]) and int(step.args[1]) > 0):
+                return False
+        return True
+
+    def last_definition(self, block, name):
+        for instruction in reversed(block.instructions):
+            if name in instruction.defs():
+                return instruction
+        return None
+
+    def exit_tests(self, cfg, body, blocks, counters, dominators):
+        # (counter, limit, test block, first block after the test) for every branch that
+        # leaves the loop unless counter < limit
+        labels = {block.label(): block for block in cfg.blocks if block.label() is not None}
+        tests = []
+        for block in blocks:
+            last = block.instructions[-1]
+            if not last.jump_targets() or last.op == "goto" or labels[last.target].index in body:
+                continue
+            if last.op == "ifrel" and last.operator == ">=":
+                counter, limit = last.args
+            elif last.op == "iffalse" and len(block.instructions) > 1:
+                compare = block.instructions[-2]
+                if not (compare.op == "binary" and compare.operator == "<" and compare.dest == last.args[0]):
+                    continue
+                counter, limit = compare.args
+            else:
+                continue
+            following = cfg.blocks[block.index + 1] if block.index + 1 < len(cfg.blocks) else None
+            if counter not in counters or following is None or following.index not in body:
+                continue
+            # Every way into the block after the test goes through the test, or around a
+            # loop that is itself inside that block's region
+            if all(predecessor is block or following.index in dominators.get(predecessor.index, ())
+                   for predecessor in following.predecessors):
+                tests.append((counter, limit, block, following))
+        return tests
+
+    def covers(self, test, block, offset, array, index, defined, preheader, dominators, function):
+        # Whether the test proves array[index] in bounds at block.instructions[offset]
+        counter, limit, test_block, following = test
+        if following.index not in dominators.get(block.index, ()):
+            return False
+        if index != counter and not self.copy_of(index, counter, block, offset, defined, following, dominators):
+            return False
+        return self.bounded_by_length(limit, array, test_block, defined, preheader, function)
+
+    def copy_of(self, index, counter, block, offset, defined, following, dominators):
+        # index = counter, as the only assignment of index in the loop, made after the
+        # test and before every path reaches the access
+        definitions = defined.get(index, [])
+        if len(definitions) != 1 or definitions[0].op != "copy" or definitions[0].args != [counter]:
+            return False
+        copy = definitions[0]
+        home = self.block_of[id(copy)]
+        if home is block:
+            return block.instructions.index(copy) < offset
+        return home.index in dominators.get(block.index, ()) and following.index in dominators.get(home.index, ())
+
+    def bounded_by_length(self, limit, array, test_block, defined, preheader, function):
+        # limit <= len(array) for as long as the loop runs
+        if limit in defined:
+            definitions = defined[limit]
+            return (len(definitions) == 1 and definitions[0].op == "len" and definitions[0].args == [array]
+                    and any(item is definitions[0] for item in test_block.instructions))
+        if INTEGER.fullmatch(limit):
+            constant = int(limit)
+        else:
+            source = self.last_definition(preheader, limit)
+            if source is not None and source.op == "len":
+                after = preheader.instructions[preheader.instructions.index(source) + 1:]
+                return source.args == [array] and not any(array in item.defs() for item in after)
+            if source is None or source.op != "copy" or not INTEGER.fullmatch(source.args[0]):
+                return False
+            constant = int(source.args[0])
+        length = self.literal_length(array, function)
+        return length is not None and constant <= length
+
+    def literal_length(self, array, function):
+        # Elements of the literal a local array is assigned once, before any loop reads it
+        if self.is_global(function, array):
+            return None
+        definitions = self.definitions.get(array, [])
+        if len(definitions) != 1:
+            return None
+        literal = definitions[0]
+        if literal.op == "copy" and is_temp(literal.args[0]):
+            sources = self.definitions.get(literal.args[0], [])
+            if len(sources) != 1:
+                return None
+            literal = sources[0]
+        if literal.op == "constarray":
+            return len(literal.args)
+        if literal.op == "newarray":
+            # The visitor pushes exactly this many elements before the literal is used
+            return int(literal.args[0])
+        return None
+
+    def hoist(self, function, cfg, header, preheader, defined, position):
+        # len(a) at the top of the loop, for an array the loop never reassigns or pushes to
+        if cfg.blocks[header.index - 1] is not preheader or not preheader.instructions[-1].falls_through():
+            return
+        for offset, instruction in enumerate(header.instructions):
+            if instruction.op != "len" or not is_temp(instruction.dest):
+                continue
+            earlier = header.instructions[:offset]
+            if (instruction.args[0] in defined or len(defined[instruction.dest]) != 1
+                    or any(instruction.dest in item.uses() for item in earlier)):
+                continue
+            label = function.lines[position[id(header.instructions[0])]]
+            self.hoisted.setdefault(label, []).append(function.lines[position[id(instruction)]])
+            self.stats["hoisted"] += 1
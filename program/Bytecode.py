@@ -0,0 +1,975 @@
+import sys
+import io
+import json
+import math
+import time
+import struct
+import contextlib
+from array import array
+from bisect import bisect_right
+from ThreeAddressCode import TACProgram, HandlerTable, is_constant, is_temp, constant_value, constant_array, literal_fills, ARRAY_TYPECODES
+from ThreeAddressCode import wrap_integer, INT_MIN, INT_MAX, MAX_CALL_DEPTH
+from ClassLayout import Record
+
+MAGIC = b"CPSBC2"
+
+# Every instruction is four ints [opcode, a, b, c] in one array('i') for the whole program.
+# Operands are frame slots unless noted; jump targets are offsets into the array. Opcodes are
+# numbered in the order the VM tests them: the hot group first, by the share of executed
+# instructions measured over benchmarks/ (addi 19%, add 13%, jlt 11%, jge 5%, jmp 4%, ...).
+(ADDI,                                  # a = b + c, c an immediate integer
+ ADD,
+ JLT, JGE,                              # if a <op> b goto c
+ JMP,                                   # goto a
+ MOVE, LOAD, ULOAD, MOD, MUL,           # LOAD: a = b[c], ULOAD the same without the bounds check
+ PARAM, CALL,                           # CALL: a = call function b with c params
+ RET, SUB, JLE, JGT, JEQ, JNE,
+ STORE, USTORE,                         # STORE: a[b] = c, USTORE the same without the bounds check
+ DIV, LT, LE, GT, GE, EQ, NE, AND, OR,
+ JF, JT,                                # if (not) a goto b
+ NEG, NOT,
+ LOADG, STOREG,                         # a = global b / global a = b
+ RETV, LEN, PUSH,
+ NEWARR,                                # a = new array of ARRAY_KINDS[b] holding c zeros (None in a list)
+ PRINT,                                 # PRINT a as PRINT_KINDS[b]
+ CONSTARR,                              # a = copy of the array in constant pool entry b
+ NEW,                                   # a = new object of class b
+ GETF, SETF,                            # a = b.field c / a.field b = c
+ CALLV,                                 # a = call vtable slot b of the first of c params
+ NULLCHK,                               # fail when a is null
+ CAUGHT) = range(47)                    # a = message of the error being handled
+HOT = MUL  # Opcodes up to this one are dispatched before the rest
+
+OPNAMES = ["addi", "add", "jlt", "jge", "jmp", "move", "load", "uload", "mod", "mul", "param", "call", "ret",
+           "sub", "jle", "jgt", "jeq", "jne", "store", "ustore", "div", "lt", "le", "gt", "ge", "eq", "ne", "and", "or",
+           "jf", "jt", "neg", "not", "loadg", "storeg", "retv", "len", "push", "newarray", "print",
+           "constarray", "new", "getfield", "setfield", "callvirt", "nullcheck", "caught"]
+BINARY_OPCODES = {"+": ADD, "-": SUB, "*": MUL, "/": DIV, "%": MOD, "<": LT, "<=": LE, ">": GT, ">=": GE,
+                  "==": EQ, "!=": NE, "&&": AND, "||": OR}
+BRANCH_OPCODES = {"<": JLT, "<=": JLE, ">": JGT, ">=": JGE, "==": JEQ, "!=": JNE}
+INVERTED_BRANCHES = {JLT: JGE, JGE: JLT, JLE: JGT, JGT: JLE, JEQ: JNE, JNE: JEQ}
+JUMPS = {JMP: 1, JF: 2, JT: 2, JLT: 3, JLE: 3, JGT: 3, JGE: 3, JEQ: 3, JNE: 3}  # Operand holding the target
+PRINT_KINDS = ["integer", "float", "string", "boolean"]
+ARRAY_KINDS = [None] + list(ARRAY_TYPECODES.values())  # None is a list
+ITEM_SIZES = [0] + [array(typecode).itemsize for typecode in ARRAY_TYPECODES.values()]
+MAX_REGION = 256  # Instructions per translated region
+WRAP = "{fa} = v if -2147483648 <= v <= 2147483647 else wrap_integer(v)"  # Integer results wrap to 32 bits
+
+# Python statements for the instructions RegionTranslator inlines. {a}/{b}/{c} read an operand
+# slot (a literal for a constant), {fa} is the destination slot and {ia}/{ib}/{ic} the raw operands.
+STATEMENTS = {
+    ADD: ["v = {b} + {c}", WRAP],
+    SUB: ["v = {b} - {c}", WRAP],
+    MUL: ["v = {b} * {c}", WRAP],
+    MOVE: ["{fa} = {b}"],
+    LOAD: ["v = {b}", "i = {c}", "if not 0 <= i < len(v): out_of_bounds(i, v)", "{fa} = v[i]"],
+    ULOAD: ["{fa} = {b}[{c}]"],
+    STORE: ["v = {a}", "i = {b}", "if not 0 <= i < len(v): out_of_bounds(i, v)", "v[i] = {c}"],
+    USTORE: ["{a}[{b}] = {c}"],
+    MOD: ["x = {b}", "y = {c}", "{fa} = x % y if x >= 0 and y > 0 else remainder(x, y)"],
+    DIV: ["{fa} = divide({b}, {c})"],
+    LT: ["{fa} = {b} < {c}"], LE: ["{fa} = {b} <= {c}"], GT: ["{fa} = {b} > {c}"],
+    GE: ["{fa} = {b} >= {c}"], EQ: ["{fa} = {b} == {c}"], NE: ["{fa} = {b} != {c}"],
+    AND: ["{fa} = {b} and {c}"], OR: ["{fa} = {b} or {c}"],
+    NEG: ["v = -{b}", "{fa} = v if v <= 2147483647 else wrap_integer(v)"],
+    NOT: ["{fa} = not {b}"],
+    PARAM: ["push_argument({a})"],
+    LOADG: ["{fa} = g[{ib}]"],
+    STOREG: ["g[{ia}] = {b}"],
+    LEN: ["{fa} = len({b})"],
+    PUSH: ["{a}.append({b})"],
+    CONSTARR: ["{fa} = pool[{ib}][:]"],
+    NEW: ["{fa} = Record(objects[{ib}])"],
+    GETF: ["r = {b}", "if r is None: null_reference()", "{fa} = r[{ic}]"],
+    SETF: ["r = {a}", "if r is None: null_reference()", "r[{ib}] = {c}"],
+    NULLCHK: ["if {a} is None: null_reference()"],
+}
+# Branch conditions and the operand holding the target
+CONDITIONS = {
+    JLT: ("{a} < {b}", 3), JGE: ("{a} >= {b}", 3), JLE: ("{a} <= {b}", 3), JGT: ("{a} > {b}", 3),
+    JEQ: ("{a} == {b}", 3), JNE: ("{a} != {b}", 3), JF: ("not {a}", 2), JT: ("{a}", 2),
+}
+
+
+class VMError(Exception):
+    pass
+
+
+class VMException(VMError):
+    # A runtime error of the program itself, which a catch block can handle
+    pass
+
+
+def truncated_division(x, y):
+    # Integer division rounds toward zero, like the MIPS div instruction
+    if y == 0:
+        raise VMException("division by zero")
+    quotient = abs(x) // abs(y)
+    return -quotient if (x < 0) != (y < 0) else quotient
+
+
+def divide(x, y):
+    if type(x) is int and type(y) is int:
+        return wrap_integer(truncated_division(x, y))
+    if y == 0:
+        raise VMException("division by zero")
+    return x / y
+
+
+def remainder(x, y):
+    # The sign follows the dividend, as in MIPS
+    if type(x) is int and type(y) is int:
+        return x - truncated_division(x, y) * y
+    if y == 0:
+        raise VMException("division by zero")
+    return math.fmod(x, y)
+
+
+def out_of_bounds(index, values):
+    raise VMException(f"index {index} out of bounds for array of length {len(values)}")
+
+
+def null_reference():
+    raise VMException("null reference")
+
+
+class BytecodeFunction:
+    def __init__(self, name, params, frame_size, entry, constants):
+        self.name = name
+        self.params = params          # Arguments arrive in slots 0 .. params - 1
+        self.frame_size = frame_size
+        self.entry = entry            # Offset of the first instruction
+        self.constants = constants    # [slot, constant pool index] pairs
+
+    def template(self, pool):
+        # Fresh frames are copies of this list, with constants already in their slots
+        frame = [None] * self.frame_size
+        for slot, index in self.constants:
+            frame[slot] = pool[index]
+        return frame
+
+
+class BytecodeProgram:
+    def __init__(self, pool, functions, code, globals_count, classes=None, handlers=None):
+        self.pool = pool
+        self.functions = functions    # main first
+        self.code = code
+        self.globals_count = globals_count
+        self.classes = classes or []  # [name, record size, vtable as function indexes]
+        self.handlers = handlers or []  # [start, end, catch] code offsets of every try
+
+    def save(self, path):
+        # MAGIC, header length, JSON header (pool and function table), little-endian code.
+        # Array literals in the pool are saved as [typecode, elements].
+        header = json.dumps({
+            "pool": [[value.typecode, value.tolist()] if isinstance(value, array) else value for value in self.pool],
+            "globals": self.globals_count,
+            "functions": [[f.name, f.params, f.frame_size, f.entry, f.constants] for f in self.functions],
+            "classes": self.classes,
+            "handlers": self.handlers,
+        }).encode("utf-8")
+        code = array("i", self.code)
+        if sys.byteorder == "big":
+            code.byteswap()
+        with open(path, "wb") as output:
+            output.write(MAGIC + struct.pack("<I", len(header)) + header + code.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as source:
+            data = source.read()
+        if not data.startswith(MAGIC):
+            raise VMError(f"{path} is not a Compiscript bytecode file")
+        start = len(MAGIC) + 4
+        length, = struct.unpack("<I", data[len(MAGIC):start])
+        header = json.loads(data[start:start + length].decode("utf-8"))
+        code = array("i")
+        code.frombytes(data[start + length:])
+        if sys.byteorder == "big":
+            code.byteswap()
+        functions = [BytecodeFunction(*entry) for entry in header["functions"]]
+        pool = [array(*value) if isinstance(value, list) else value for value in header["pool"]]
+        return cls(pool, functions, code, header["globals"], header.get("classes"), header.get("handlers"))
+
+    def disassemble(self):
+        entries = {function.entry: function.name for function in self.functions}
+        lines = ["constants:"]
+        for index, value in enumerate(self.pool):
+            text = f"{value.typecode}[{len(value)}]" if isinstance(value, array) else repr(value)
+            lines.append(f"  {index:>5}  {text}")
+        if self.classes:
+            lines.append("classes:")
+            for index, (name, size, vtable) in enumerate(self.classes):
+                lines.append(f"  {index:>5}  {name}, size {size}, vtable {vtable}")
+        if self.handlers:
+            lines.append("handlers:")
+            for start, end, catch in self.handlers:
+                lines.append(f"  {start:>5} - {end:<5} -> {catch}")
+        for pc in range(0, len(self.code), 4):
+            if pc in entries:
+                lines.append(f"{entries[pc]}:")
+            op, a, b, c = self.code[pc:pc + 4]
+            lines.append(f"  {pc:>5}  {OPNAMES[op]:<9}{a}, {b}, {c}")
+        return lines
+
+
+class BytecodeCompiler:
+    # Encodes the visitor's TAC as bytecode. With superinstructions on, the pairs that
+    # dominate measured runs (Benchmark.py --report=pairs) become single instructions:
+    #   t = x + k ; y = t                 ->  addi y, x, k    (results go straight to y)
+    #   t = x < y ; ifFalse t goto L      ->  jge x, y, L
+    #   goto L ; L: jge x, y, E           ->  jlt x, y, L' ; jmp E   (loop test at the bottom)
+    def __init__(self, code, symbol_table, superinstructions=True):
+        self.tac = TACProgram(code, symbol_table)
+        self.superinstructions = superinstructions
+        self.pool = []
+        self.pool_index = {}
+        self.globals = {name: index for index, name in enumerate(sorted(self.tac.globals))}
+        self.function_index = {function.name: index for index, function in enumerate(self.tac.all_functions())}
+        self.class_index = {name: index for index, name in enumerate(self.tac.classes)}
+        self.stats = {"add_immediate": 0, "compare_branch": 0, "forwarded": 0, "loop_inversion": 0}
+        for literal in self.tac.strings:
+            self.constant(literal)  # The string pool opens the constants table
+
+    def constant(self, operand):
+        value = constant_value(operand)
+        key = (type(value).__name__, value)
+        if key not in self.pool_index:
+            self.pool_index[key] = len(self.pool)
+            self.pool.append(value)
+        return self.pool_index[key]
+
+    def constant_array(self, instruction):
+        # Identical literals share one pool entry
+        key = ("array", instruction.type, tuple(instruction.args))
+        if key not in self.pool_index:
+            self.pool_index[key] = len(self.pool)
+            self.pool.append(constant_array(instruction))
+        return self.pool_index[key]
+
+    def compile(self):
+        code = []
+        functions = []
+        handlers = []
+        for function in self.tac.all_functions():
+            listing, frame_size, constants = self.compile_function(function)
+            functions.append(BytecodeFunction(function.name, len(function.params), frame_size, len(code), constants))
+
+            # Lay out the function, then patch label names into offsets
+            labels = {}
+            start = len(code)
+            for item in listing:
+                if item[0] == "label":
+                    labels[item[1]] = len(code)
+                else:
+                    code.extend(item)
+            for pc in range(start, len(code), 4):
+                position = JUMPS.get(code[pc])
+                if position is not None:
+                    code[pc + position] = labels[code[pc + position]]
+            handlers += [[labels[first], labels[last], labels[catch]] for first, last, catch in function.handlers]
+        classes = [[name, size, [self.function_index[function] for function in vtable]]
+                   for name, (size, vtable) in self.tac.classes.items()]
+        return BytecodeProgram(self.pool, functions, array("i", code), len(self.globals), classes, handlers)
+
+    def compile_function(self, function):
+        slots = {}
+        constants = []
+
+        def slot(operand):
+            if operand not in slots:
+                slots[operand] = len(slots)
+                if is_constant(operand):
+                    constants.append([slots[operand], self.constant(operand)])
+            return slots[operand]
+
+        for param in function.params:
+            slot(param)
+
+        # Temps defined and used exactly once can be fused with the instruction using them
+        counts = {}
+        for instruction in function.instructions:
+            for name in instruction.uses() + instruction.defs():
+                counts[name] = counts.get(name, 0) + 1
+
+        def single_use(name):
+            return self.superinstructions and is_temp(name) and counts.get(name) == 2
+
+        listing = []
+        instructions = function.instructions
+        self.fills = literal_fills(instructions)
+        index = 0
+        while index < len(instructions):
+            instruction = instructions[index]
+            following = instructions[index + 1] if index + 1 < len(instructions) else None
+            fused = following is not None and instruction.dest is not None and single_use(instruction.dest)
+
+            # Globals are copied into their slot before use and back after a definition
+            for name in instruction.uses():
+                if self.is_global(function, name):
+                    listing.append([LOADG, slot(name), self.globals[name], 0])
+
+            if fused and instruction.op == "binary" and instruction.operator in BRANCH_OPCODES \
+                    and following.op in ["iffalse", "iftrue"] and following.args[0] == instruction.dest:
+                opcode = BRANCH_OPCODES[instruction.operator]
+                if following.op == "iffalse":
+                    opcode = INVERTED_BRANCHES[opcode]
+                listing.append([opcode, slot(instruction.args[0]), slot(instruction.args[1]), following.target])
+                self.stats["compare_branch"] += 1
+                index += 2
+                continue
+
+            dest = instruction.dest
+            if fused and following.op == "copy" and following.args[0] == dest:
+                dest = following.dest
+                self.stats["forwarded"] += 1
+                index += 1
+            listing += self.translate(instruction, dest, slot)
+            if dest is not None and self.is_global(function, dest):
+                listing.append([STOREG, self.globals[dest], slot(dest), 0])
+            index += 1
+
+        listing.append([RETV, 0, 0, 0])
+        if self.superinstructions:
+            listing = self.invert_loops(listing)
+        return listing, len(slots), constants
+
+    def is_global(self, function, name):
+        return name in self.globals and not function.is_local(name)
+
+    def immediate(self, operand, negate=False):
+        # Integer literal usable as an addi immediate, or None
+        if operand is None or not is_constant(operand):
+            return None
+        value = constant_value(operand)
+        if type(value) is not int:
+            return None
+        value = -value if negate else value
+        return value if INT_MIN <= value <= INT_MAX else None
+
+    def translate(self, instruction, dest, slot):
+        # Instructions for one TAC instruction whose result goes to dest
+        op = instruction.op
+        args = instruction.args
+        if op == "binary":
+            if self.superinstructions and instruction.operator in ["+", "-"]:
+                immediate = self.immediate(args[1], negate=instruction.operator == "-")
+                if immediate is not None:
+                    self.stats["add_immediate"] += 1
+                    return [[ADDI, slot(dest), slot(args[0]), immediate]]
+            return [[BINARY_OPCODES[instruction.operator], slot(dest), slot(args[0]), slot(args[1])]]
+        if op == "copy":
+            return [[MOVE, slot(dest), slot(args[0]), 0]]
+        if op == "unary":
+            return [[NEG if instruction.operator == "-" else NOT, slot(dest), slot(args[0]), 0]]
+        if op == "goto":
+            return [[JMP, instruction.target, 0, 0]]
+        if op in ["iffalse", "iftrue"]:
+            return [[JF if op == "iffalse" else JT, slot(args[0]), instruction.target, 0]]
+        if op == "ifrel":
+            return [[BRANCH_OPCODES[instruction.operator], slot(args[0]), slot(args[1]), instruction.target]]
+        if op == "label":
+            return [("label", instruction.target)]
+        if op == "param":
+            return [[PARAM, slot(args[0]), 0, 0]]
+        if op == "call":
+            if instruction.target not in self.function_index:
+                raise VMError(f"call to unknown function '{instruction.target}'")
+            return [[CALL, slot(dest), self.function_index[instruction.target], instruction.args_count]]
+        if op == "callvirt":
+            return [[CALLV, slot(dest), int(args[1]), instruction.args_count]]
+        if op == "new":
+            return [[NEW, slot(dest), self.class_index[instruction.target], 0]]
+        if op == "getfield":
+            return [[GETF, slot(dest), slot(args[0]), int(args[1])]]
+        if op == "setfield":
+            return [[SETF, slot(args[0]), int(args[1]), slot(args[2])]]
+        if op == "nullcheck":
+            return [[NULLCHK, slot(args[0]), 0, 0]]
+        if op == "caught":
+            return [[CAUGHT, slot(dest), 0, 0]]
+        if op == "return":
+            return [[RET, slot(args[0]), 0, 0]] if args else [[RETV, 0, 0, 0]]
+        if op == "print":
+            return [[PRINT, slot(args[0]), PRINT_KINDS.index(instruction.type), 0]]
+        if op == "newarray":
+            # A literal whose pushes all follow is allocated at its full length and stored into
+            kind = ARRAY_KINDS.index(ARRAY_TYPECODES.get(instruction.type))
+            return [[NEWARR, slot(dest), kind, self.fills.get(id(instruction), 0)]]
+        if op == "constarray":
+            return [[CONSTARR, slot(dest), self.constant_array(instruction), 0]]
+        if op == "push":
+            if id(instruction) in self.fills:
+                return [[USTORE, slot(args[0]), slot(str(self.fills[id(instruction)])), slot(args[1])]]
+            return [[PUSH, slot(args[0]), slot(args[1]), 0]]
+        if op == "len":
+            return [[LEN, slot(dest), slot(args[0]), 0]]
+        if op == "load":
+            return [[LOAD if instruction.checked else ULOAD, slot(dest), slot(args[0]), slot(args[1])]]
+        if op == "store":
+            return [[STORE if instruction.checked else USTORE, slot(args[0]), slot(args[1]), slot(args[2])]]
+        raise VMError(f"cannot encode '{instruction}'")
+
+    def invert_loops(self, listing):
+        # A jump to a compare-and-branch becomes the inverted test, jumping to the
+        # instruction after the original one, followed by a jump to where the test exits
+        tests = {}
+        for position, item in enumerate(listing):
+            if item[0] == "label":
+                following = next((other for other in listing[position + 1:] if other[0] != "label"), None)
+                if following is not None and following[0] in INVERTED_BRANCHES:
+                    tests[item[1]] = (position, following)
+
+        result = []
+        inserted = {}  # Original label -> label placed after its test
+        for item in listing:
+            if item[0] == JMP and item[1] in tests:
+                label = item[1]
+                _, test = tests[label]
+                inserted.setdefault(label, f"{label}_body")
+                result.append([INVERTED_BRANCHES[test[0]], test[1], test[2], inserted[label]])
+                result.append([JMP, test[3], 0, 0])
+                self.stats["loop_inversion"] += 1
+            else:
+                result.append(item)
+
+        # Place the new labels right after the tests they skip
+        final = []
+        pending = []
+        for item in result:
+            final.append(item)
+            if item[0] == "label":
+                if item[1] in inserted:
+                    pending.append(inserted[item[1]])
+            elif pending:
+                final += [("label", label) for label in pending]
+                pending = []
+
+        # The jump that used to enter the test often lands on the very next instruction
+        return [item for position, item in enumerate(final)
+                if not (item[0] == JMP and self.falls_into(final, position + 1, item[1]))]
+
+    def falls_into(self, listing, position, label):
+        while position < len(listing) and listing[position][0] == "label":
+            if listing[position][1] == label:
+                return True
+            position += 1
+        return False
+
+
+class BytecodeVM:
+    # Executes a BytecodeProgram. Calls push (return offset, frame, destination) on an
+    # explicit stack instead of recursing in Python. By default the straight-line code
+    # between calls runs as regions translated to Python by RegionTranslator; with
+    # translate=False every instruction goes through one dispatch loop.
+    def __init__(self, program, max_jumps=10_000_000, translate=True):
+        self.program = program
+        self.max_jumps = max_jumps
+        self.translate = translate
+        self.output = []
+
+    def run(self):
+        try:
+            return self.execute_translated() if self.translate else self.execute()
+        except OverflowError:
+            raise VMError("value out of range for an integer[] element")
+
+    def execute_translated(self):
+        program = self.program
+        handlers = HandlerTable(program.handlers)
+        translator = RegionTranslator(self, program.code.tolist(), handlers)
+        regions = translator.regions
+        current = translator.current
+        stack = translator.stack
+
+        frame = current[0] = [None] * program.functions[0].frame_size
+        pc = program.functions[0].entry
+        while True:
+            try:
+                while pc >= 0:
+                    pc = (regions[pc] or translator.region(pc))(frame)
+                    frame = current[0]
+                return "".join(self.output)
+            except VMException as error:
+                # A region never spans the edge of a try, so its start finds the same handler
+                # as the instruction that failed
+                catch = handlers.lookup(pc)
+                while catch is None:
+                    if not stack:
+                        raise
+                    pc, frame, _ = stack.pop()
+                    pc -= 4  # The call the error came out of
+                    catch = handlers.lookup(pc)
+                translator.caught[0] = str(error)
+                current[0] = frame
+                pc = catch
+
+    def execute(self):
+        program = self.program
+        code = program.code.tolist()
+        functions = program.functions
+        pool = program.pool
+        templates = [function.template(pool) for function in functions]
+        objects = [Record([vtable] + [None] * (size - 1)) for _, size, vtable in program.classes]
+        entries = [function.entry for function in functions]
+        globals_ = [None] * program.globals_count
+        handlers = HandlerTable(program.handlers)
+        output = self.output = []
+        arguments = []
+        stack = []
+        max_jumps = self.max_jumps
+        jumps = 0
+
+        frame = templates[0][:]
+        pc = entries[0]
+        caught = None
+        while True:
+            try:
+                while True:
+                    op = code[pc]
+                    if op <= HOT:
+                        if op == ADDI:
+                            value = frame[code[pc + 2]] + code[pc + 3]
+                            frame[code[pc + 1]] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+                            pc += 4
+                        elif op == ADD:
+                            value = frame[code[pc + 2]] + frame[code[pc + 3]]
+                            frame[code[pc + 1]] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+                            pc += 4
+                        elif op == JLT:
+                            if frame[code[pc + 1]] < frame[code[pc + 2]]:
+                                pc = code[pc + 3]
+                                jumps += 1
+                                if jumps > max_jumps:
+                                    raise VMError(f"more than {max_jumps} jumps taken")
+                            else:
+                                pc += 4
+                        elif op == JGE:
+                            if frame[code[pc + 1]] >= frame[code[pc + 2]]:
+                                pc = code[pc + 3]
+                                jumps += 1
+                                if jumps > max_jumps:
+                                    raise VMError(f"more than {max_jumps} jumps taken")
+                            else:
+                                pc += 4
+                        elif op == JMP:
+                            pc = code[pc + 1]
+                            jumps += 1
+                            if jumps > max_jumps:
+                                raise VMError(f"more than {max_jumps} jumps taken")
+                        elif op == MOVE:
+                            frame[code[pc + 1]] = frame[code[pc + 2]]
+                            pc += 4
+                        elif op == LOAD:
+                            values = frame[code[pc + 2]]
+                            index = frame[code[pc + 3]]
+                            if not 0 <= index < len(values):
+                                raise VMException(f"index {index} out of bounds for array of length {len(values)}")
+                            frame[code[pc + 1]] = values[index]
+                            pc += 4
+                        elif op == ULOAD:
+                            frame[code[pc + 1]] = frame[code[pc + 2]][frame[code[pc + 3]]]
+                            pc += 4
+                        elif op == MOD:
+                            x = frame[code[pc + 2]]
+                            y = frame[code[pc + 3]]
+                            if x >= 0 and y > 0:
+                                # Python's % agrees with truncation here, for integers and floats
+                                frame[code[pc + 1]] = x % y
+                            elif type(x) is int and type(y) is int:
+                                frame[code[pc + 1]] = x - truncated_division(x, y) * y
+                            elif y == 0:
+                                raise VMException("division by zero")
+                            else:
+                                frame[code[pc + 1]] = math.fmod(x, y)
+                            pc += 4
+                        else:
+                            value = frame[code[pc + 2]] * frame[code[pc + 3]]
+                            frame[code[pc + 1]] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+                            pc += 4
+                    elif op == PARAM:
+                        arguments.append(frame[code[pc + 1]])
+                        pc += 4
+                    elif op == CALL or op == CALLV:
+                        count = code[pc + 3]
+                        if op == CALL:
+                            callee = code[pc + 2]
+                        else:
+                            record = arguments[-count]
+                            if record is None:
+                                raise VMException("null reference")
+                            callee = record[0][code[pc + 2]]
+                        new_frame = templates[callee][:]
+                        if count:
+                            new_frame[:count] = arguments[-count:]
+                            del arguments[-count:]
+                        stack.append((pc + 4, frame, code[pc + 1]))
+                        if len(stack) > MAX_CALL_DEPTH:
+                            raise VMError("call stack overflow")
+                        frame = new_frame
+                        pc = entries[callee]
+                    elif op == RET or op == RETV:
+                        value = frame[code[pc + 1]] if op == RET else None
+                        if not stack:
+                            return "".join(output)
+                        pc, frame, dest = stack.pop()
+                        frame[dest] = value
+                    elif op == SUB:
+                        value = frame[code[pc + 2]] - frame[code[pc + 3]]
+                        frame[code[pc + 1]] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+                        pc += 4
+                    elif op <= JNE:
+                        x = frame[code[pc + 1]]
+                        y = frame[code[pc + 2]]
+                        if op == JLE:
+                            taken = x <= y
+                        elif op == JGT:
+                            taken = x > y
+                        elif op == JEQ:
+                            taken = x == y
+                        else:
+                            taken = x != y
+                        if taken:
+                            pc = code[pc + 3]
+                            jumps += 1
+                            if jumps > max_jumps:
+                                raise VMError(f"more than {max_jumps} jumps taken")
+                        else:
+                            pc += 4
+                    elif op == STORE:
+                        values = frame[code[pc + 1]]
+                        index = frame[code[pc + 2]]
+                        if not 0 <= index < len(values):
+                            raise VMException(f"index {index} out of bounds for array of length {len(values)}")
+                        values[index] = frame[code[pc + 3]]
+                        pc += 4
+                    elif op == USTORE:
+                        frame[code[pc + 1]][frame[code[pc + 2]]] = frame[code[pc + 3]]
+                        pc += 4
+                    elif op == DIV:
+                        x = frame[code[pc + 2]]
+                        y = frame[code[pc + 3]]
+                        if type(x) is int and type(y) is int:
+                            frame[code[pc + 1]] = wrap_integer(truncated_division(x, y))
+                        elif y == 0:
+                            raise VMException("division by zero")
+                        else:
+                            frame[code[pc + 1]] = x / y
+                        pc += 4
+                    elif op <= OR:
+                        x = frame[code[pc + 2]]
+                        y = frame[code[pc + 3]]
+                        if op == LT:
+                            result = x < y
+                        elif op == LE:
+                            result = x <= y
+                        elif op == GT:
+                            result = x > y
+                        elif op == GE:
+                            result = x >= y
+                        elif op == EQ:
+                            result = x == y
+                        elif op == NE:
+                            result = x != y
+                        elif op == AND:
+                            result = x and y
+                        else:
+                            result = x or y
+                        frame[code[pc + 1]] = result
+                        pc += 4
+                    elif op == JF:
+                        pc = pc + 4 if frame[code[pc + 1]] else code[pc + 2]
+                    elif op == JT:
+                        pc = code[pc + 2] if frame[code[pc + 1]] else pc + 4
+                    elif op == NEG:
+                        value = -frame[code[pc + 2]]
+                        frame[code[pc + 1]] = value if value <= INT_MAX else wrap_integer(value)
+                        pc += 4
+                    elif op == NOT:
+                        frame[code[pc + 1]] = not frame[code[pc + 2]]
+                        pc += 4
+                    elif op == LOADG:
+                        frame[code[pc + 1]] = globals_[code[pc + 2]]
+                        pc += 4
+                    elif op == STOREG:
+                        globals_[code[pc + 1]] = frame[code[pc + 2]]
+                        pc += 4
+                    elif op == LEN:
+                        frame[code[pc + 1]] = len(frame[code[pc + 2]])
+                        pc += 4
+                    elif op == PUSH:
+                        frame[code[pc + 1]].append(frame[code[pc + 2]])
+                        pc += 4
+                    elif op == NEWARR:
+                        kind, length = code[pc + 2], code[pc + 3]
+                        if kind:
+                            frame[code[pc + 1]] = array(ARRAY_KINDS[kind], bytes(length * ITEM_SIZES[kind]))
+                        else:
+                            frame[code[pc + 1]] = [None] * length
+                        pc += 4
+                    elif op == CONSTARR:
+                        frame[code[pc + 1]] = pool[code[pc + 2]][:]
+                        pc += 4
+                    elif op == NEW:
+                        frame[code[pc + 1]] = Record(objects[code[pc + 2]])
+                        pc += 4
+                    elif op == GETF:
+                        record = frame[code[pc + 2]]
+                        if record is None:
+                            raise VMException("null reference")
+                        frame[code[pc + 1]] = record[code[pc + 3]]
+                        pc += 4
+                    elif op == SETF:
+                        record = frame[code[pc + 1]]
+                        if record is None:
+                            raise VMException("null reference")
+                        record[code[pc + 2]] = frame[code[pc + 3]]
+                        pc += 4
+                    elif op == NULLCHK:
+                        if frame[code[pc + 1]] is None:
+                            raise VMException("null reference")
+                        pc += 4
+                    elif op == CAUGHT:
+                        frame[code[pc + 1]] = caught
+                        pc += 4
+                    elif op == PRINT:
+                        value = frame[code[pc + 1]]
+                        if PRINT_KINDS[code[pc + 2]] == "boolean":
+                            output.append("true\n" if value else "false\n")
+                        else:
+                            output.append(f"{value}\n")
+                        pc += 4
+                    else:
+                        raise VMError(f"bad opcode {op} at offset {pc}")
+            except VMException as error:
+                # Unwind to the innermost try around pc, in this frame or a caller's. Nothing
+                # about tries is executed until here.
+                catch = handlers.lookup(pc)
+                while catch is None:
+                    if not stack:
+                        raise
+                    pc, frame, _ = stack.pop()
+                    pc -= 4  # The call the error came out of
+                    catch = handlers.lookup(pc)
+                caught = str(error)
+                pc = catch
+
+
+class RegionTranslator:
+    # Translates the code reached from an offset, up to a jump elsewhere, a call, a return or
+    # the edge of a try, into one generated Python function over the frame. Constants become
+    # literals, a branch back to the region's start turns into a while loop, and arguments
+    # pushed in the region go straight into the callee's frame. The function returns the
+    # offset to continue at (-1 once main returns) and leaves the frame to continue with,
+    # the callee's or the caller's after a call or a return, in current[0].
+    def __init__(self, vm, code, handlers):
+        program = vm.program
+        self.vm = vm
+        self.code = code
+        self.regions = [None] * len(code)
+        self.current = [None]  # Frame of the running function
+        self.stack = []        # (return offset, frame, destination slot) of every active call
+        self.caught = [None]   # Message of the error the running catch block handles
+        self.jumps = [0]       # Backward jumps taken, checked against vm.max_jumps
+        self.bounds = set(handlers.bounds)
+        self.entries = [function.entry for function in program.functions]
+        self.constants = [{slot: program.pool[index] for slot, index in function.constants}
+                          for function in program.functions]
+        self.arguments = []    # Arguments pushed in a region that ended before their call
+        vm.output = []
+        self.namespace = {
+            "g": [None] * program.globals_count, "pool": program.pool, "current": self.current,
+            "stack": self.stack, "caught": self.caught, "arguments": self.arguments,
+            "entries": self.entries,
+            # Translated code reads constants as literals, so frames start empty past the arguments
+            "padding": [[None] * (function.frame_size - function.params) for function in program.functions],
+            "objects": [Record([vtable] + [None] * (size - 1)) for _, size, vtable in program.classes],
+            "Record": Record, "array": array, "out": vm.output.append, "push_argument": self.arguments.append,
+            "jumps": self.jumps, "max_jumps": vm.max_jumps, "too_many_jumps": self.too_many_jumps,
+            "call_stack_overflow": self.call_stack_overflow, "MAX_CALL_DEPTH": MAX_CALL_DEPTH,
+            "divide": divide, "remainder": remainder, "out_of_bounds": out_of_bounds,
+            "null_reference": null_reference, "wrap_integer": wrap_integer,
+        }
+
+    def too_many_jumps(self):
+        raise VMError(f"more than {self.vm.max_jumps} jumps taken")
+
+    def call_stack_overflow(self):
+        raise VMError("call stack overflow")
+
+    def region(self, pc):
+        self.regions[pc] = self.translate(pc)
+        return self.regions[pc]
+
+    def translate(self, start):
+        code = self.code
+        constants = self.constants[bisect_right(self.entries, start) - 1]
+        body = []
+        pending = []  # Locals holding arguments pushed in this region, not yet called with
+        looped = False
+
+        def read(slot):
+            value = constants.get(slot, self)
+            if value is self or isinstance(value, array) or (isinstance(value, float) and not math.isfinite(value)):
+                return f"f[{slot}]"
+            return repr(value)
+
+        def flush(indent):
+            # Arguments still pending when the region ends wait for their call in arguments
+            return [f"{indent}push_argument({name})" for name in pending]
+
+        def leave(target, source, indent="    "):
+            body.extend(flush(indent))
+            if target <= source:
+                body.append(f"{indent}jumps[0] += 1")
+                body.append(f"{indent}if jumps[0] > max_jumps: too_many_jumps()")
+                if target == start:
+                    body.append(f"{indent}continue")
+                    return True
+            body.append(f"{indent}return {target}")
+            return False
+
+        def call(pc, dest, callee, count):
+            # Frame for the callee from the pending arguments, or from arguments for those
+            # pushed before the region started
+            if count <= len(pending):
+                first = f"[{', '.join(pending[len(pending) - count:])}]" if count else "[]"
+                del pending[len(pending) - count:]
+                body.extend(flush("    "))
+                body.append(f"    new = {first} + padding[{callee}]")
+            else:
+                body.extend(flush("    "))
+                body.append(f"    new = arguments[-{count}:] + padding[{callee}]")
+                body.append(f"    del arguments[-{count}:]")
+            body.append(f"    stack.append(({pc + 4}, f, {dest}))")
+            body.append("    if len(stack) > MAX_CALL_DEPTH: call_stack_overflow()")
+            body.append("    current[0] = new")
+
+        pc = start
+        count = 0
+        while True:
+            op, a, b, c = code[pc:pc + 4]
+            if (pc != start and pc in self.bounds) or count >= MAX_REGION:
+                body.extend(flush("    "))
+                body.append(f"    return {pc}")
+                break
+            count += 1
+            if op == PARAM:
+                name = f"p{len(pending)}_{pc}"
+                body.append(f"    {name} = {read(a)}")
+                pending.append(name)
+            elif op in STATEMENTS:
+                values = {"a": read(a), "b": read(b), "c": read(c), "fa": f"f[{a}]", "ia": a, "ib": b, "ic": c}
+                body += ["    " + line.format(**values) for line in STATEMENTS[op]]
+            elif op == ADDI:
+                # An immediate can only carry the sum past one end of the 32 bits
+                test = "v <= 2147483647" if c > 0 else "v >= -2147483648"
+                body += [f"    v = {read(b)} + {c}", f"    f[{a}] = v if {test} else wrap_integer(v)"]
+            elif op == NEWARR:
+                if b:
+                    body.append(f"    f[{a}] = array({ARRAY_KINDS[b]!r}, bytes({c * ITEM_SIZES[b]}))")
+                else:
+                    body.append(f"    f[{a}] = [None] * {c}")
+            elif op == PRINT:
+                if PRINT_KINDS[b] == "boolean":
+                    body.append(f"    out('true\\n' if {read(a)} else 'false\\n')")
+                else:
+                    body.append(f"    out('%s\\n' % ({read(a)},))")
+            elif op == CAUGHT:
+                body.append(f"    f[{a}] = caught[0]")
+            elif op in CONDITIONS:
+                condition, position = CONDITIONS[op]
+                body.append(f"    if {condition.format(a=read(a), b=read(b))}:")
+                looped = leave(code[pc + position], pc, "        ") or looped
+            elif op == JMP:
+                looped = leave(a, pc) or looped
+                break
+            elif op == CALL:
+                call(pc, a, b, c)
+                body.append(f"    return {self.entries[b]}")
+                break
+            elif op == CALLV:
+                # The object is the first argument; its vtable picks the function
+                first = pending[len(pending) - c] if c <= len(pending) else f"arguments[-{c}]"
+                body.append(f"    r = {first}")
+                body.append("    if r is None: null_reference()")
+                body.append(f"    k = r[0][{b}]")
+                call(pc, a, "k", c)
+                body.append("    return entries[k]")
+                break
+            elif op == RET or op == RETV:
+                body.append(f"    value = {read(a) if op == RET else None}")
+                body.append("    if not stack: return -1")
+                body.append("    pc, caller, dest = stack.pop()")
+                body.append("    caller[dest] = value")
+                body.append("    current[0] = caller")
+                body.append("    return pc")
+                break
+            else:
+                raise VMError(f"bad opcode {op} at offset {pc}")
+            pc += 4
+
+        lines = body
+        if looped:
+            lines = ["    while True:"] + ["    " + line for line in body]
+        source = [f"def region_{start}(f):"] + lines
+        namespace = dict(self.namespace)
+        exec("\n".join(source), namespace)
+        return namespace[f"region_{start}"]
+
+
+def compile_program(path, superinstructions=True):
+    # Bytecode for a .cps file, or None after printing its errors
+    from antlr4 import FileStream
+    from Driver import analyze
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(FileStream(path, encoding="utf-8"))
+    errors = syntax_errors + visitor.errors
+    for error in errors:
+        print(error)
+    if errors:
+        return None
+    return BytecodeCompiler(visitor.generated_code, visitor.symbol_table, superinstructions).compile()
+
+
+def main(argv):
+    # python3 Bytecode.py program.cps|program.cbc ... [--save=out.cbc] [--superinstructions=off] [--disassemble]
+    from Driver import parse_options
+
+    options, arguments = parse_options(argv)
+    failed = False
+    for path in arguments:
+        print(f"== {path}")
+        if path.endswith(".cps"):
+            program = compile_program(path, options.get("superinstructions") != "off")
+            if program is None:
+                failed = True
+                continue
+        else:
+            program = BytecodeProgram.load(path)
+
+        if "save" in options:
+            program.save(options["save"])
+            print(f"bytecode written to {options['save']}")
+        if "disassemble" in options:
+            for line in program.disassemble():
+                print(line)
+
+        vm = BytecodeVM(program)
+        start = time.perf_counter()
+        try:
+            output = vm.run()
+        except VMError as error:
+            print("".join(vm.output), end="")
+            print(f"runtime error: {error}")
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        print(output, end="")
+        print(f"-- {len(program.code) // 4} instructions, ran in {elapsed * 1000:.1f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,121 @@
+# Layout of Compiscript objects. An object is a fixed record: slot 0 holds its class's
+# vtable and the fields follow in declaration order, inherited ones first, so obj.field
+# is a load at an offset known at compile time and a subclass object can stand in for
+# its base class. A method takes a vtable slot the first time a class in the chain
+# declares it; overrides reuse their parent's slot, so obj.method() is an indexed
+# indirect call.
+
+FIELD_DEFAULTS = {"integer": "0", "float": "0.0", "boolean": "false", "string": '""'}
+
+
+class ClassLayout:
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.fields = list(parent.fields) if parent else []      # (name, type) by offset - 1
+        self.methods = list(parent.methods) if parent else []    # (name, function) by vtable slot
+        self.signatures = dict(parent.signatures) if parent else {}  # Method -> (param types, return type)
+        self.constructor = parent.constructor if parent else None    # (function, param types)
+
+    def method_function(self, method):
+        # Name of the TAC function implementing a method declared in this class. Like a
+        # nested function's label, it holds a "." so it never matches a user function.
+        return f"{self.name}.{method}"
+
+    def init_function(self):
+        # TAC function that stores every field's initial value; "$" marks made-up names
+        return f"{self.name}$init"
+
+    def add_field(self, name, type_):
+        if self.field_offset(name) is not None:
+            return False
+        self.fields.append((name, type_))
+        return True
+
+    def field_offset(self, name):
+        for index, (field, _) in enumerate(self.fields):
+            if field == name:
+                return index + 1
+        return None
+
+    def field_type(self, name):
+        offset = self.field_offset(name)
+        return self.fields[offset - 1][1] if offset is not None else None
+
+    def add_method(self, name, params, return_type):
+        # Override in place or take the next slot; False when the signature differs
+        function = self.method_function(name)
+        slot = self.method_slot(name)
+        if slot is not None:
+            if self.signatures[name] != (list(params.values()), return_type):
+                return False
+            self.methods[slot] = (name, function)
+        else:
+            self.methods.append((name, function))
+        self.signatures[name] = (list(params.values()), return_type)
+        return True
+
+    def method_slot(self, name):
+        for slot, (method, _) in enumerate(self.methods):
+            if method == name:
+                return slot
+        return None
+
+    def vtable(self):
+        return [function for _, function in self.methods]
+
+    def size(self):
+        return 1 + len(self.fields)
+
+    def is_subclass_of(self, name):
+        layout = self
+        while layout is not None:
+            if layout.name == name:
+                return True
+            layout = layout.parent
+        return False
+
+    def declaration(self):
+        # TAC line describing the class to the backends: record size, then the vtable
+        header = f"class {self.name}, {self.size()}"
+        return f"{header}: {', '.join(self.vtable())}" if self.methods else header
+
+
+class Record(list):
+    # Runtime object of the interpreters and the Python backend: [vtable, field, ...].
+    # Objects are equal only to themselves, never by contents.
+    __slots__ = ()
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+
+class ClassHierarchy:
+    # Whole-program view of the classes of one compile. A call through a vtable slot can
+    # only reach the functions in that slot of the receiver's static class and of its
+    # subclasses; when that is a single function the call can be made directly.
+    def __init__(self, layouts):
+        self.layouts = layouts
+        self.subclasses = {name: [] for name in layouts}  # Class -> direct subclasses
+        for layout in layouts.values():
+            if layout.parent is not None:
+                self.subclasses[layout.parent.name].append(layout.name)
+        self.targets = {}  # (class, slot) -> possible functions, filled on first lookup
+
+    def descendants(self, name):
+        # The class and every class below it
+        result = [name]
+        for child in self.subclasses[name]:
+            result += self.descendants(child)
+        return result
+
+    def possible_targets(self, name, slot):
+        key = (name, slot)
+        if key not in self.targets:
+            self.targets[key] = {self.layouts[descendant].vtable()[slot] for descendant in self.descendants(name)}
+        return self.targets[key]
+
+    def direct_target(self, name, slot):
+        # The only function a call to this slot on a 'name' object can run, or None
+        targets = self.possible_targets(name, slot)
+        return next(iter(targets)) if len(targets) == 1 else None
@@ -0,0 +1,254 @@
+from CodeFragment import TacLine
+from ThreeAddressCode import parse_line
+
+# Flat closure conversion. A nested function that reads or writes variables of the
+# functions around it gets a hidden last parameter, __env: a record with one field per
+# variable it (or any function nested in it) actually uses, filled in where the function
+# is declared and read into locals of the same names on entry. A variable that is never
+# assigned after a closure captures it is stored by value. The rest are boxed: they hold
+# a one-field $box record for their whole life, in the owner and in every closure, and
+# each read or write goes through it.
+
+BOX_CLASS = "$box"  # "$" marks names the compiler makes up; no identifier contains it
+ENV_PARAM = "__env"
+
+
+def env_variable(region):
+    # Variable of the enclosing function holding a closure's environment
+    # Siblings have distinct names, so the last part of the label is enough
+    return f"{ENV_PARAM}_{region.name.rsplit('.', 1)[-1]}"
+
+
+def env_class(region):
+    return f"{region.name}$env"
+
+
+class Region:
+    # A begin_func/end_func region: its own instructions, with nested functions kept in place
+    def __init__(self, begin, parent, info):
+        self.name = begin.split()[1]
+        self.begin = begin
+        self.end = None
+        self.parent = parent
+        self.info = info
+        self.items = []        # TacLine or Region, in order
+        self.instructions = {}  # Index in items -> parsed instruction
+        self.own = set(info.get("params", {})) | set(info.get("locals", []))
+        self.free = set()
+
+    def children(self):
+        return [item for item in self.items if isinstance(item, Region)]
+
+    def subtree(self):
+        result = [self]
+        for child in self.children():
+            result += child.subtree()
+        return result
+
+    def owner(self, name):
+        # Closest enclosing region, this one excluded, that declares name
+        region = self.parent
+        while region is not None and name not in region.own:
+            region = region.parent
+        return region
+
+
+def parse_regions(code, functions):
+    stack = []
+    root = None
+    for line in code:
+        if line.startswith("begin_func "):
+            region = Region(line, stack[-1] if stack else None, functions[line.split()[1]])
+            if stack:
+                stack[-1].items.append(region)
+            else:
+                root = region
+            stack.append(region)
+        elif line.startswith("end_func "):
+            stack.pop().end = line
+        else:
+            region = stack[-1]
+            region.instructions[len(region.items)] = parse_line(line)
+            region.items.append(line)
+    return root
+
+
+class ClosureConverter:
+    def __init__(self, code, functions, new_temp):
+        # functions maps every function label in code to its symbol table entry
+        self.root = parse_regions(code, functions)
+        self.new_temp = new_temp
+        self.regions = {region.name: region for region in self.root.subtree()}
+        self.with_env = set()  # Closures that need an environment
+        self.boxed = set()     # (owner region name, variable)
+        self.classes = []      # TAC class declarations the converted code needs
+
+    def convert(self):
+        self.find_environments()
+        self.find_boxes()
+        code = self.rewrite(self.root)
+        if self.boxed:
+            self.classes.append(f"class {BOX_CLASS}, 2")
+        return code
+
+    # ******************************
+    # *** Analysis               ***
+    # ******************************
+
+    def find_environments(self):
+        # Free variables, iterated because calling a closure that has an environment makes
+        # that environment's variable free in the caller too
+        changed = True
+        while changed:
+            changed = False
+            for region in reversed(self.root.subtree()):
+                free = set()
+                for instruction in region.instructions.values():
+                    for name in self.instruction_names(region, instruction):
+                        if name not in region.own and region.owner(name) is not None:
+                            free.add(name)
+                for child in region.children():
+                    free |= {name for name in child.free if name not in region.own}
+                if free != region.free:
+                    region.free = free
+                    changed = True
+                if free and region.name not in self.with_env:
+                    self.with_env.add(region.name)
+                    region.parent.own.add(env_variable(region))
+                    changed = True
+
+    def instruction_names(self, region, instruction):
+        names = instruction.uses() + instruction.defs()
+        callee = self.closure_call(region, instruction)
+        if callee is not None and callee is not region:
+            names.append(env_variable(callee))
+        return names
+
+    def closure_call(self, region, instruction):
+        # The region a call goes to, when it is a closure with an environment
+        if instruction.op != "call" or instruction.target not in self.with_env:
+            return None
+        return self.regions[instruction.target]
+
+    def find_boxes(self):
+        for region in self.root.subtree():
+            loops = self.loops(region)
+            for index, child in enumerate(region.items):
+                if not isinstance(child, Region):
+                    continue
+                assigned_inside = {name for inner in child.subtree()
+                                   for instruction in inner.instructions.values() for name in instruction.defs()}
+                for name in child.free & region.own:
+                    if name in assigned_inside or self.assigned_after(region, name, index, loops):
+                        self.boxed.add((region.name, name))
+
+    def loops(self, region):
+        # (label index, jump index) of every backward jump among the region's own items
+        labels = {}
+        spans = []
+        for index, instruction in region.instructions.items():
+            if instruction.op == "label":
+                labels[instruction.target] = index
+            for target in instruction.jump_targets():
+                if target in labels:
+                    spans.append((labels[target], index))
+        return spans
+
+    def assigned_after(self, region, name, capture, loops):
+        # Whether name can be assigned in region once the closure at index capture exists:
+        # later in the code, or earlier inside a loop that also runs the capture again
+        for index, instruction in region.instructions.items():
+            if name not in instruction.defs():
+                continue
+            if index > capture or any(start <= index and capture <= end for start, end in loops):
+                return True
+        return False
+
+    def is_boxed(self, region, name):
+        owner = region if name in region.own else region.owner(name)
+        return owner is not None and (owner.name, name) in self.boxed
+
+    # ******************************
+    # *** Rewriting              ***
+    # ******************************
+
+    def rewrite(self, region):
+        tag = region.begin.line if isinstance(region.begin, TacLine) else None
+
+        def emit(lines, text):
+            lines.append(TacLine(text, tag) if tag is not None else text)
+
+        code = [region.begin]
+        entry = []
+        params = list(region.info.get("params", {}))
+        for name in sorted(region.own):
+            if (region.name, name) not in self.boxed:
+                continue
+            if name in params:
+                box = self.new_temp()
+                for text in [f"{box} = new {BOX_CLASS}", f"setfield {box}, 1, {name}", f"{name} = {box}"]:
+                    emit(entry, text)
+            else:
+                emit(entry, f"{name} = new {BOX_CLASS}")
+        if region.name in self.with_env:
+            for slot, name in enumerate(sorted(region.free), 1):
+                emit(entry, f"{name} = getfield {ENV_PARAM}, {slot}")
+        code += entry
+
+        for index, item in enumerate(region.items):
+            if isinstance(item, Region):
+                if item.name in self.with_env:
+                    code += self.environment(region, item)
+                code += self.rewrite(item)
+                continue
+            instruction = region.instructions[index]
+            callee = self.closure_call(region, instruction)
+            if callee is not None:
+                env = ENV_PARAM if callee is region else env_variable(callee)
+                code += self.through_boxes(region, parse_line(f"param {env}"), item, changed=True)
+                instruction.args_count += 1
+                code += self.through_boxes(region, instruction, item, changed=True)
+            else:
+                code += self.through_boxes(region, instruction, item)
+        code.append(region.end)
+
+        if region.name in self.with_env:
+            region.info["params"][ENV_PARAM] = "env"
+            self.classes.append(f"class {env_class(region)}, {1 + len(region.free)}")
+        region.info.setdefault("locals", []).extend(sorted(region.free | {
+            env_variable(child) for child in region.children() if child.name in self.with_env}))
+        return code
+
+    def environment(self, region, closure):
+        # Record built where the closure is declared, holding boxes or values in slot order
+        env = self.new_temp()
+        lines = [f"{env} = new {env_class(closure)}"]
+        lines += [f"setfield {env}, {slot}, {name}" for slot, name in enumerate(sorted(closure.free), 1)]
+        code = []
+        for text in lines:
+            code += self.through_boxes(region, parse_line(text), closure.begin, changed=True, boxes=False)
+        code += self.through_boxes(region, parse_line(f"{env_variable(closure)} = {env}"), closure.begin, changed=True)
+        return code
+
+    def through_boxes(self, region, instruction, original, changed=False, boxes=True):
+        # The instruction with boxed variables read before it and written after it
+        tag = original.line if isinstance(original, TacLine) else None
+        before, after = [], []
+        if boxes:
+            for name in dict.fromkeys(instruction.uses()):
+                if self.is_boxed(region, name):
+                    value = self.new_temp()
+                    before.append(f"{value} = getfield {name}, 1")
+                    instruction.args = [value if arg == name else arg for arg in instruction.args]
+                    changed = True
+            dest = instruction.dest
+            if dest is not None and self.is_boxed(region, dest):
+                changed = True
+                if instruction.op == "copy":
+                    instruction = parse_line(f"setfield {dest}, 1, {instruction.args[0]}")
+                else:
+                    instruction.dest = self.new_temp()
+                    after.append(f"setfield {dest}, 1, {instruction.dest}")
+        if not changed:
+            return [original]
+        return [TacLine(text, tag) if tag is not None else text for text in before + [str(instruction)] + after]
@@ -5,4 +5,17 @@ class CodeFragment:
         self.type = type_
 
     def __repr__(self):
-        return f"CodeFragment(place={self.place}, type={self.type}, code={self.code})"
\ No newline at end of file
+        return f"CodeFragment(place={self.place}, type={self.type}, code={self.code})"
+
+
+class TacLine(str):
+    # A line of three-address code that remembers the source line of its statement
+    def __new__(cls, text, line):
+        instance = super().__new__(cls, text)
+        instance.line = line
+        return instance
+
+
+def tag_lines(code, line):
+    # Lines already tagged by an inner statement keep their own line
+    return [text if isinstance(text, TacLine) else TacLine(text, line) for text in code]
@@ -0,0 +1,144 @@
+class BasicBlock:
+    def __init__(self, index):
+        self.index = index
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+        self.live_in = set()
+        self.live_out = set()
+        self.loop_depth = 0
+
+    def label(self):
+        if self.instructions:
+            return self.instructions[0].label_name()
+        return None
+
+    def __repr__(self):
+        return f"BasicBlock({self.index}, label={self.label()}, size={len(self.instructions)})"
+
+
+class ControlFlowGraph:
+    # Works on any instruction list whose items provide label_name(), jump_targets(),
+    # falls_through(), uses() and defs(): TAC instructions and MIPS instructions alike.
+    def __init__(self, instructions):
+        self.blocks = []
+        self.loops = []  # (header block, set of block indices) for each natural loop
+        self.build(instructions)
+        self.compute_loops()
+
+    def build(self, instructions):
+        # Leaders are the first instruction, every label and every instruction after a jump
+        block = None
+        for instruction in instructions:
+            if block is None or instruction.label_name() is not None:
+                block = self.new_block(block)
+            block.instructions.append(instruction)
+            if instruction.jump_targets() or not instruction.falls_through():
+                block = None
+
+        labels = {}
+        for block in self.blocks:
+            for instruction in block.instructions:
+                if instruction.label_name() is not None:
+                    labels[instruction.label_name()] = block
+
+        for i, block in enumerate(self.blocks):
+            last = block.instructions[-1] if block.instructions else None
+            targets = []
+            if last is not None:
+                targets = [labels[target] for target in last.jump_targets() if target in labels]
+            if (last is None or last.falls_through()) and i + 1 < len(self.blocks):
+                targets.append(self.blocks[i + 1])
+            for target in targets:
+                if target not in block.successors:
+                    block.successors.append(target)
+                    target.predecessors.append(block)
+
+    def new_block(self, previous):
+        # Reuse an empty block instead of leaving it dangling
+        if previous is not None and not previous.instructions:
+            return previous
+        block = BasicBlock(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def instructions(self):
+        return [instruction for block in self.blocks for instruction in block.instructions]
+
+    def reachable(self, entries=()):
+        # Blocks reachable from the entry block, and from extra entries such as catch blocks
+        if not self.blocks:
+            return set()
+        seen = {0} | set(entries)
+        stack = [self.blocks[index] for index in seen]
+        while stack:
+            block = stack.pop()
+            for successor in block.successors:
+                if successor.index not in seen:
+                    seen.add(successor.index)
+                    stack.append(successor)
+        return seen
+
+    def dominators(self):
+        # Iterative dataflow: dom(n) = {n} U intersection of dom(p) for every predecessor p
+        reachable = self.reachable()
+        dominators = {index: set(reachable) for index in reachable}
+        if self.blocks:
+            dominators[0] = {0}
+
+        changed = True
+        while changed:
+            changed = False
+            for block in self.blocks[1:]:
+                if block.index not in reachable:
+                    continue
+                predecessors = [dominators[p.index] for p in block.predecessors if p.index in reachable]
+                new = set.intersection(*predecessors) if predecessors else set()
+                new = new | {block.index}
+                if new != dominators[block.index]:
+                    dominators[block.index] = new
+                    changed = True
+        return dominators
+
+    def compute_loops(self):
+        # Natural loops from back edges n -> h where h dominates n
+        dominators = self.dominators()
+        bodies = {}
+        for block in self.blocks:
+            for successor in block.successors:
+                if block.index in dominators and successor.index in dominators[block.index]:
+                    body = bodies.setdefault(successor.index, {successor.index})
+                    stack = [block]
+                    while stack:
+                        node = stack.pop()
+                        if node.index not in body:
+                            body.add(node.index)
+                            stack.extend(node.predecessors)
+
+        self.loops = [(self.blocks[header], body) for header, body in bodies.items()]
+        for block in self.blocks:
+            block.loop_depth = sum(1 for _, body in self.loops if block.index in body)
+
+    def compute_liveness(self):
+        # Backward dataflow: in = use U (out - def), out = U in(successor)
+        use_def = []
+        for block in self.blocks:
+            uses, defs = set(), set()
+            for instruction in block.instructions:
+                uses |= set(instruction.uses()) - defs
+                defs |= set(instruction.defs())
+            use_def.append((uses, defs))
+            block.live_in, block.live_out = set(), set()
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.blocks):
+                uses, defs = use_def[block.index]
+                live_out = set()
+                for successor in block.successors:
+                    live_out |= successor.live_in
+                live_in = uses | (live_out - defs)
+                if live_in != block.live_in or live_out != block.live_out:
+                    block.live_in, block.live_out = live_in, live_out
+                    changed = True
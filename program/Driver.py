@@ -1,10 +1,14 @@
 import sys
+import os
 from antlr4 import *
 from antlr4.error.ErrorListener import ErrorListener
 from CompiscriptLexer import CompiscriptLexer
 from CompiscriptParser import CompiscriptParser
 from graphviz import Digraph
 from Visitor import Visitor
+from MipsGenerator import MipsGenerator
+from TacInterpreter import TacInterpreter, TacRuntimeError, MEMO_ENTRIES
+from PureCalls import memoizable_functions
 from antlr4 import InputStream
 
 class CustomErrorListener(ErrorListener):
@@ -39,8 +43,34 @@ def tree_to_graph(tree, rule_names, graph=None, parent=None, count=[0]):
 
     return graph
 
-def parse_text(code: str):
-    input_stream = InputStream(code)
+def generate_mips(visitor, regalloc="graph", **options):
+    # Translate the visitor's TAC into MIPS assembly; options go to MipsGenerator
+    generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, regalloc,
+                              source_lines=visitor.source_lines, **options)
+    assembly = generator.generate()
+    return assembly, generator
+
+def run_tac(visitor, memoize=False, memo_entries=MEMO_ENTRIES):
+    # Execute the TAC with the interpreter; returns the program output, a runtime error, if any,
+    # and the interpreter. With memoize, calls to pure functions share an LRU table of results.
+    memoized = memoizable_functions(visitor.generated_code, visitor.symbol_table) if memoize else ()
+    interpreter = TacInterpreter(visitor.generated_code, visitor.symbol_table,
+                                 memoize=memoized, memo_entries=memo_entries)
+    try:
+        return interpreter.run(), None, interpreter
+    except TacRuntimeError as error:
+        return "".join(interpreter.output), f"Runtime error: {error}", interpreter
+
+def format_allocation_stats(stats):
+    lines = []
+    for function, data in stats.items():
+        lines.append(f"{function}: {data['spilled']} spilled, {data['rematerialized']} rematerialized, "
+                     f"{data['coalesced']} moves coalesced"
+                     + (f", {data['split']} intervals split" if "split" in data else ""))
+    return lines
+
+def analyze(input_stream, eliminate_checks=True, pure_calls=True):
+    # Front end: parse the input and run the semantic visitor over the tree
     lexer = CompiscriptLexer(input_stream)
     stream = CommonTokenStream(lexer)
     parser = CompiscriptParser(stream)
@@ -53,14 +83,31 @@ def parse_text(code: str):
     parser.addErrorListener(error_listener)
     
     tree = parser.program()
-    
-    # Get syntax errors
-    syntax_errors = error_listener.errors
-    
-    # Run visitor to get semantic errors and symbol table
-    visitor = Visitor()
-    tac_code = visitor.visit(tree)
+
+    visitor = Visitor(eliminate_checks, pure_calls)
+    visitor.visit(tree)
+    return tree, parser, error_listener.errors, visitor
+
+def parse_text(code: str, regalloc="linear", run=False):
+    tree, parser, syntax_errors, visitor = analyze(InputStream(code))
     semantic_errors = visitor.errors
+
+    # Only error-free programs reach the backend
+    mips_code = None
+    allocation_stats = []
+    backend_errors = []
+    program_output = None
+    runtime_error = None
+    if not syntax_errors and not semantic_errors:
+        if run:
+            program_output, runtime_error, _ = run_tac(visitor)
+        # What the MIPS backend does not support (floats, try/catch) is not an error in the
+        # program, so the TAC and its output stay valid
+        mips_code, generator = generate_mips(visitor, regalloc)
+        backend_errors = generator.errors
+        if backend_errors:
+            mips_code = None
+        allocation_stats = format_allocation_stats(generator.stats)
     
     # Generate parse tree image
     graph = tree_to_graph(tree, parser.ruleNames)
@@ -72,33 +119,123 @@ def parse_text(code: str):
         "semantic_errors": semantic_errors,
         "symbol_table": visitor.symbol_table,
         "image_path": output_path + ".png",
-        "intermediate_code": visitor.generated_code if hasattr(visitor, "generated_code") else tac_code
+        "intermediate_code": visitor.generated_code,
+        "mips_code": mips_code,
+        "backend_errors": backend_errors,
+        "allocation_stats": allocation_stats,
+        "program_output": program_output,
+        "runtime_error": runtime_error
     }
 
+def parse_options(argv):
+    # Split "--name=value" options and "--flag" switches from positional arguments
+    options, arguments = {}, []
+    for argument in argv[1:]:
+        if argument.startswith("--") and "=" in argument:
+            name, value = argument[2:].split("=", 1)
+            options[name] = value
+        elif argument.startswith("--"):
+            options[argument[2:]] = "on"
+        else:
+            arguments.append(argument)
+    return options, arguments
+
+def format_frame_allocations(generator):
+    stats = generator.allocation_stats
+    if not stats["sites"]:
+        return []
+    return [f"{stats['frame']} of {stats['sites']} allocations placed in the stack frame"]
+
+def format_devirtualization(visitor):
+    stats = visitor.devirtualization
+    if not stats["sites"]:
+        return []
+    return [f"{stats['devirtualized']} of {stats['sites']} method calls devirtualized"]
+
+def format_bounds_checks(visitor):
+    stats = visitor.bounds_checks
+    if not stats["accesses"]:
+        return []
+    return [f"{stats['unchecked']} of {stats['accesses']} array accesses unchecked, {stats['hoisted']} len hoisted"]
+
+def format_purity(visitor):
+    stats = visitor.purity
+    if not stats["pure"]:
+        return []
+    return [f"{stats['pure']} of {stats['functions']} functions pure: {stats['evaluated']} calls evaluated, "
+            f"{stats['reused']} reused, {stats['hoisted']} hoisted out of loops"]
+
+def format_memoization(interpreter):
+    stats = interpreter.memo_stats
+    calls = stats["hits"] + stats["misses"]
+    if not calls:
+        return []
+    return [f"{len(interpreter.memoize)} functions memoized: {stats['hits']} of {calls} calls hit "
+            f"({100 * stats['hits'] / calls:.1f}%), {stats['evicted']} results evicted"]
+
+def format_strength_reduction(generator):
+    stats = generator.reduction_stats
+    if not stats["pointers"]:
+        return []
+    return [f"{stats['pointers']} element addresses strength-reduced, {stats['tests']} loop tests rewritten"]
+
+def format_unrolling(generator):
+    stats = generator.unroll_stats
+    if not stats["full"] and not stats["partial"]:
+        return []
+    return [f"{stats['full']} loops fully unrolled, {stats['partial']} partially unrolled"]
+
+def backend_options(options):
+    # MipsGenerator keyword arguments from the command line options
+    backend = {"strength_reduction": options.get("strength-reduction") != "off"}
+    if "unroll-factor" in options:
+        backend["unroll_factor"] = int(options["unroll-factor"])
+    if "unroll-budget" in options:
+        backend["unroll_budget"] = int(options["unroll-budget"])
+    if options.get("unroll") == "off":
+        backend["unroll_budget"] = 0
+    return backend
+
 def main(argv):
-    input_stream = FileStream(argv[1])
-    lexer = CompiscriptLexer(input_stream)
-    stream = CommonTokenStream(lexer)
-    parser = CompiscriptParser(stream)
-    
-    # Add custom error listener for command line
-    error_listener = CustomErrorListener()
-    lexer.removeErrorListeners()
-    parser.removeErrorListeners()
-    lexer.addErrorListener(error_listener)
-    parser.addErrorListener(error_listener)
-    
-    tree = parser.program()
+    options, arguments = parse_options(argv)
+    regalloc = options.get("regalloc", "graph")
+    if regalloc not in ("graph", "linear"):
+        print(f"unknown register allocator '{regalloc}', expected 'graph' or 'linear'")
+        return
 
-    visitor = Visitor()
-    visitor.visit(tree)
+    tree, parser, syntax_errors, visitor = analyze(FileStream(arguments[0], encoding="utf-8"), options.get("check-elimination") != "off",
+                                                   options.get("pure-calls") != "off")
     
     # Print all errors
-    for error in error_listener.errors:
+    for error in syntax_errors:
         print(error)
     for error in visitor.errors:
         print(error)
 
+    if not syntax_errors and not visitor.errors and "run" in options:
+        output, runtime_error, interpreter = run_tac(visitor, "memoize" in options,
+                                                     int(options.get("memo-entries", MEMO_ENTRIES)))
+        print(output, end="")
+        if runtime_error:
+            print(runtime_error)
+        for line in format_memoization(interpreter):
+            print(line)
+
+    if not syntax_errors and not visitor.errors:
+        assembly, generator = generate_mips(visitor, regalloc, **backend_options(options))
+        for error in generator.errors:
+            print(error)
+
+        output_path = os.path.splitext(os.path.basename(arguments[0]))[0] + ".asm"
+        with open(output_path, "w") as output:
+            output.write(assembly + "\n")
+        print(f"MIPS written to {output_path}")
+        report = (format_allocation_stats(generator.stats) + format_devirtualization(visitor)
+                  + format_bounds_checks(visitor) + format_purity(visitor) + format_frame_allocations(generator)
+                  + format_strength_reduction(generator) + format_unrolling(generator))
+        for line in report:
+            print(line)
+
     graph = tree_to_graph(tree, parser.ruleNames)
     graph.render('parse_tree', format='png', cleanup=True)
 
@@ -0,0 +1,114 @@
+import sys
+import os
+import io
+import contextlib
+from antlr4 import FileStream
+from Driver import analyze, parse_options, generate_mips
+from TacInterpreter import TacInterpreter, TacRuntimeError
+from Bytecode import BytecodeCompiler, BytecodeVM, VMError
+from PythonGenerator import PythonGenerator, PythonRuntimeError
+from MipsSimulator import MipsSimulator, SimulationError
+
+# Every execution backend runs each program and must print what the TAC interpreter
+# prints, and fail at runtime exactly when it does. Each runner returns
+# (output, failed), or None when the backend does not support the program.
+
+def run_reference(visitor):
+    interpreter = TacInterpreter(visitor.generated_code, visitor.symbol_table)
+    try:
+        return interpreter.run(), False
+    except TacRuntimeError:
+        return "".join(interpreter.output), True
+
+def run_bytecode(visitor):
+    vm = BytecodeVM(BytecodeCompiler(visitor.generated_code, visitor.symbol_table).compile())
+    try:
+        return vm.run(), False
+    except VMError:
+        return "".join(vm.output), True
+
+def run_python(visitor):
+    generator = PythonGenerator(visitor.generated_code, visitor.symbol_table)
+    try:
+        return generator.run(), False
+    except PythonRuntimeError:
+        return "".join(generator.output), True
+
+def run_mips(visitor):
+    # Runtime errors are reported differently in MIPS, so only their output is compared
+    with contextlib.redirect_stdout(io.StringIO()):
+        assembly, generator = generate_mips(visitor, "linear")
+    if generator.errors:
+        return None
+    simulator = MipsSimulator(assembly)
+    try:
+        return simulator.run(), False
+    except SimulationError:
+        return "".join(simulator.output), True
+
+BACKENDS = [("bytecode", run_bytecode), ("python", run_python), ("mips", run_mips)]
+
+def program_paths(arguments):
+    base = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+    for argument in arguments or [os.path.join(base, "tests"), os.path.join(base, "benchmarks")]:
+        if os.path.isdir(argument):
+            paths += [os.path.join(argument, name) for name in sorted(os.listdir(argument)) if name.endswith(".cps")]
+        else:
+            paths.append(argument)
+    return paths
+
+def first_difference(expected, actual):
+    expected_lines, actual_lines = expected.splitlines(), actual.splitlines()
+    for number, (left, right) in enumerate(zip(expected_lines, actual_lines), 1):
+        if left != right:
+            return f"line {number}: expected {left!r}, got {right!r}"
+    return f"expected {len(expected_lines)} lines, got {len(actual_lines)}"
+
+def compare(visitor, name):
+    # One table row, plus a description of every mismatch
+    expected, expected_failed = run_reference(visitor)
+    row = f"{name:<28}{'error' if expected_failed else 'ok':>10}"
+    problems = []
+    for backend, runner in BACKENDS:
+        result = runner(visitor)
+        if result is None or (backend == "mips" and expected_failed):
+            row += f"{'-':>10}"
+            continue
+        output, failed = result
+        if output == expected and failed == expected_failed:
+            row += f"{'same':>10}"
+            continue
+        row += f"{'DIFFERS':>10}"
+        if failed != expected_failed:
+            problems.append(f"  {backend}: {'fails' if failed else 'does not fail'} at runtime")
+        if output != expected:
+            problems.append(f"  {backend}: {first_difference(expected, output)}")
+    return row, problems
+
+def main(argv):
+    # python3 Equivalence.py [program.cps | directory] ...
+    _, arguments = parse_options(argv)
+    header = f"{'program':<28}{'tac':>10}" + "".join(f"{backend:>10}" for backend, _ in BACKENDS)
+    print(header)
+    print("-" * len(header))
+
+    mismatches = 0
+    for path in program_paths(arguments):
+        name = os.path.basename(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, syntax_errors, visitor = analyze(FileStream(path, encoding="utf-8"))
+        if syntax_errors or visitor.errors:
+            print(f"{name:<28}skipped (front end errors)")
+            continue
+        row, problems = compare(visitor, name)
+        print(row)
+        for problem in problems:
+            print(problem)
+        mismatches += 1 if problems else 0
+
+    print(f"{mismatches} program(s) with differences")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
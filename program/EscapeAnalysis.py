@@ -0,0 +1,88 @@
+from ControlFlowGraph import ControlFlowGraph
+
+ALLOCATIONS = ["new", "newarray", "constarray"]
+
+
+class EscapeAnalysis:
+    # Finds the objects and arrays that never outlive the call that allocates them. A value
+    # escapes when any variable it is copied into is global, is returned, is stored in a
+    # field, an array element or a push, or is passed to a callvirt or to a parameter that
+    # escapes in its callee. Parameter summaries are iterated to a fixed point over the
+    # whole program, starting from "nothing escapes".
+    def __init__(self, program):
+        self.program = program
+        self.param_escapes = {function.name: [False] * len(function.params) for function in program.all_functions()}
+        changed = True
+        while changed:
+            changed = False
+            for function in program.all_functions():
+                flags = self.param_escapes[function.name]
+                for position, param in enumerate(function.params):
+                    if not flags[position] and self.escapes(function, param):
+                        flags[position] = True
+                        changed = True
+
+        # Allocation instructions whose objects can live in the allocating function's frame
+        self.local_allocations = set()
+        self.stats = {"sites": 0, "local": 0}
+        for function in program.all_functions():
+            for instruction in self.frame_allocations(function):
+                self.local_allocations.add(id(instruction))
+        self.stats["local"] = len(self.local_allocations)
+
+    def is_local(self, instruction):
+        return id(instruction) in self.local_allocations
+
+    def aliases(self, function, name):
+        # Every variable the value of name may be copied into, name included
+        names = {name}
+        changed = True
+        while changed:
+            changed = False
+            for instruction in function.instructions:
+                if instruction.op == "copy" and instruction.args[0] in names and instruction.dest not in names:
+                    names.add(instruction.dest)
+                    changed = True
+        return names
+
+    def escapes(self, function, name):
+        names = self.aliases(function, name)
+        if any(not function.is_local(alias) for alias in names):
+            return True
+        params = []
+        for instruction in function.instructions:
+            op, args = instruction.op, instruction.args
+            if op == "param":
+                params.append(args[0])
+            elif op in ["call", "callvirt"]:
+                count = instruction.args_count
+                arguments = params[len(params) - count:]
+                del params[len(params) - count:]
+                flags = self.param_escapes.get(instruction.target) if op == "call" else None
+                for position, argument in enumerate(arguments):
+                    if argument in names and (flags is None or flags[position]):
+                        return True
+            elif op == "return" and args and args[0] in names:
+                return True
+            elif op in ["setfield", "store"] and args[2] in names:
+                return True
+            elif op == "push" and args[1] in names:
+                return True
+        return False
+
+    def frame_allocations(self, function):
+        # Non-escaping allocations that also get one frame slot per site: when the site runs
+        # again, no variable may still hold the object it made the previous time
+        cfg = ControlFlowGraph(function.instructions)
+        cfg.compute_liveness()
+        result = []
+        for block in cfg.blocks:
+            live = set(block.live_out)
+            for instruction in reversed(block.instructions):
+                if instruction.op in ALLOCATIONS:
+                    self.stats["sites"] += 1
+                    names = self.aliases(function, instruction.dest)
+                    if not (live - {instruction.dest}) & names and not self.escapes(function, instruction.dest):
+                        result.append(instruction)
+                live = (live - set(instruction.defs())) | set(instruction.uses())
+        return result
@@ -0,0 +1,549 @@
+from ThreeAddressCode import is_temp, constant_value
+from ControlFlowGraph import ControlFlowGraph
+from MipsInstruction import Mem
+
+INVERTED_RELATIONS = {"<": ">=", ">=": "<", ">": "<=", "<=": ">", "==": "!=", "!=": "=="}
+SWAPPED_RELATIONS = {"<": ">", ">": "<", "<=": ">=", ">=": "<=", "==": "==", "!=": "!="}
+RELATIONS = set(INVERTED_RELATIONS)
+
+# TAC instructions whose result can be folded into the instruction that uses it
+FOLDABLE = {"binary", "unary", "load", "len"}
+# TAC instructions that may write array memory or global variables
+CLOBBERS_MEMORY = {"store", "push", "call"}
+
+
+def fits_signed(value):
+    return isinstance(value, int) and not isinstance(value, bool) and -32768 <= value <= 32767
+
+
+def fits_unsigned(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 65535
+
+
+def is_power_of_two(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 2 and value & (value - 1) == 0
+
+
+def is_two_powers(value):
+    # Constants with exactly two bits set, e.g. 10 = 8 + 2
+    return (isinstance(value, int) and not isinstance(value, bool) and value > 2
+            and not is_power_of_two(value) and bin(value).count("1") == 2)
+
+
+class Node:
+    # Expression tree node: "const", "name", "binary", "unary", "load" (array[index]) or "len"
+    def __init__(self, kind, kids=(), operator=None, value=None):
+        self.kind = kind
+        self.kids = list(kids)
+        self.operator = operator
+        self.value = value  # TAC text of a constant or variable name
+        self.costs = {}     # Nonterminal -> (cost, rule), filled in by labeling
+
+    def number(self):
+        # Integer value of a constant leaf, None for anything else
+        if self.kind != "const" or self.value.startswith('"'):
+            return None
+        value = constant_value(self.value)
+        if isinstance(value, bool):
+            return int(value)
+        return value if isinstance(value, int) else None
+
+    def __repr__(self):
+        if not self.kids:
+            return str(self.value)
+        return f"({self.operator or self.kind} {' '.join(repr(kid) for kid in self.kids)})"
+
+
+class Rule:
+    # nonterminal <- kind[operator](kid nonterminals); a "chain" rule converts the
+    # node's own kids[0] nonterminal into another one. Cost estimates cycles:
+    # one per instruction plus the latency of the multiply/divide unit.
+    def __init__(self, name, nonterminal, kind, operators, kids, cost, condition=None):
+        self.name = name
+        self.nonterminal = nonterminal
+        self.kind = kind
+        self.operators = operators
+        self.kids = kids
+        self.cost = cost
+        self.condition = condition
+
+    def __repr__(self):
+        return f"Rule({self.name})"
+
+
+def constant(condition):
+    return lambda selector, node: condition(node.number())
+
+
+def right_constant(condition):
+    return lambda selector, node: condition(node.kids[1].number())
+
+
+RULES = [
+    # Leaves
+    Rule("zero", "zero", "const", None, (), 0, constant(lambda value: value == 0)),
+    Rule("imm", "imm", "const", None, (), 0, constant(fits_signed)),
+    Rule("uimm", "uimm", "const", None, (), 0, constant(fits_unsigned)),
+    Rule("nimm", "nimm", "const", None, (), 0, constant(lambda value: value is not None and fits_signed(-value))),
+    Rule("imm_plus1", "imm_plus1", "const", None, (), 0,
+         constant(lambda value: value is not None and fits_signed(value + 1))),
+    Rule("pow2", "pow2", "const", None, (), 0, constant(is_power_of_two)),
+    Rule("two_powers", "two_powers", "const", None, (), 0, constant(is_two_powers)),
+    Rule("li", "reg", "const", None, (), 1),
+    Rule("local", "reg", "name", None, (), 0, lambda selector, node: not selector.generator.is_global(node.value)),
+    Rule("global", "reg", "name", None, (), 1, lambda selector, node: selector.generator.is_global(node.value)),
+
+    # Arithmetic
+    Rule("addu", "reg", "binary", {"+"}, ("reg", "reg"), 1),
+    Rule("addiu", "reg", "binary", {"+"}, ("reg", "imm"), 1),
+    Rule("addiu_left", "reg", "binary", {"+"}, ("imm", "reg"), 1),
+    Rule("subu", "reg", "binary", {"-"}, ("reg", "reg"), 1),
+    Rule("subiu", "reg", "binary", {"-"}, ("reg", "nimm"), 1),
+    Rule("mul", "reg", "binary", {"*"}, ("reg", "reg"), 4),
+    Rule("mul_pow2", "reg", "binary", {"*"}, ("reg", "pow2"), 1),
+    Rule("mul_pow2_left", "reg", "binary", {"*"}, ("pow2", "reg"), 1),
+    Rule("mul_two_powers", "reg", "binary", {"*"}, ("reg", "two_powers"), 3),
+    Rule("mul_two_powers_left", "reg", "binary", {"*"}, ("two_powers", "reg"), 3),
+    Rule("div", "reg", "binary", {"/"}, ("reg", "reg"), 36),
+    Rule("div_pow2", "reg", "binary", {"/"}, ("reg", "pow2"), 4),
+    Rule("rem", "reg", "binary", {"%"}, ("reg", "reg"), 36),
+    Rule("rem_pow2", "reg", "binary", {"%"}, ("reg", "pow2"), 6),
+    Rule("negu", "reg", "unary", {"-"}, ("reg",), 1),
+    Rule("not", "reg", "unary", {"!"}, ("reg",), 1),
+    Rule("and", "reg", "binary", {"&&"}, ("reg", "reg"), 1),
+    Rule("andi", "reg", "binary", {"&&"}, ("reg", "uimm"), 1),
+    Rule("or", "reg", "binary", {"||"}, ("reg", "reg"), 1),
+    Rule("ori", "reg", "binary", {"||"}, ("reg", "uimm"), 1),
+
+    # Comparisons producing 0/1
+    Rule("slt", "reg", "binary", {"<"}, ("reg", "reg"), 1),
+    Rule("slti", "reg", "binary", {"<"}, ("reg", "imm"), 1),
+    Rule("sgt", "reg", "binary", {">"}, ("reg", "reg"), 1),
+    Rule("sgt_imm", "reg", "binary", {">"}, ("reg", "imm_plus1"), 2),
+    Rule("sle", "reg", "binary", {"<="}, ("reg", "reg"), 2),
+    Rule("sle_imm", "reg", "binary", {"<="}, ("reg", "imm_plus1"), 1),
+    Rule("sge", "reg", "binary", {">="}, ("reg", "reg"), 2),
+    Rule("sge_imm", "reg", "binary", {">="}, ("reg", "imm"), 2),
+    Rule("seq", "reg", "binary", {"=="}, ("reg", "reg"), 2),
+    Rule("seq_imm", "reg", "binary", {"=="}, ("reg", "uimm"), 2),
+    Rule("seq_zero", "reg", "binary", {"=="}, ("reg", "zero"), 1),
+    Rule("sne", "reg", "binary", {"!="}, ("reg", "reg"), 2),
+    Rule("sne_imm", "reg", "binary", {"!="}, ("reg", "uimm"), 2),
+    Rule("sne_zero", "reg", "binary", {"!="}, ("reg", "zero"), 1),
+
+    # Arrays: an index becomes a (register, byte offset) pair added to the data pointer
+    Rule("index_const", "index", "const", None, (), 0,
+         constant(lambda value: value is not None and fits_signed(4 * value))),
+    Rule("index_offset", "index", "binary", {"+"}, ("reg", "imm"), 2,
+         right_constant(lambda value: fits_signed(4 * value))),
+    Rule("index_reg", "index", "chain", None, ("reg",), 2),
+    Rule("load_element", "reg", "load", None, ("reg", "index"), 2),
+    Rule("len", "reg", "len", None, ("reg",), 1),
+
+    # Compare and branch
+    Rule("beqz", "cond", "binary", {"=="}, ("reg", "zero"), 1),
+    Rule("bnez", "cond", "binary", {"!="}, ("reg", "zero"), 1),
+    Rule("bltz", "cond", "binary", {"<"}, ("reg", "zero"), 1),
+    Rule("bgez", "cond", "binary", {">="}, ("reg", "zero"), 1),
+    Rule("blez", "cond", "binary", {"<="}, ("reg", "zero"), 1),
+    Rule("bgtz", "cond", "binary", {">"}, ("reg", "zero"), 1),
+    Rule("beq", "cond", "binary", {"=="}, ("reg", "reg"), 1),
+    Rule("bne", "cond", "binary", {"!="}, ("reg", "reg"), 1),
+    Rule("blt", "cond", "binary", {"<"}, ("reg", "reg"), 2),
+    Rule("bge", "cond", "binary", {">="}, ("reg", "reg"), 2),
+    Rule("ble", "cond", "binary", {"<="}, ("reg", "reg"), 2),
+    Rule("bgt", "cond", "binary", {">"}, ("reg", "reg"), 2),
+    Rule("blt_imm", "cond", "binary", {"<"}, ("reg", "imm"), 2),
+    Rule("bge_imm", "cond", "binary", {">="}, ("reg", "imm"), 2),
+    Rule("ble_imm", "cond", "binary", {"<="}, ("reg", "imm_plus1"), 2),
+    Rule("bgt_imm", "cond", "binary", {">"}, ("reg", "imm_plus1"), 2),
+]
+
+# Rules the benchmark can switch off one group at a time, each group being one idea
+PATTERN_GROUPS = {
+    "immediates": ["addiu", "addiu_left", "subiu", "andi", "ori", "slti", "sgt_imm", "sle_imm", "sge_imm",
+                   "seq_imm", "sne_imm", "seq_zero", "sne_zero"],
+    "compare_branch": ["beqz", "bnez", "bltz", "bgez", "blez", "bgtz", "beq", "bne", "blt", "bge", "ble", "bgt",
+                       "blt_imm", "bge_imm", "ble_imm", "bgt_imm"],
+    "addressing": ["index_const", "index_offset"],
+    "strength_reduction": ["mul_pow2", "mul_pow2_left", "mul_two_powers", "mul_two_powers_left",
+                           "div_pow2", "rem_pow2"],
+}
+
+
+def foldable_temps(function):
+    # Temps defined once by a pure expression and used once later in the same basic block,
+    # with nothing in between that could change what the expression reads. Their trees are
+    # evaluated at the use instead, where the selector sees the whole expression.
+    instructions = function.instructions
+    definitions, uses = {}, {}
+    for index, instruction in enumerate(instructions):
+        for name in instruction.defs():
+            definitions.setdefault(name, []).append(index)
+        for name in instruction.uses():
+            uses.setdefault(name, []).append(index)
+
+    block_of = {}
+    for block in ControlFlowGraph(instructions).blocks:
+        for instruction in block.instructions:
+            block_of[id(instruction)] = block.index
+
+    foldable = set()
+    reads = {}  # Folded temp -> (names read by its tree, whether it reads memory)
+    for index, instruction in enumerate(instructions):
+        temp = instruction.dest
+        if instruction.op not in FOLDABLE or not is_temp(temp):
+            continue
+        if len(definitions.get(temp, [])) != 1 or len(uses.get(temp, [])) != 1:
+            continue
+        use = uses[temp][0]
+        if use <= index or block_of[id(instructions[use])] != block_of[id(instruction)]:
+            continue
+
+        names, memory = set(), instruction.op in ["load", "len"]
+        for arg in instruction.uses():
+            if arg in foldable:
+                names |= reads[arg][0]
+                memory = memory or reads[arg][1]
+            else:
+                names.add(arg)
+        reads_globals = any(not function.is_local(name) for name in names)
+
+        safe = True
+        for between in instructions[index + 1:use]:
+            if set(between.defs()) & names:
+                safe = False
+            elif memory and between.op in CLOBBERS_MEMORY:
+                safe = False
+            elif reads_globals and between.op == "call":
+                safe = False
+        if safe:
+            foldable.add(temp)
+            reads[temp] = (names, memory)
+    return foldable
+
+
+class TreeSelector:
+    # BURS-style instruction selection: label every tree node bottom-up with the cheapest
+    # rule for each nonterminal, then walk the chosen rules top-down emitting instructions.
+    def __init__(self, generator, disabled=()):
+        self.generator = generator
+        self.rules = {}
+        self.chains = []
+        for rule in RULES:
+            if rule.name in disabled:
+                continue
+            if rule.kind == "chain":
+                self.chains.append(rule)
+            else:
+                self.rules.setdefault(rule.kind, []).append(rule)
+
+    # ******************************
+    # *** Labeling               ***
+    # ******************************
+
+    def label(self, node):
+        for kid in node.kids:
+            self.label(kid)
+        node.costs = {}
+
+        for rule in self.rules.get(node.kind, []):
+            if rule.operators is not None and node.operator not in rule.operators:
+                continue
+            if len(rule.kids) != len(node.kids):
+                continue
+            if any(nonterminal not in kid.costs for kid, nonterminal in zip(node.kids, rule.kids)):
+                continue
+            if rule.condition is not None and not rule.condition(self, node):
+                continue
+            cost = rule.cost + sum(kid.costs[nonterminal][0] for kid, nonterminal in zip(node.kids, rule.kids))
+            self.record(node, rule, cost)
+
+        changed = True
+        while changed:
+            changed = False
+            for rule in self.chains:
+                if rule.kids[0] in node.costs:
+                    changed = self.record(node, rule, rule.cost + node.costs[rule.kids[0]][0]) or changed
+
+    def record(self, node, rule, cost):
+        best = node.costs.get(rule.nonterminal)
+        if best is None or cost < best[0]:
+            node.costs[rule.nonterminal] = (cost, rule)
+            return True
+        return False
+
+    def cost(self, node, nonterminal):
+        self.label(node)
+        return node.costs[nonterminal][0] if nonterminal in node.costs else None
+
+    # ******************************
+    # *** Reduction              ***
+    # ******************************
+
+    def reduce(self, node, nonterminal, target=None):
+        if nonterminal not in node.costs:
+            self.label(node)
+        _, rule = node.costs[nonterminal]
+        if rule.kind == "chain":
+            operands = [self.reduce(node, rule.kids[0])]
+        else:
+            operands = [self.reduce(kid, kid_nonterminal) for kid, kid_nonterminal in zip(node.kids, rule.kids)]
+        self.generator.selection_stats[rule.name] = self.generator.selection_stats.get(rule.name, 0) + 1
+
+        emitter = getattr(self, f"emit_{rule.name}", None)
+        result = emitter(node, operands, target) if emitter else None
+        if nonterminal == "reg" and target is not None and result != target:
+            self.emit("move", target, result)
+            result = target
+        return result
+
+    def register(self, node, target=None):
+        return self.reduce(node, "reg", target)
+
+    def branch(self, node, label):
+        # Jump to label when the relation node holds, through a 0/1 register if no cond rule applies
+        self.label(node)
+        if "cond" in node.costs:
+            self.reduce(node, "cond", label)
+        else:
+            self.emit("bnez", self.register(node), label)
+            self.generator.selection_stats["bnez"] = self.generator.selection_stats.get("bnez", 0) + 1
+
+    def emit(self, *args, **kwargs):
+        self.generator.emit(*args, **kwargs)
+
+    def new(self, target):
+        return target if target is not None else self.generator.new_vreg()
+
+    # Leaves
+    def emit_zero(self, node, operands, target):
+        return 0
+
+    def emit_imm(self, node, operands, target):
+        return node.number()
+
+    emit_uimm = emit_imm
+    emit_pow2 = emit_imm
+    emit_two_powers = emit_imm
+
+    def emit_nimm(self, node, operands, target):
+        return -node.number()
+
+    def emit_imm_plus1(self, node, operands, target):
+        return node.number() + 1
+
+    def emit_li(self, node, operands, target):
+        result = self.new(target)
+        if node.value.startswith('"'):
+            self.emit("la", result, self.generator.string_label(node.value))
+        else:
+            self.emit("li", result, self.generator.immediate(node.value))
+        return result
+
+    def emit_local(self, node, operands, target):
+        return f"%{node.value}"
+
+    def emit_global(self, node, operands, target):
+        result = self.new(target)
+        self.emit("lw", result, self.generator.global_label(node.value))
+        return result
+
+    # Arithmetic
+    def emit_addu(self, node, operands, target):
+        return self.instruction("addu", operands, target)
+
+    def emit_addiu(self, node, operands, target):
+        return self.instruction("addiu", operands, target)
+
+    def emit_addiu_left(self, node, operands, target):
+        return self.instruction("addiu", operands[::-1], target)
+
+    def emit_subu(self, node, operands, target):
+        return self.instruction("subu", operands, target)
+
+    emit_subiu = emit_addiu
+
+    def emit_mul(self, node, operands, target):
+        return self.instruction("mul", operands, target)
+
+    def emit_mul_pow2(self, node, operands, target):
+        return self.instruction("sll", [operands[0], operands[1].bit_length() - 1], target)
+
+    def emit_mul_pow2_left(self, node, operands, target):
+        return self.emit_mul_pow2(node, operands[::-1], target)
+
+    def emit_mul_two_powers(self, node, operands, target):
+        # x * (2^a + 2^b) = (x << a) + (x << b)
+        value, low = operands[1], operands[1] & -operands[1]
+        high_part = self.instruction("sll", [operands[0], (value - low).bit_length() - 1])
+        low_part = operands[0]
+        if low > 1:
+            low_part = self.instruction("sll", [operands[0], low.bit_length() - 1])
+        return self.instruction("addu", [high_part, low_part], target)
+
+    def emit_mul_two_powers_left(self, node, operands, target):
+        return self.emit_mul_two_powers(node, operands[::-1], target)
+
+    def emit_div(self, node, operands, target):
+        return self.instruction("div", operands, target)
+
+    def emit_rem(self, node, operands, target):
+        return self.instruction("rem", operands, target)
+
+    def rounded_dividend(self, value, shift):
+        # Add 2^shift - 1 to negative dividends so the arithmetic shift truncates toward zero
+        sign = self.instruction("sra", [value, 31])
+        bias = self.instruction("srl", [sign, 32 - shift])
+        return self.instruction("addu", [value, bias])
+
+    def emit_div_pow2(self, node, operands, target):
+        shift = operands[1].bit_length() - 1
+        return self.instruction("sra", [self.rounded_dividend(operands[0], shift), shift], target)
+
+    def emit_rem_pow2(self, node, operands, target):
+        # x % 2^k = x - (x / 2^k) * 2^k
+        shift = operands[1].bit_length() - 1
+        quotient = self.instruction("sra", [self.rounded_dividend(operands[0], shift), shift])
+        multiple = self.instruction("sll", [quotient, shift])
+        return self.instruction("subu", [operands[0], multiple], target)
+
+    def emit_negu(self, node, operands, target):
+        return self.instruction("subu", ["$zero", operands[0]], target)
+
+    def emit_not(self, node, operands, target):
+        return self.instruction("xori", [operands[0], 1], target)
+
+    def emit_and(self, node, operands, target):
+        return self.instruction("and", operands, target)
+
+    def emit_andi(self, node, operands, target):
+        return self.instruction("andi", operands, target)
+
+    def emit_or(self, node, operands, target):
+        return self.instruction("or", operands, target)
+
+    def emit_ori(self, node, operands, target):
+        return self.instruction("ori", operands, target)
+
+    # Comparisons
+    def emit_slt(self, node, operands, target):
+        return self.instruction("slt", operands, target)
+
+    def emit_slti(self, node, operands, target):
+        return self.instruction("slti", operands, target)
+
+    def emit_sgt(self, node, operands, target):
+        return self.instruction("slt", operands[::-1], target)
+
+    def emit_sgt_imm(self, node, operands, target):
+        # x > c  <=>  !(x < c + 1)
+        return self.instruction("xori", [self.instruction("slti", operands), 1], target)
+
+    emit_sle_imm = emit_slti
+
+    def emit_sle(self, node, operands, target):
+        return self.instruction("xori", [self.instruction("slt", operands[::-1]), 1], target)
+
+    def emit_sge(self, node, operands, target):
+        return self.instruction("xori", [self.instruction("slt", operands), 1], target)
+
+    def emit_sge_imm(self, node, operands, target):
+        return self.instruction("xori", [self.instruction("slti", operands), 1], target)
+
+    def emit_seq(self, node, operands, target):
+        return self.instruction("sltiu", [self.instruction("xor", operands), 1], target)
+
+    def emit_seq_imm(self, node, operands, target):
+        return self.instruction("sltiu", [self.instruction("xori", operands), 1], target)
+
+    def emit_seq_zero(self, node, operands, target):
+        return self.instruction("sltiu", [operands[0], 1], target)
+
+    def emit_sne(self, node, operands, target):
+        return self.instruction("sltu", ["$zero", self.instruction("xor", operands)], target)
+
+    def emit_sne_imm(self, node, operands, target):
+        return self.instruction("sltu", ["$zero", self.instruction("xori", operands)], target)
+
+    def emit_sne_zero(self, node, operands, target):
+        return self.instruction("sltu", ["$zero", operands[0]], target)
+
+    # Arrays
+    def emit_index_const(self, node, operands, target):
+        return None, 4 * node.number()
+
+    def emit_index_offset(self, node, operands, target):
+        return operands[0], 4 * operands[1]
+
+    def emit_index_reg(self, node, operands, target):
+        return operands[0], 0
+
+    def element(self, array, index):
+        # Memory operand of array[index]; the header's third word points to the elements
+        register, offset = index
+        data = self.instruction("lw", [Mem(8, array)])
+        if register is None:
+            return Mem(offset, data)
+        scaled = self.instruction("sll", [register, 2])
+        return Mem(offset, self.instruction("addu", [data, scaled]))
+
+    def emit_load_element(self, node, operands, target):
+        return self.instruction("lw", [self.element(*operands)], target)
+
+    def emit_len(self, node, operands, target):
+        return self.instruction("lw", [Mem(0, operands[0])], target)
+
+    # Branches: the target of a cond reduction is the label
+    def emit_beqz(self, node, operands, label):
+        self.emit("beqz", operands[0], label)
+
+    def emit_bnez(self, node, operands, label):
+        self.emit("bnez", operands[0], label)
+
+    def emit_bltz(self, node, operands, label):
+        self.emit("bltz", operands[0], label)
+
+    def emit_bgez(self, node, operands, label):
+        self.emit("bgez", operands[0], label)
+
+    def emit_blez(self, node, operands, label):
+        self.emit("blez", operands[0], label)
+
+    def emit_bgtz(self, node, operands, label):
+        self.emit("bgtz", operands[0], label)
+
+    def emit_beq(self, node, operands, label):
+        self.emit("beq", operands[0], operands[1], label)
+
+    def emit_bne(self, node, operands, label):
+        self.emit("bne", operands[0], operands[1], label)
+
+    def emit_blt(self, node, operands, label):
+        self.emit("blt", operands[0], operands[1], label)
+
+    def emit_bge(self, node, operands, label):
+        self.emit("bge", operands[0], operands[1], label)
+
+    def emit_ble(self, node, operands, label):
+        self.emit("ble", operands[0], operands[1], label)
+
+    def emit_bgt(self, node, operands, label):
+        self.emit("bgt", operands[0], operands[1], label)
+
+    def emit_blt_imm(self, node, operands, label):
+        self.emit("bnez", self.instruction("slti", operands), label)
+
+    def emit_bge_imm(self, node, operands, label):
+        self.emit("beqz", self.instruction("slti", operands), label)
+
+    def emit_ble_imm(self, node, operands, label):
+        self.emit("bnez", self.instruction("slti", operands), label)
+
+    def emit_bgt_imm(self, node, operands, label):
+        self.emit("beqz", self.instruction("slti", operands), label)
+
+    def instruction(self, op, operands, target=None):
+        result = self.new(target)
+        self.emit(op, result, *operands)
+        return result
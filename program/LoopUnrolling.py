@@ -0,0 +1,333 @@
+import re
+from CodeFragment import TacLine
+from ControlFlowGraph import ControlFlowGraph
+from ThreeAddressCode import parse_line, is_name, is_temp, INT_MIN, INT_MAX
+from BoundsCheck import split_functions
+
+# Loop unrolling over the visitor's TAC, ahead of instruction selection. A counted loop
+# tests "i < n" (or <=, >, >=) at its top and changes i only by a constant step right
+# before jumping back. When its trip count is known and the copies fit the code-size
+# budget, the loop becomes that many copies of its body, each with i as a constant. An
+# innermost loop without calls runs several copies per test instead, for as long as all
+# of them would pass it, and a copy of the original loop runs the iterations left over.
+# Bigger code costs instruction cache misses the first time it runs, so only hot loops
+# (inside another loop, in a function called from a loop, or with many known trips)
+# may grow; any other loop is only unrolled when the copies are no larger than it.
+
+INTEGER = re.compile(r"-?\d+")
+INVERSE = {"<": ">=", "<=": ">", ">": "<=", ">=": "<"}
+UNROLL_FACTOR = 4   # Copies per test in a partially unrolled loop
+UNROLL_BUDGET = 64  # MIPS instructions the copies of one hot loop may take
+MAX_FULL_TRIPS = 16
+HOT_TRIPS = 64      # A loop known to run this many times is hot wherever it is
+
+# Rough number of MIPS instructions a TAC instruction becomes, for the budget
+SIZES = {"label": 0, "print": 6, "call": 3, "callvirt": 5, "push": 3, "new": 3, "newarray": 4,
+         "load": 4, "store": 4}
+
+
+def tagged(text, like):
+    # text with the source line of the line it was made from
+    return TacLine(text, like.line) if isinstance(like, TacLine) else text
+
+
+class CountedLoop:
+    def __init__(self, header, first, last, counter, relation, limit, step):
+        self.header = header      # Header block
+        self.first = first        # Line index of the header label
+        self.last = last          # Line index of the jump back
+        self.counter = counter
+        self.relation = relation  # The loop goes on while counter relation limit
+        self.limit = limit
+        self.step = step          # Constant added to the counter every iteration
+        self.steps = []           # Line indices of the counter update
+        self.start = None         # Constant the counter starts at, when known
+        self.exit = None          # Label the test leaves through
+        self.calls = False
+        self.innermost = True
+        self.hot = False
+
+
+class LoopUnroller:
+    def __init__(self, code, symbol_table, factor=UNROLL_FACTOR, budget=UNROLL_BUDGET):
+        self.code = list(code)
+        self.symbol_table = symbol_table
+        self.factor = factor
+        self.budget = budget
+        text = "\n".join(self.code)
+        self.temp_count = max([int(number) for number in re.findall(r"\bt(\d+)\b", text)] + [0])
+        self.label_count = max([int(number) for number in re.findall(r"\bL(\d+)\b", text)] + [0])
+        self.done = set()  # Headers already tried, and every label made here
+        self.stats = {"full": 0, "partial": 0}
+
+    def size(self, indices):
+        return sum(SIZES.get(parse_line(self.code[index]).op, 1) for index in indices)
+
+    def new_temp(self):
+        self.temp_count += 1
+        return f"t{self.temp_count}"
+
+    def new_label(self):
+        self.label_count += 1
+        label = f"L{self.label_count}"
+        self.done.add(label)
+        return label
+
+    def run(self):
+        functions = split_functions(self.code)
+        self.globals = set()
+        for function in functions[1:]:
+            info = self.symbol_table.get(function.name, {})
+            own = set(info.get("params", {})) | set(info.get("locals", []))
+            for instruction in function.instructions:
+                self.globals |= {name for name in instruction.uses() + instruction.defs()
+                                 if not is_temp(name) and name not in own}
+        self.hot_functions = self.functions_called_in_loops(functions)
+        # A try's labels must stay where they are, so loops holding them are left alone
+        self.handler_labels = set()
+        for line in self.code:
+            instruction = parse_line(line)
+            if instruction.op == "handler":
+                self.handler_labels |= set(instruction.protected) | {instruction.target}
+
+        while self.unroll_one():
+            pass
+        return self.code
+
+    def unroll_one(self):
+        # Unrolls the first loop that qualifies, innermost loops first
+        for function in split_functions(self.code):
+            cfg = ControlFlowGraph(function.instructions)
+            for header, body in sorted(cfg.loops, key=lambda loop: len(loop[1])):
+                label = header.label()
+                if label is None or label in self.done:
+                    continue
+                self.done.add(label)
+                loop = self.match(function, cfg, header, body)
+                if loop is not None and self.unroll(function, cfg, loop):
+                    return True
+        return False
+
+    def functions_called_in_loops(self, functions):
+        # Functions called from inside a loop, and everything they call
+        hot, calls = set(), {}
+        for function in functions:
+            cfg = ControlFlowGraph(function.instructions)
+            for block in cfg.blocks:
+                for instruction in block.instructions:
+                    if instruction.op == "call":
+                        calls.setdefault(function.name, set()).add(instruction.target)
+                        if block.loop_depth:
+                            hot.add(instruction.target)
+        pending = list(hot)
+        while pending:
+            for callee in calls.get(pending.pop(), set()) - hot:
+                hot.add(callee)
+                pending.append(callee)
+        return hot
+
+    def is_global(self, function, name):
+        if function.name is None:
+            return name in self.globals
+        info = self.symbol_table.get(function.name, {})
+        return not is_temp(name) and name not in info.get("params", {}) and name not in info.get("locals", [])
+
+    # ******************************
+    # *** Matching               ***
+    # ******************************
+
+    def match(self, function, cfg, header, body):
+        # The loop as a CountedLoop, or None when it is not one the unroller can copy
+        indices = sorted(body)
+        latch = cfg.blocks[indices[-1]]
+        if indices != list(range(header.index, latch.index + 1)):
+            return None
+        inside = [block for block in header.predecessors if block.index in body]
+        outside = [block for block in header.predecessors if block.index not in body]
+        back = latch.instructions[-1]
+        if inside != [latch] or len(outside) != 1 or back.op != "goto" or back.target != header.label():
+            return None
+
+        # Nothing from other functions, classes or tries in between
+        position = {id(instruction): index for index, instruction in enumerate(function.instructions)}
+        loop = [instruction for index in indices for instruction in cfg.blocks[index].instructions]
+        first = function.lines[position[id(loop[0])]]
+        last = function.lines[position[id(back)]]
+        if last - first + 1 != len(loop) or any(instruction.label_name() in self.handler_labels
+                                                 or instruction.op == "caught" for instruction in loop):
+            return None
+
+        test = header.instructions[1:]
+        if (len(test) == 2 and test[0].op == "binary" and test[0].operator in INVERSE
+                and test[1].op == "iffalse" and test[1].args == [test[0].dest]):
+            counter, limit = test[0].args
+            relation = test[0].operator
+        elif len(test) == 1 and test[0].op == "ifrel" and test[0].operator in INVERSE:
+            counter, limit = test[0].args
+            relation = INVERSE[test[0].operator]
+        else:
+            return None
+        labels = {block.label(): block for block in cfg.blocks if block.label() is not None}
+        exit_block = labels.get(test[-1].target)
+        if exit_block is None or exit_block.index in body or not is_name(counter):
+            return None
+
+        step = self.counter_step(function, latch, counter, loop, position)
+        if step is None:
+            return None
+        amount, steps = step
+        if amount == 0 or (amount > 0) != (relation in ["<", "<="]):
+            return None
+        defined = {name for instruction in loop for name in instruction.defs()}
+        if not INTEGER.fullmatch(limit) and (not is_name(limit) or limit in defined):
+            return None
+
+        counted = CountedLoop(header, first, last, counter, relation, limit, amount)
+        counted.steps = [function.lines[position[id(instruction)]] for instruction in steps]
+        counted.exit = test[-1].target
+        # A call may change any global the loop relies on
+        counted.calls = any(instruction.op in ["call", "callvirt"] for instruction in loop)
+        if counted.calls and any(self.is_global(function, name) for name in [counter, limit] if is_name(name)):
+            return None
+        counted.innermost = not any(other.index != header.index and other.index in body for other, _ in cfg.loops)
+        counted.hot = header.loop_depth > 1 or function.name in self.hot_functions
+        initial = None
+        for instruction in outside[0].instructions:
+            if counter in instruction.defs():
+                initial = instruction
+        if initial is not None and initial.op == "copy" and INTEGER.fullmatch(initial.args[0]):
+            counted.start = int(initial.args[0])
+        return counted
+
+    def counter_step(self, function, latch, counter, loop, position):
+        # (constant, instructions) of "counter = counter + c", or of "t = counter + c"
+        # followed by "counter = t", as the only update of counter, right before the jump back
+        definitions = [instruction for instruction in loop if counter in instruction.defs()]
+        tail = latch.instructions
+        if len(definitions) != 1 or len(tail) < 2 or tail[-2] is not definitions[0]:
+            return None
+        steps = [definitions[0]]
+        step = definitions[0]
+        if step.op == "copy" and is_temp(step.args[0]) and len(tail) > 2 and tail[-3].dest == step.args[0]:
+            step = tail[-3]
+            uses = sum(instruction.uses().count(step.dest) for instruction in function.instructions)
+            if uses != 1:
+                return None
+            steps.insert(0, step)
+        if not (step.op == "binary" and step.operator in ["+", "-"] and step.args[0] == counter
+                and INTEGER.fullmatch(step.args[1])):
+            return None
+        amount = int(step.args[1])
+        return (amount if step.operator == "+" else -amount), steps
+
+    def trip_count(self, loop):
+        if loop.start is None or not INTEGER.fullmatch(loop.limit):
+            return None
+        distance = int(loop.limit) - loop.start
+        step = loop.step
+        if loop.relation in [">", ">="]:
+            distance, step = -distance, -step
+        if loop.relation in ["<=", ">="]:
+            distance += 1
+        trips = max(0, -(-distance // step))
+        # A counter that leaves 32 bits wraps around and keeps the loop going
+        if not INT_MIN <= loop.start + trips * loop.step <= INT_MAX:
+            return None
+        return trips
+
+    # ******************************
+    # *** Rewriting              ***
+    # ******************************
+
+    def unroll(self, function, cfg, loop):
+        body = range(loop.first + len(loop.header.instructions), loop.last)
+        span = set(range(loop.first, loop.last + 1))
+        outside = [function.instructions[offset] for offset, index in enumerate(function.lines) if index not in span]
+        referenced = {name for instruction in outside for name in instruction.uses() + instruction.defs()}
+        temps = {name for index in span for name in parse_line(self.code[index]).defs()
+                 if is_temp(name) and name not in referenced}
+
+        trips = self.trip_count(loop)
+        hot = loop.hot or (trips is not None and trips >= HOT_TRIPS)
+        budget = self.budget if hot else self.size(span)
+        kept = [index for index in body if index not in loop.steps]
+        if trips is not None and trips <= MAX_FULL_TRIPS and trips * self.size(kept) <= budget:
+            cfg.compute_liveness()
+            labels = {block.label(): block for block in cfg.blocks}
+            keep = loop.counter in labels[loop.exit].live_in or self.is_global(function, loop.counter)
+            lines = [self.code[loop.first]]
+            for trip in range(trips):
+                value = loop.start + trip * loop.step
+                lines += self.copy(kept, temps, {loop.counter: str(value)})
+                if keep:
+                    lines.append(tagged(f"{loop.counter} = {value + loop.step}", self.code[loop.steps[-1]]))
+            following = parse_line(self.code[loop.last + 1]) if loop.last + 1 < len(self.code) else None
+            if following is None or following.label_name() != loop.exit:
+                lines.append(tagged(f"goto {loop.exit}", self.code[loop.last]))
+            self.code[loop.first:loop.last + 1] = lines
+            self.stats["full"] += 1
+            return True
+
+        factor = min(self.factor, self.budget // max(self.size(body), 1))
+        if not hot or not loop.innermost or loop.calls or factor < 2 or (trips is not None and trips < factor):
+            return False
+        # The copies are entered from right before the loop, which has to fall into it
+        preheader = cfg.blocks[loop.header.index - 1]
+        last = preheader.instructions[-1] if preheader.instructions else None
+        if (loop.header.index == 0 or loop.header not in preheader.successors or last is None
+                or not last.falls_through() or loop.header.label() in last.jump_targets()):
+            return False
+        reach = loop.step * (factor - 1)
+        lines = []
+        # No counter value leaves room for every copy when limit - reach is past 32 bits
+        if INTEGER.fullmatch(loop.limit):
+            if not INT_MIN <= int(loop.limit) - reach <= INT_MAX:
+                return False
+            bound = str(int(loop.limit) - reach)
+        else:
+            # The last counter value that still leaves room for every copy, computed only
+            # when it does not wrap around
+            if reach > 0:
+                lines.append(tagged(f"if {loop.limit} < {INT_MIN + reach} goto {loop.header.label()}",
+                                    self.code[loop.first + 1]))
+            else:
+                lines.append(tagged(f"if {loop.limit} > {INT_MAX + reach} goto {loop.header.label()}",
+                                    self.code[loop.first + 1]))
+            bound = self.new_temp()
+            operator = "-" if reach > 0 else "+"
+            lines.append(tagged(f"{bound} = {loop.limit} {operator} {abs(reach)}", self.code[loop.first]))
+
+        # A guard before the loop jumps to the copies, which test again at their bottom and
+        # go back to the original loop for the iterations left over. A loop too short for
+        # one round of copies only pays for the guard.
+        copies = self.new_label()
+        test = tagged(f"if {loop.counter} {loop.relation} {bound} goto {copies}", self.code[loop.first + 1])
+        lines += [test] + self.code[loop.first:loop.last + 1] + [tagged(f"{copies}:", self.code[loop.first])]
+        for _ in range(factor):
+            lines += self.copy(body, temps)
+        lines += [test, self.code[loop.last]]
+        self.code[loop.first:loop.last + 1] = lines
+        self.stats["partial"] += 1
+        return True
+
+    def copy(self, indices, temps, constants=None):
+        # The lines at indices with fresh labels and temps, and constants for some names
+        names = dict(constants or {})
+        for index in indices:
+            instruction = parse_line(self.code[index])
+            if instruction.op == "label":
+                names[instruction.target] = self.new_label()
+            for temp in instruction.defs():
+                if temp in temps and temp not in names:
+                    names[temp] = self.new_temp()
+
+        lines = []
+        for index in indices:
+            instruction = parse_line(self.code[index])
+            if instruction.op == "label" or instruction.jump_targets():
+                instruction.target = names.get(instruction.target, instruction.target)
+            if instruction.dest is not None:
+                instruction.dest = names.get(instruction.dest, instruction.dest)
+            instruction.args = [names.get(arg, arg) for arg in instruction.args]
+            lines.append(tagged(str(instruction), self.code[index]))
+        return lines
@@ -0,0 +1,613 @@
+from ThreeAddressCode import TACProgram, is_constant, constant_value
+from MipsInstruction import MipsInstruction, Mem, CALLER_SAVED, CALLEE_SAVED, ARGUMENT_REGISTERS
+from RegisterAllocator import ALLOCATORS
+from EscapeAnalysis import EscapeAnalysis
+from StrengthReduction import StrengthReduction
+from LoopUnrolling import LoopUnroller, UNROLL_FACTOR, UNROLL_BUDGET
+from CodeFragment import TacLine
+from Peephole import optimize, fill_delay_slots, CONTROL_TRANSFERS
+from InstructionSelector import (TreeSelector, Node, foldable_temps, PATTERN_GROUPS, RELATIONS,
+                                 INVERTED_RELATIONS, SWAPPED_RELATIONS)
+
+PRINT_SYSCALLS = {"integer": 1, "string": 4}
+
+MAX_FRAME_OBJECT = 64  # Largest object or array, in words, placed in a frame instead of the heap
+
+# Runtime support routines. They only touch caller-saved registers, so calling them
+# with jal has exactly the same effect on allocation as calling a user function.
+# Arrays are a 3-word header [length, capacity, data pointer] followed by the initial
+# buffer, sized by __array_new's argument; pushes past it move to a buffer twice as big.
+# __array_copy builds a constant literal from its .word table in the data segment;
+# __array_fill does the same into space the caller provides in $a2, such as its frame.
+# Objects are [vtable address, field 1, ...]; __object_new allocates one with its vtable set.
+RUNTIME = {
+    "__array_new": """__array_new:
+    move $t0, $a0
+    sll $a0, $a0, 2
+    addiu $a0, $a0, 12
+    li $v0, 9
+    syscall
+    sw $zero, 0($v0)
+    sw $t0, 4($v0)
+    addiu $t1, $v0, 12
+    sw $t1, 8($v0)
+    jr $ra""",
+    "__array_copy": """__array_copy:
+    move $t0, $a0
+    sll $a0, $a1, 2
+    addiu $a0, $a0, 12
+    li $v0, 9
+    syscall
+    move $a0, $t0
+    move $a2, $v0
+__array_fill:
+    sw $a1, 0($a2)
+    sw $a1, 4($a2)
+    addiu $t1, $a2, 12
+    sw $t1, 8($a2)
+    li $t2, 0
+__array_copy_loop:
+    beq $t2, $a1, __array_copy_done
+    lw $t3, 0($a0)
+    sw $t3, 0($t1)
+    addiu $a0, $a0, 4
+    addiu $t1, $t1, 4
+    addiu $t2, $t2, 1
+    j __array_copy_loop
+__array_copy_done:
+    move $v0, $a2
+    jr $ra""",
+    "__array_push": """__array_push:
+    lw $t0, 0($a0)
+    lw $t1, 4($a0)
+    bne $t0, $t1, __array_push_store
+    sll $t2, $t1, 1
+    bnez $t2, __array_push_grow
+    li $t2, 4
+__array_push_grow:
+    move $t3, $a0
+    sll $a0, $t2, 2
+    li $v0, 9
+    syscall
+    lw $t4, 8($t3)
+    li $t5, 0
+__array_push_copy:
+    beq $t5, $t0, __array_push_copied
+    sll $t6, $t5, 2
+    addu $t7, $t4, $t6
+    lw $t8, 0($t7)
+    addu $t7, $v0, $t6
+    sw $t8, 0($t7)
+    addiu $t5, $t5, 1
+    j __array_push_copy
+__array_push_copied:
+    sw $v0, 8($t3)
+    sw $t2, 4($t3)
+    move $a0, $t3
+__array_push_store:
+    lw $t4, 8($a0)
+    sll $t6, $t0, 2
+    addu $t7, $t4, $t6
+    sw $a1, 0($t7)
+    addiu $t0, $t0, 1
+    sw $t0, 0($a0)
+    jr $ra""",
+    "__object_new": """__object_new:
+    li $v0, 9
+    syscall
+    sw $a1, 0($v0)
+    jr $ra""",
+    "__print_bool": """__print_bool:
+    bnez $a0, __print_bool_true
+    la $a0, __str_false
+    j __print_bool_out
+__print_bool_true:
+    la $a0, __str_true
+__print_bool_out:
+    li $v0, 4
+    syscall
+    jr $ra""",
+}
+RUNTIME_DATA = {
+    "__print_bool": ['__str_true: .asciiz "true"', '__str_false: .asciiz "false"'],
+}
+
+
+def asciiz(literal):
+    # A Compiscript string has no escapes, so a backslash is printed as is; the UTF-8 bytes
+    # of non-ASCII text are written as \xNN escapes
+    escaped = []
+    for byte in literal[1:-1].encode("utf-8"):
+        char = chr(byte)
+        escaped.append("\\\\" if char == "\\" else char if 32 <= byte < 127 else f"\\x{byte:02x}")
+    return '"' + "".join(escaped) + '"'
+
+
+class Frame:
+    # Activation record, addressed from $fp (the caller's $sp at the call):
+    #   0($fp), 4($fp), ...   incoming stack arguments (the fifth one onwards)
+    #   -4($fp)               saved $ra
+    #   -8($fp)               saved caller $fp
+    #   below                 objects that do not escape, spill slots, then saved
+    #                         callee-saved registers
+    # Leaf functions that need none of this get no frame at all.
+    def __init__(self, name):
+        self.name = name
+        self.object_words = 0  # Fixed during selection, before any spill slot exists
+        self.spill_slots = 0
+        self.saved_registers = []
+        self.stack_arguments = 0
+        self.leaf = False
+
+    def allocate_object(self, words):
+        # Offset from $fp of a new object area
+        self.object_words += words
+        return -8 - 4 * self.object_words
+
+    def allocate_spill_slot(self):
+        self.spill_slots += 1
+        return Mem(-8 - 4 * (self.object_words + self.spill_slots), "$fp")
+
+    def saved_register_slot(self, index):
+        return Mem(-8 - 4 * (self.object_words + self.spill_slots + index + 1), "$fp")
+
+    def is_empty(self):
+        return (self.leaf and not self.object_words and not self.spill_slots and not self.saved_registers
+                and not self.stack_arguments)
+
+    def size(self):
+        size = 8 + 4 * (self.object_words + self.spill_slots + len(self.saved_registers))
+        return (size + 7) // 8 * 8
+
+
+class MipsGenerator:
+    def __init__(self, code, symbol_table, regalloc="graph", disabled_patterns=(), peephole=True,
+                 delay_slots=False, source_lines=None, strength_reduction=True,
+                 unroll_factor=UNROLL_FACTOR, unroll_budget=UNROLL_BUDGET):
+        # disabled_patterns names PATTERN_GROUPS to leave out, plus "trees" to select
+        # every TAC instruction on its own instead of folding single-use temps.
+        # delay_slots targets a machine that runs the instruction after every branch or jump.
+        # source_lines (the visitor's) adds "# line N" comments that the simulator maps back.
+        # unroll_budget caps the instructions the copies of an unrolled loop take; 0 unrolls nothing.
+        self.unroll_stats = {"full": 0, "partial": 0}  # Loops replaced by copies, loops unrolled by a factor
+        if unroll_budget:
+            code, source_lines = self.unroll(code, symbol_table, source_lines, unroll_factor, unroll_budget)
+        self.program = TACProgram(code, symbol_table, source_lines)
+        self.escape = EscapeAnalysis(self.program)
+        self.allocation_stats = {"sites": 0, "frame": 0}  # Allocations placed in a frame
+        self.allocator = ALLOCATORS[regalloc]
+        self.peephole = peephole
+        self.strength_reduction = strength_reduction
+        self.reduction_stats = {"pointers": 0, "tests": 0}  # Addresses turned into pointers, tests rewritten
+        self.delay_slots = delay_slots
+        self.fold_trees = "trees" not in disabled_patterns
+        self.selector = TreeSelector(self, [rule for group in disabled_patterns
+                                            for rule in PATTERN_GROUPS.get(group, [])])
+        self.errors = []
+        self.unsupported_catches = set()  # Functions already reported for a try/catch
+        self.stats = {}  # Register allocation statistics per function
+        self.selection_stats = {}  # Times each selection rule was used
+        self.peephole_stats = {}   # Times each peephole rule fired, plus delay slots filled/nop
+        self.arrays = {}  # Constant array literal -> data label
+        self.runtime = set()
+
+    def unroll(self, code, symbol_table, source_lines, factor, budget):
+        # Unrolled TAC and its source lines
+        lines = [TacLine(text, source_lines[index] if source_lines else None)
+                 for index, text in enumerate(code.splitlines()) if text.strip()]
+        unroller = LoopUnroller(lines, symbol_table, factor, budget)
+        lines = unroller.run()
+        self.unroll_stats = unroller.stats
+        return "\n".join(lines), [line.line for line in lines] if source_lines else None
+
+    def add_error(self, message):
+        self.errors.append(f"MIPS error in '{self.function.name}': {message}")
+
+    def generate(self):
+        text = [".text", ".globl main"]
+        for function in self.program.all_functions():
+            text += self.listing(self.compile_function(function))
+            text.append("")
+
+        if self.runtime:
+            text.append("# runtime")  # Ends the "# line N" attribution of the last function
+        for name in sorted(self.runtime):
+            text += self.runtime_lines(name) + [""]
+
+        data = [".data"]
+        data += [f"{self.global_label(name)}: .word 0" for name in sorted(self.program.globals)]
+        data += [f"{label}: .asciiz {asciiz(literal)}" for literal, label in self.program.strings.items()]
+        for values, label in self.arrays.items():
+            rows = [values[start:start + 16] for start in range(0, len(values), 16)]
+            data += [f"{label}: .word {', '.join(rows[0])}"] + [f"    .word {', '.join(row)}" for row in rows[1:]]
+        for name, (_, vtable) in self.program.classes.items():
+            if vtable:
+                data.append(f"{self.vtable_label(name)}: .word {', '.join(vtable)}")
+        for name in sorted(self.runtime):
+            data += RUNTIME_DATA.get(name, [])
+
+        return "\n".join(data + [""] + text)
+
+    def listing(self, code):
+        # Assembly text of a function, with a "# line N" comment wherever the source line changes
+        lines, current = [], None
+        for instruction in code:
+            if instruction.line is not None and instruction.line != current and instruction.op != "label":
+                current = instruction.line
+                lines.append(f"    # line {current}")
+            lines.append(str(instruction))
+        return lines
+
+    def runtime_lines(self, name):
+        # The hand-written routines leave their delay slots empty
+        lines = []
+        for line in RUNTIME[name].splitlines():
+            lines.append(line)
+            words = line.split()
+            if self.delay_slots and words and words[0] in CONTROL_TRANSFERS:
+                lines.append("    nop")
+        return lines
+
+    def compile_function(self, function):
+        frame = Frame(function.name)
+        self.frame = frame
+        body = self.select(function)
+        if self.strength_reduction:
+            reduction = StrengthReduction(body, self.new_vreg)
+            body = reduction.run()
+            for key, count in reduction.stats.items():
+                self.reduction_stats[key] += count
+
+        allocator = self.allocator(body, frame)
+        body, _ = allocator.allocate()
+        self.stats[function.name] = allocator.stats
+
+        frame.saved_registers = sorted({register for instruction in body
+                                        for register in instruction.registers() if register in CALLEE_SAVED})
+        if function is self.program.main:
+            frame.saved_registers = []  # main never returns to a caller
+        frame.stack_arguments = max(0, len(function.params) - len(ARGUMENT_REGISTERS))
+        # main never returns, so it only needs a frame for spill slots
+        frame.leaf = function is self.program.main or all(instruction.op not in ["jal", "jalr"] for instruction in body)
+
+        stats = allocator.stats
+        header = MipsInstruction("label", function.name,
+                                 comment=f"{stats['spilled']} spilled, {stats['rematerialized']} rematerialized, "
+                                         f"{stats['coalesced']} moves coalesced")
+        prologue, epilogue = self.prologue(function, frame), self.epilogue(function, frame)
+        for instruction in prologue + epilogue:
+            instruction.line = function.line  # Frame code is charged to the declaration
+        code = [header] + prologue + body + epilogue
+        if self.peephole:
+            code = optimize(code, self.peephole_stats)
+        if self.delay_slots:
+            code = fill_delay_slots(code, self.peephole_stats)
+        return code
+
+    def prologue(self, function, frame):
+        if frame.is_empty():
+            return []
+
+        code = []
+        if function is not self.program.main:
+            code.append(MipsInstruction("sw", "$ra", Mem(-4, "$sp")))
+            code.append(MipsInstruction("sw", "$fp", Mem(-8, "$sp")))
+        code.append(MipsInstruction("move", "$fp", "$sp"))
+        code.append(MipsInstruction("addiu", "$sp", "$sp", -frame.size()))
+        for i, register in enumerate(frame.saved_registers):
+            code.append(MipsInstruction("sw", register, frame.saved_register_slot(i)))
+        return code
+
+    def epilogue(self, function, frame):
+        if function is self.program.main:
+            return [MipsInstruction("li", "$v0", 10), MipsInstruction("syscall")]
+        if frame.is_empty():
+            return [MipsInstruction("jr", "$ra", extra_uses=["$v0"])]
+
+        code = []
+        for i, register in enumerate(frame.saved_registers):
+            code.append(MipsInstruction("lw", register, frame.saved_register_slot(i)))
+        code.append(MipsInstruction("lw", "$ra", Mem(-4, "$fp")))
+        code.append(MipsInstruction("move", "$sp", "$fp"))
+        code.append(MipsInstruction("lw", "$fp", Mem(-8, "$sp")))
+        code.append(MipsInstruction("jr", "$ra", extra_uses=["$v0"]))
+        return code
+
+    # ******************************
+    # *** Instruction selection  ***
+    # ******************************
+
+    def new_vreg(self):
+        self.vreg_count += 1
+        # Digits only, so they never collide with %name registers of source variables
+        return f"%{self.vreg_count}"
+
+    def emit(self, op, *operands, **kwargs):
+        self.code.append(MipsInstruction(op, *operands, **kwargs))
+
+    def global_label(self, name):
+        return f"var_{name}"
+
+    def epilogue_label(self):
+        return f"{self.function.name}_epilogue"
+
+    def is_global(self, name):
+        return not self.function.is_local(name)
+
+    def string_label(self, literal):
+        return self.program.strings[literal]
+
+    def vtable_label(self, name):
+        return f"vtable_{name}"
+
+    def array_label(self, instruction):
+        # Identical literals share one table
+        values = tuple(str(self.immediate(value)) for value in instruction.args)
+        if values not in self.arrays:
+            self.arrays[values] = f"array_{len(self.arrays) + 1}"
+        return self.arrays[values]
+
+    def node(self, operand):
+        # Expression tree for a TAC operand: the folded tree of a temp, or a leaf
+        if operand in self.trees:
+            return self.trees.pop(operand)
+        return Node("const" if is_constant(operand) else "name", value=operand)
+
+    def expression(self, instruction):
+        # Expression tree computed by a binary, unary, load or len instruction
+        kids = [self.node(arg) for arg in instruction.args]
+        if instruction.op in ["binary", "unary"]:
+            return Node(instruction.op, kids, operator=instruction.operator)
+        return Node(instruction.op, kids)
+
+    def value(self, operand):
+        # Register holding the value of a TAC operand
+        return self.selector.register(self.node(operand))
+
+    def immediate(self, operand):
+        value = constant_value(operand)
+        if isinstance(value, float):
+            self.add_error(f"float value {operand} is not supported by the MIPS backend")
+            return 0
+        return int(value or 0)
+
+    def destination(self, name):
+        return self.new_vreg() if self.is_global(name) else f"%{name}"
+
+    def assign(self, name, register):
+        # Write a computed register back to a global variable
+        if self.is_global(name):
+            self.emit("sw", register, self.global_label(name))
+
+    def call(self, label, argument_registers=(), result=None):
+        # label is a function, or a register holding its address for calls through a vtable
+        op = "jalr" if label.startswith("%") else "jal"
+        self.emit(op, label, extra_uses=list(argument_registers), extra_defs=CALLER_SAVED)
+        if result is not None:
+            self.emit("move", result, "$v0")
+
+    def select(self, function):
+        self.function = function
+        self.code = []
+        self.vreg_count = 0
+        self.pending_params = []
+        self.trees = {}
+        self.foldable = foldable_temps(function) if self.fold_trees else set()
+
+        # The first arguments arrive in $a0-$a3, the rest were pushed by the caller right above our frame
+        for i, param in enumerate(function.params):
+            if i < len(ARGUMENT_REGISTERS):
+                self.emit("move", f"%{param}", ARGUMENT_REGISTERS[i])
+            else:
+                self.emit("lw", f"%{param}", Mem(4 * (i - len(ARGUMENT_REGISTERS)), "$fp"))
+
+        for instruction in function.instructions:
+            start = len(self.code)
+            handler = getattr(self, f"select_{instruction.op}")
+            handler(instruction)
+            for selected in self.code[start:]:
+                selected.line = instruction.line
+
+        if function is not self.program.main:
+            self.emit("label", self.epilogue_label())
+        return self.code
+
+    def select_label(self, instruction):
+        self.emit("label", instruction.target)
+
+    def select_goto(self, instruction):
+        self.emit("j", instruction.target)
+
+    def branch(self, condition, relation, label):
+        # Branch to label when "condition relation 0" holds, fusing it with a comparison tree
+        if condition.kind == "binary" and condition.operator in RELATIONS:
+            operator = condition.operator if relation == "!=" else INVERTED_RELATIONS[condition.operator]
+            self.branch_relation(operator, condition.kids, label)
+        else:
+            self.branch_relation(relation, [condition, Node("const", value="0")], label)
+
+    def branch_relation(self, operator, kids, label):
+        left, right = kids
+        if left.kind == "const" and right.kind != "const":
+            operator, left, right = SWAPPED_RELATIONS[operator], right, left
+        self.selector.branch(Node("binary", [left, right], operator=operator), label)
+
+    def select_iffalse(self, instruction):
+        self.branch(self.node(instruction.args[0]), "==", instruction.target)
+
+    def select_iftrue(self, instruction):
+        self.branch(self.node(instruction.args[0]), "!=", instruction.target)
+
+    def select_ifrel(self, instruction):
+        kids = [self.node(arg) for arg in instruction.args]
+        self.branch_relation(instruction.operator, kids, instruction.target)
+
+    def select_copy(self, instruction):
+        self.compute(instruction.dest, self.node(instruction.args[0]))
+
+    def select_binary(self, instruction):
+        self.compute(instruction.dest, self.expression(instruction))
+
+    select_unary = select_binary
+    select_load = select_binary
+    select_len = select_binary
+
+    def compute(self, dest, tree):
+        # Defer folded temps to their single use, evaluate everything else into dest
+        if dest in self.foldable:
+            self.trees[dest] = tree
+            return
+        target = self.destination(dest)
+        self.selector.register(tree, target)
+        self.assign(dest, target)
+
+    def frame_object(self, instruction, words):
+        # Frame offset for an allocation that does not escape and is small enough, or None
+        self.allocation_stats["sites"] += 1
+        if not self.escape.is_local(instruction) or words > MAX_FRAME_OBJECT:
+            return None
+        self.allocation_stats["frame"] += 1
+        return self.frame.allocate_object(words)
+
+    def select_newarray(self, instruction):
+        # Header and room for the elements the literal pushes come from one allocation
+        target = self.destination(instruction.dest)
+        capacity = int(instruction.args[0])
+        offset = self.frame_object(instruction, 3 + capacity)
+        if offset is not None:
+            self.emit("addiu", target, "$fp", offset)
+            self.emit("sw", "$zero", Mem(0, target))
+            room, data = self.new_vreg(), self.new_vreg()
+            self.emit("li", room, capacity)
+            self.emit("sw", room, Mem(4, target))
+            self.emit("addiu", data, target, 12)
+            self.emit("sw", data, Mem(8, target))
+        else:
+            self.runtime.add("__array_new")
+            self.emit("li", "$a0", capacity)
+            self.call("__array_new", ["$a0"], result=target)
+        self.assign(instruction.dest, target)
+
+    def select_constarray(self, instruction):
+        # The elements are copied from the literal's table, so stores never change it
+        self.runtime.add("__array_copy")
+        target = self.destination(instruction.dest)
+        offset = self.frame_object(instruction, 3 + len(instruction.args))
+        self.emit("la", "$a0", self.array_label(instruction))
+        self.emit("li", "$a1", len(instruction.args))
+        if offset is not None:
+            self.emit("addiu", "$a2", "$fp", offset)
+            self.call("__array_fill", ["$a0", "$a1", "$a2"], result=target)
+        else:
+            self.call("__array_copy", ["$a0", "$a1"], result=target)
+        self.assign(instruction.dest, target)
+
+    def select_push(self, instruction):
+        self.runtime.add("__array_push")
+        array, value = (self.value(arg) for arg in instruction.args)
+        self.emit("move", "$a0", array)
+        self.emit("move", "$a1", value)
+        self.call("__array_push", ["$a0", "$a1"])
+
+    def select_store(self, instruction):
+        array, index, value = (self.node(arg) for arg in instruction.args)
+        self.selector.label(index)
+        address = self.selector.element(self.selector.register(array), self.selector.reduce(index, "index"))
+        self.emit("sw", self.selector.register(value), address)
+
+    def select_param(self, instruction):
+        self.pending_params.append(self.value(instruction.args[0]))
+
+    def select_new(self, instruction):
+        size, vtable = self.program.classes[instruction.target]
+        target = self.destination(instruction.dest)
+        offset = self.frame_object(instruction, size)
+        if offset is not None:
+            self.emit("addiu", target, "$fp", offset)
+            if vtable:
+                table = self.new_vreg()
+                self.emit("la", table, self.vtable_label(instruction.target))
+                self.emit("sw", table, Mem(0, target))
+            else:
+                self.emit("sw", "$zero", Mem(0, target))
+        else:
+            self.runtime.add("__object_new")
+            self.emit("li", "$a0", 4 * size)
+            if vtable:
+                self.emit("la", "$a1", self.vtable_label(instruction.target))
+            else:
+                self.emit("move", "$a1", "$zero")
+            self.call("__object_new", ["$a0", "$a1"], result=target)
+        self.assign(instruction.dest, target)
+
+    def select_getfield(self, instruction):
+        target = self.destination(instruction.dest)
+        self.emit("lw", target, Mem(4 * int(instruction.args[1]), self.value(instruction.args[0])))
+        self.assign(instruction.dest, target)
+
+    def select_setfield(self, instruction):
+        record = self.value(instruction.args[0])
+        self.emit("sw", self.value(instruction.args[2]), Mem(4 * int(instruction.args[1]), record))
+
+    def select_nullcheck(self, instruction):
+        pass  # Like field accesses, MIPS code does not check for null objects
+
+    def select_caught(self, instruction):
+        # MIPS code does not check for runtime errors, so a catch block would never run;
+        # one error per function is enough
+        if self.function.name not in self.unsupported_catches:
+            self.unsupported_catches.add(self.function.name)
+            self.add_error("try/catch is not supported")
+
+    def select_callvirt(self, instruction):
+        # The object is the first argument; its vtable holds the method's address
+        record = self.pending_params[len(self.pending_params) - instruction.args_count]
+        function = self.new_vreg()
+        self.emit("lw", function, Mem(0, record))
+        self.emit("lw", function, Mem(4 * int(instruction.args[1]), function))
+        self.select_call(instruction, function)
+
+    def select_call(self, instruction, function=None):
+        count = instruction.args_count
+        arguments = self.pending_params[len(self.pending_params) - count:]
+        del self.pending_params[len(self.pending_params) - count:]
+
+        in_registers = arguments[:len(ARGUMENT_REGISTERS)]
+        on_stack = arguments[len(ARGUMENT_REGISTERS):]
+        if on_stack:
+            self.emit("addiu", "$sp", "$sp", -4 * len(on_stack))
+        for i, register in enumerate(on_stack):
+            self.emit("sw", register, Mem(4 * i, "$sp"))
+        for i, register in enumerate(in_registers):
+            self.emit("move", ARGUMENT_REGISTERS[i], register)
+
+        target = self.destination(instruction.dest)
+        self.call(function or instruction.target, ARGUMENT_REGISTERS[:len(in_registers)], result=target)
+        if on_stack:
+            self.emit("addiu", "$sp", "$sp", 4 * len(on_stack))
+        self.assign(instruction.dest, target)
+
+    def select_return(self, instruction):
+        if self.function is self.program.main:
+            self.add_error("'return' outside of a function")
+            return
+        if instruction.args:
+            self.emit("move", "$v0", self.value(instruction.args[0]))
+        self.emit("j", self.epilogue_label())
+
+    def select_print(self, instruction):
+        value = self.value(instruction.args[0])
+        if instruction.type in PRINT_SYSCALLS:
+            self.emit("move", "$a0", value)
+            self.emit("li", "$v0", PRINT_SYSCALLS[instruction.type])
+            self.emit("syscall", extra_uses=["$a0", "$v0"])
+        elif instruction.type == "boolean":
+            self.runtime.add("__print_bool")
+            self.emit("move", "$a0", value)
+            self.call("__print_bool", ["$a0"])
+        else:
+            self.add_error(f"cannot print values of type {instruction.type}")
+
+        self.emit("li", "$a0", 10)
+        self.emit("li", "$v0", 11)
+        self.emit("syscall", extra_uses=["$a0", "$v0"])
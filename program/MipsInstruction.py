@@ -0,0 +1,117 @@
+ALLOCATABLE_REGISTERS = ["$t0", "$t1", "$t2", "$t3", "$t4", "$t5", "$t6", "$t7", "$t8", "$t9",
+                         "$s0", "$s1", "$s2", "$s3", "$s4", "$s5", "$s6", "$s7"]
+CALLER_SAVED = ["$t0", "$t1", "$t2", "$t3", "$t4", "$t5", "$t6", "$t7", "$t8", "$t9",
+                "$v0", "$v1", "$a0", "$a1", "$a2", "$a3", "$ra"]
+CALLEE_SAVED = ["$s0", "$s1", "$s2", "$s3", "$s4", "$s5", "$s6", "$s7"]
+ARGUMENT_REGISTERS = ["$a0", "$a1", "$a2", "$a3"]
+
+# Opcodes whose first operand is the destination register
+WRITES_FIRST = {
+    "add", "addu", "addi", "addiu", "sub", "subu", "mul", "div", "rem", "divu", "remu",
+    "and", "or", "xor", "nor", "andi", "ori", "xori", "not", "neg", "negu",
+    "slt", "sltu", "slti", "sltiu", "sle", "sgt", "sge", "seq", "sne",
+    "sll", "srl", "sra", "sllv", "srlv", "srav",
+    "move", "li", "la", "lw", "lb", "lbu", "lh", "lhu", "lui", "mflo", "mfhi",
+}
+BRANCHES = {"beq", "bne", "blt", "ble", "bgt", "bge", "beqz", "bnez", "bltz", "blez", "bgtz", "bgez"}
+LOADS = {"lw", "lb", "lbu", "lh", "lhu"}
+STORES = {"sw", "sb", "sh"}
+
+
+def is_register(operand):
+    return isinstance(operand, str) and operand.startswith(("$", "%"))
+
+
+def is_virtual(operand):
+    return isinstance(operand, str) and operand.startswith("%")
+
+
+class Mem:
+    # Memory operand: offset(base)
+    def __init__(self, offset, base):
+        self.offset = offset
+        self.base = base
+
+    def __str__(self):
+        return f"{self.offset}({self.base})"
+
+    def __eq__(self, other):
+        return isinstance(other, Mem) and self.offset == other.offset and self.base == other.base
+
+    def __hash__(self):
+        return hash((self.offset, self.base))
+
+
+class MipsInstruction:
+    def __init__(self, op, *operands, extra_uses=None, extra_defs=None, comment=None):
+        self.op = op
+        self.operands = list(operands)
+        self.extra_uses = list(extra_uses or [])  # Implicit registers read (arguments of jal/syscall)
+        self.extra_defs = list(extra_defs or [])  # Implicit registers clobbered
+        self.comment = comment
+        self.line = None  # Source line it was selected from; None for spill code and frames
+
+    def registers(self):
+        # Every register read or written, memory bases included
+        result = []
+        for operand in self.operands:
+            if isinstance(operand, Mem):
+                result.append(operand.base)
+            elif is_register(operand):
+                result.append(operand)
+        return result
+
+    def defs(self):
+        result = []
+        if self.op in WRITES_FIRST and self.operands and is_register(self.operands[0]):
+            result.append(self.operands[0])
+        return result + self.extra_defs
+
+    def uses(self):
+        result = []
+        for i, operand in enumerate(self.operands):
+            if isinstance(operand, Mem):
+                result.append(operand.base)
+            elif is_register(operand) and not (i == 0 and self.op in WRITES_FIRST):
+                result.append(operand)
+        return result + self.extra_uses
+
+    def is_move(self):
+        return self.op == "move" and is_register(self.operands[0]) and is_register(self.operands[1])
+
+    def label_name(self):
+        return self.operands[0] if self.op == "label" else None
+
+    def jump_targets(self):
+        if self.op in BRANCHES or self.op == "j":
+            return [self.operands[-1]]
+        return []
+
+    def falls_through(self):
+        return self.op not in ["j", "jr"]
+
+    def replace_registers(self, mapping):
+        # Rename registers through mapping, leaving unmapped ones untouched
+        def rename(operand):
+            if isinstance(operand, Mem):
+                return Mem(operand.offset, mapping.get(operand.base, operand.base))
+            if is_register(operand):
+                return mapping.get(operand, operand)
+            return operand
+        self.operands = [rename(operand) for operand in self.operands]
+        self.extra_uses = [mapping.get(r, r) for r in self.extra_uses]
+        self.extra_defs = [mapping.get(r, r) for r in self.extra_defs]
+
+    def __str__(self):
+        if self.op == "label":
+            return f"{self.operands[0]}:" + (f"  # {self.comment}" if self.comment else "")
+        text = self.op
+        if self.operands:
+            text += " " + ", ".join(str(operand) for operand in self.operands)
+        text = "    " + text
+        if self.comment:
+            text = f"{text:<32}# {self.comment}"
+        return text
+
+    def __repr__(self):
+        return f"MipsInstruction({str(self).strip()})"
@@ -0,0 +1,891 @@
+import sys
+import io
+import time
+import contextlib
+import re
+import codecs
+
+TEXT_BASE = 0x00400000
+DATA_BASE = 0x10010000
+HEAP_BASE = 0x10040000
+STACK_TOP = 0x7FFFEFFC
+
+REGISTER_NAMES = ["$zero", "$at", "$v0", "$v1", "$a0", "$a1", "$a2", "$a3",
+                  "$t0", "$t1", "$t2", "$t3", "$t4", "$t5", "$t6", "$t7",
+                  "$s0", "$s1", "$s2", "$s3", "$s4", "$s5", "$s6", "$s7",
+                  "$t8", "$t9", "$k0", "$k1", "$gp", "$sp", "$fp", "$ra"]
+REGISTERS = {name: i for i, name in enumerate(REGISTER_NAMES)}
+REGISTERS.update({f"${i}": i for i in range(32)})
+REGISTERS["$s8"] = 30
+
+# Pre-decoded opcodes, numbered roughly by how often generated code executes them
+(ADDIU, ADDU, LW, SW, MOVE, LI, BEQ, BNE, J, SLT, SLTI, SUBU, SLL, MUL,
+ BLT, BGE, BLE, BGT, BEQZ, BNEZ, JAL, JR, SYSCALL, LA, AND, OR, XOR, XORI, ANDI, ORI,
+ SLE, SGT, SGE, SEQ, SNE, DIV3, REM3, DIV2, MFLO, MFHI, SRA, SRL, SLLV, SRAV, SRLV, NOR, NOP,
+ BLTZ, BGEZ, BLEZ, BGTZ, SLTU, NEG, NOT, LUI, JALR, HALT) = range(57)
+
+OPCODES = {
+    "addiu": ADDIU, "addi": ADDIU, "addu": ADDU, "add": ADDU, "lw": LW, "sw": SW, "move": MOVE,
+    "li": LI, "beq": BEQ, "bne": BNE, "j": J, "b": J, "slt": SLT, "slti": SLTI, "subu": SUBU, "sub": SUBU,
+    "sll": SLL, "mul": MUL, "blt": BLT, "bge": BGE, "ble": BLE, "bgt": BGT, "beqz": BEQZ, "bnez": BNEZ,
+    "jal": JAL, "jr": JR, "syscall": SYSCALL, "la": LA, "and": AND, "or": OR, "xor": XOR, "xori": XORI,
+    "andi": ANDI, "ori": ORI, "sle": SLE, "sgt": SGT, "sge": SGE, "seq": SEQ, "sne": SNE,
+    "div": DIV3, "rem": REM3, "mflo": MFLO, "mfhi": MFHI, "sra": SRA, "srl": SRL,
+    "sllv": SLLV, "srav": SRAV, "srlv": SRLV, "nor": NOR, "nop": NOP, "bltz": BLTZ, "bgez": BGEZ,
+    "blez": BLEZ, "bgtz": BGTZ, "sltu": SLTU, "sltiu": SLTU, "neg": NEG, "negu": NEG, "not": NOT, "lui": LUI,
+    "jalr": JALR,
+}
+BRANCH_OPCODES = {BEQ, BNE, BLT, BGE, BLE, BGT, BEQZ, BNEZ, BLTZ, BGEZ, BLEZ, BGTZ}
+JUMP_OPCODES = {J, JAL, JR, JALR}
+
+
+class SimulationError(Exception):
+    pass
+
+
+def wrap(value):
+    # Two's complement 32-bit
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def truncated_division(a, b):
+    if b == 0:
+        raise SimulationError("division by zero")
+    quotient = abs(a) // abs(b)
+    return -quotient if (a < 0) != (b < 0) else quotient
+
+
+class Instruction:
+    def __init__(self, op, a=0, b=0, c=0, line=0, text="", source_line=None):
+        self.op, self.a, self.b, self.c = op, a, b, c
+        self.line = line
+        self.text = text
+        self.source_line = source_line  # From the "# line N" comments of generated code, if any
+
+    def decoded(self):
+        return (self.op, self.a, self.b, self.c)
+
+
+class Assembler:
+    # Two passes: lay out data and text labels, then decode every instruction
+    def __init__(self, source):
+        self.labels = {}
+        self.constants = []  # Immediate operands of pseudo-instructions, see constant_register
+        self.memory = {}     # Word address -> value
+        self.strings = {}    # Address -> text of .asciiz data
+        self.lines = []      # (line number, mnemonic, operands, text, source line) for the text segment
+        self.instructions = []
+        self.data_end = DATA_BASE
+        self.layout(source)
+        self.decode()
+
+    def layout(self, source):
+        segment = "text"
+        address = DATA_BASE
+        source_line = None
+        for number, raw in enumerate(source.splitlines(), 1):
+            marker = re.match(r"^\s*#\s*(?:line (\d+)|runtime)\s*$", raw)
+            if marker:
+                source_line = int(marker.group(1)) if marker.group(1) else None
+                continue
+            line = self.strip_comment(raw).strip()
+            while line:
+                match = re.match(r"^([A-Za-z_.$][\w.$]*):\s*(.*)$", line)
+                if not match:
+                    break
+                label, line = match.group(1), match.group(2).strip()
+                if segment == "text":
+                    self.labels[label] = TEXT_BASE + 4 * len(self.lines)
+                else:
+                    address = (address + 3) & ~3 if not line.startswith(".asciiz") else address
+                    self.labels[label] = address
+            if not line:
+                continue
+
+            if line.startswith("."):
+                directive, _, rest = line.partition(" ")
+                if directive == ".text":
+                    segment = "text"
+                elif directive == ".data":
+                    segment = "data"
+                elif directive == ".word":
+                    address = (address + 3) & ~3
+                    for item in rest.split(","):
+                        self.memory[address] = self.pending_word(item.strip())
+                        address += 4
+                elif directive == ".space":
+                    address += int(rest)
+                elif directive in [".asciiz", ".ascii"]:
+                    # Escapes are decoded on the UTF-8 bytes, and the text keeps one character per byte
+                    try:
+                        data = codecs.escape_decode(rest.strip()[1:-1].encode("utf-8"))[0]
+                    except ValueError as error:
+                        raise SimulationError(f"line {number}: bad string {rest.strip()}: {error}")
+                    self.strings[address] = data.decode("latin-1")
+                    address += len(data) + (1 if directive == ".asciiz" else 0)
+                elif directive == ".align":
+                    alignment = 1 << int(rest)
+                    address = (address + alignment - 1) & ~(alignment - 1)
+                continue
+
+            mnemonic, _, rest = line.partition(" ")
+            operands = [operand.strip() for operand in self.split_operands(rest)] if rest.strip() else []
+            self.lines.append((number, mnemonic, operands, raw.strip(), source_line))
+        self.data_end = (address + 7) & ~7
+
+    def pending_word(self, item):
+        # Words may reference labels defined later; resolve them lazily
+        try:
+            return int(item, 0)
+        except ValueError:
+            return item
+
+    @staticmethod
+    def strip_comment(line):
+        in_string = escaped = False
+        for i, char in enumerate(line):
+            if escaped:
+                escaped = False
+            elif char == "\\" and in_string:
+                escaped = True
+            elif char == '"':
+                in_string = not in_string
+            elif char == "#" and not in_string:
+                return line[:i]
+        return line
+
+    @staticmethod
+    def split_operands(text):
+        return [part for part in re.split(r",(?=(?:[^\"]*\"[^\"]*\")*[^\"]*$)", text)]
+
+    def register(self, text):
+        if text not in REGISTERS:
+            raise SimulationError(f"unknown register '{text}'")
+        return REGISTERS[text]
+
+    def value(self, text):
+        if text in self.labels:
+            return self.labels[text]
+        try:
+            return int(text, 0)
+        except ValueError:
+            if len(text) == 3 and text[0] == text[2] == "'":
+                return ord(text[1])
+            raise SimulationError(f"undefined symbol '{text}'")
+
+    def constant_register(self, text):
+        # Pseudo-instructions with an immediate where the hardware wants a register read it
+        # from a read-only slot past the 32 architectural registers, so they stay one step
+        value = self.value(text)
+        if value not in self.constants:
+            self.constants.append(value)
+        return 32 + self.constants.index(value)
+
+    def operand_register(self, text):
+        return self.register(text) if text.startswith("$") else self.constant_register(text)
+
+    def target(self, text):
+        # Text labels become instruction indexes
+        if text not in self.labels:
+            raise SimulationError(f"undefined label '{text}'")
+        return (self.labels[text] - TEXT_BASE) >> 2
+
+    def memory_operand(self, text):
+        # offset(base), (base) or a bare data label
+        match = re.match(r"^(-?\w*)\((\$\w+)\)$", text)
+        if match:
+            return self.register(match.group(2)), self.value(match.group(1)) if match.group(1) else 0
+        return 0, self.value(text)
+
+    def decode(self):
+        for address, item in list(self.memory.items()):
+            if isinstance(item, str):
+                self.memory[address] = self.value(item)
+
+        for number, mnemonic, operands, text, source_line in self.lines:
+            if mnemonic not in OPCODES:
+                raise SimulationError(f"line {number}: unknown instruction '{mnemonic}'")
+            try:
+                op, a, b, c = self.decode_operands(OPCODES[mnemonic], mnemonic, operands)
+            except (IndexError, SimulationError) as error:
+                raise SimulationError(f"line {number}: cannot assemble '{text}': {error}")
+            # Writes to $zero are discarded by the hardware
+            if a == 0 and op in WRITES_REGISTER:
+                op, a, b, c = NOP, 0, 0, 0
+            self.instructions.append(Instruction(op, a, b, c, number, text, source_line))
+
+    def decode_operands(self, op, mnemonic, operands):
+        r = self.register
+        if op in (ADDU, SUBU, SLT, MUL, AND, OR, XOR, SLE, SGT, SGE, SEQ, SNE, SLLV, SRAV, SRLV, NOR, SLTU):
+            if not operands[2].startswith("$") and op in IMMEDIATE_FORMS:
+                return IMMEDIATE_FORMS[op], r(operands[0]), r(operands[1]), self.value(operands[2]) * (-1 if op == SUBU else 1)
+            return op, r(operands[0]), r(operands[1]), self.operand_register(operands[2])
+        if op in (ADDIU, SLTI, SLL, SRA, SRL, XORI, ANDI, ORI):
+            return op, r(operands[0]), r(operands[1]), self.value(operands[2])
+        if op in (DIV3, REM3):
+            if len(operands) == 2:
+                return DIV2, r(operands[0]), r(operands[1]), 0
+            return op, r(operands[0]), r(operands[1]), self.operand_register(operands[2])
+        if op in (LW, SW):
+            base, offset = self.memory_operand(operands[1])
+            return op, r(operands[0]), base, offset
+        if op in (MOVE, NEG, NOT):
+            return op, r(operands[0]), r(operands[1]), 0
+        if op in (LI, LA, LUI):
+            value = self.value(operands[1])
+            return (LI if op != LUI else LUI), r(operands[0]), value, 0
+        if op in (BEQ, BNE, BLT, BGE, BLE, BGT):
+            return op, r(operands[0]), self.operand_register(operands[1]), self.target(operands[2])
+        if op in (BEQZ, BNEZ, BLTZ, BGEZ, BLEZ, BGTZ):
+            return op, r(operands[0]), 0, self.target(operands[1])
+        if op in (J, JAL):
+            return op, self.target(operands[0]), 0, 0
+        if op in (JR, JALR):
+            return op, r(operands[0]), 0, 0
+        if op in (MFLO, MFHI):
+            return op, r(operands[0]), 0, 0
+        return op, 0, 0, 0
+
+
+IMMEDIATE_FORMS = {ADDU: ADDIU, SUBU: ADDIU, AND: ANDI, OR: ORI, XOR: XORI, SLT: SLTI}
+WRITES_REGISTER = {ADDIU, ADDU, LW, MOVE, LI, SLT, SLTI, SUBU, SLL, MUL, LA, AND, OR, XOR, XORI, ANDI, ORI,
+                   SLE, SGT, SGE, SEQ, SNE, DIV3, REM3, MFLO, MFHI, SRA, SRL, SLLV, SRAV, SRLV, NOR, SLTU,
+                   NEG, NOT, LUI}
+
+
+class MipsSimulator:
+    # Runs assembled MIPS in-process. Instructions are pre-decoded into (opcode, a, b, c)
+    # tuples so the interpreter loop only compares small integers and indexes lists.
+    def __init__(self, source, stdin=None, delayed_branches=False, translate=True, timing=None):
+        self.assembler = Assembler(source)
+        self.program = self.assembler.instructions
+        self.labels = self.assembler.labels
+        self.input = list(stdin or [])
+        self.delayed_branches = delayed_branches
+        self.translate = translate  # Run through BlockTranslator instead of the interpreter loop
+        self.timing = timing        # A TimingModel.PipelineModel built over self.program, or None
+        self.output = []
+        self.steps = 0
+        self.exit_code = 0
+
+    def run(self, max_steps=50_000_000, entry="main"):
+        if entry not in self.labels:
+            raise SimulationError(f"entry point '{entry}' not found")
+
+        self.registers = [0] * 32 + self.assembler.constants
+        self.registers[REGISTERS["$sp"]] = STACK_TOP
+        self.registers[REGISTERS["$gp"]] = 0x10008000
+        self.memory = dict(self.assembler.memory)
+        self.strings = dict(self.assembler.strings)
+        self.heap = max(HEAP_BASE, self.assembler.data_end)
+        self.hi = self.lo = 0
+        self.output = []
+
+        pc = (self.labels[entry] - TEXT_BASE) >> 2
+        if self.delayed_branches or self.timing is not None:
+            self.execute_stepwise(pc, max_steps)
+        elif self.translate:
+            self.steps = BlockTranslator(self).execute(pc, max_steps)
+        else:
+            self.execute(pc, max_steps)
+        return "".join(self.output)
+
+    def execute(self, pc, max_steps):
+        # Every taken jump or branch checks the step count, so any loop or recursion stops
+        code = [instruction.decoded() for instruction in self.program]
+        # Falling off the end of the program stops the machine like an exit syscall
+        code.append((HALT, 0, 0, 0))
+        r = self.registers
+        memory = self.memory
+        steps = 0
+
+        while True:
+            op, a, b, c = code[pc]
+            pc += 1
+            steps += 1
+            if op == ADDIU:
+                r[a] = wrap(r[b] + c)
+            elif op == ADDU:
+                r[a] = wrap(r[b] + r[c])
+            elif op == LW:
+                r[a] = memory.get(r[b] + c, 0)
+            elif op == SW:
+                memory[r[b] + c] = r[a]
+            elif op == MOVE:
+                r[a] = r[b]
+            elif op == LI:
+                r[a] = b
+            elif op == BEQ:
+                if r[a] == r[b]:
+                    pc = c
+                    if steps > max_steps:
+                        raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == BNE:
+                if r[a] != r[b]:
+                    pc = c
+                    if steps > max_steps:
+                        raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == J:
+                pc = a
+                if steps > max_steps:
+                    raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == SLT:
+                r[a] = 1 if r[b] < r[c] else 0
+            elif op == SLTI:
+                r[a] = 1 if r[b] < c else 0
+            elif op == SUBU:
+                r[a] = wrap(r[b] - r[c])
+            elif op == SLL:
+                r[a] = wrap(r[b] << c)
+            elif op == MUL:
+                r[a] = wrap(r[b] * r[c])
+            elif op <= BNEZ:
+                # BLT, BGE, BLE, BGT, BEQZ, BNEZ
+                x = r[a]
+                y = r[b]
+                if op == BLT:
+                    taken = x < y
+                elif op == BGE:
+                    taken = x >= y
+                elif op == BLE:
+                    taken = x <= y
+                elif op == BGT:
+                    taken = x > y
+                elif op == BEQZ:
+                    taken = x == 0
+                else:
+                    taken = x != 0
+                if taken:
+                    pc = c
+                    if steps > max_steps:
+                        raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == JAL:
+                r[31] = TEXT_BASE + 4 * pc
+                pc = a
+                if steps > max_steps:
+                    raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == JR:
+                pc = (r[a] - TEXT_BASE) >> 2
+                if steps > max_steps:
+                    raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == JALR:
+                target = r[a]
+                r[31] = TEXT_BASE + 4 * pc
+                pc = (target - TEXT_BASE) >> 2
+                if steps > max_steps:
+                    raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == SYSCALL:
+                if self.syscall():
+                    break
+            elif BLTZ <= op <= BGTZ:
+                x = r[a]
+                if op == BLTZ:
+                    taken = x < 0
+                elif op == BGEZ:
+                    taken = x >= 0
+                elif op == BLEZ:
+                    taken = x <= 0
+                else:
+                    taken = x > 0
+                if taken:
+                    pc = c
+                    if steps > max_steps:
+                        raise SimulationError(f"step limit of {max_steps} exceeded")
+            elif op == HALT:
+                break
+            else:
+                self.execute_other(op, a, b, c)
+
+        self.steps = steps
+
+    def execute_other(self, op, a, b, c):
+        r = self.registers
+        if op == LA:
+            r[a] = b
+        elif op == AND:
+            r[a] = r[b] & r[c]
+        elif op == OR:
+            r[a] = r[b] | r[c]
+        elif op == XOR:
+            r[a] = r[b] ^ r[c]
+        elif op == XORI:
+            r[a] = r[b] ^ c
+        elif op == ANDI:
+            r[a] = r[b] & c
+        elif op == ORI:
+            r[a] = r[b] | c
+        elif op in (SLE, SGT, SGE, SEQ, SNE, SLTU):
+            x, y = r[b], r[c]
+            if op == SLE:
+                r[a] = int(x <= y)
+            elif op == SGT:
+                r[a] = int(x > y)
+            elif op == SGE:
+                r[a] = int(x >= y)
+            elif op == SEQ:
+                r[a] = int(x == y)
+            elif op == SNE:
+                r[a] = int(x != y)
+            else:
+                r[a] = int((x & 0xFFFFFFFF) < (y & 0xFFFFFFFF))
+        elif op == DIV3:
+            r[a] = wrap(truncated_division(r[b], r[c]))
+        elif op == REM3:
+            y = r[c]
+            r[a] = wrap(r[b] - truncated_division(r[b], y) * y)
+        elif op == DIV2:
+            self.lo = wrap(truncated_division(r[a], r[b]))
+            self.hi = wrap(r[a] - truncated_division(r[a], r[b]) * r[b])
+        elif op == MFLO:
+            r[a] = self.lo
+        elif op == MFHI:
+            r[a] = self.hi
+        elif op == SRA:
+            r[a] = r[b] >> c
+        elif op == SRL:
+            r[a] = wrap((r[b] & 0xFFFFFFFF) >> c)
+        elif op == SLLV:
+            r[a] = wrap(r[b] << (r[c] & 31))
+        elif op == SRAV:
+            r[a] = r[b] >> (r[c] & 31)
+        elif op == SRLV:
+            r[a] = wrap((r[b] & 0xFFFFFFFF) >> (r[c] & 31))
+        elif op == NOR:
+            r[a] = wrap(~(r[b] | r[c]))
+        elif op == NEG:
+            r[a] = wrap(-r[b])
+        elif op == NOT:
+            r[a] = wrap(~r[b])
+        elif op == LUI:
+            r[a] = wrap(b << 16)
+        elif op == NOP:
+            pass
+        else:
+            raise SimulationError(f"opcode {op} is not supported")
+
+    def execute_stepwise(self, pc, max_steps):
+        # Slow path, one instruction at a time. It models branch delay slots (the instruction
+        # after a taken branch or jump always executes before control transfers) and feeds the
+        # timing model, if any, with every instruction it executes.
+        r = self.registers
+        code = self.program
+        delayed = self.delayed_branches
+        timing = self.timing
+        steps = 0
+        pending = None
+        while 0 <= pc < len(code):
+            op, a, b, c = code[pc].decoded()
+            next_pc = pc + 1
+            steps += 1
+            if steps > max_steps:
+                raise SimulationError(f"step limit of {max_steps} exceeded")
+            # The base register may be the one a load overwrites
+            address = r[b] + c if op in (LW, SW) else None
+
+            target = None
+            halt = False
+            if op in BRANCH_OPCODES:
+                x = r[a]
+                y = 0 if op in (BEQZ, BNEZ, BLTZ, BGEZ, BLEZ, BGTZ) else r[b]
+                taken = {BEQ: x == y, BNE: x != y, BLT: x < y, BGE: x >= y, BLE: x <= y, BGT: x > y,
+                         BEQZ: x == 0, BNEZ: x != 0, BLTZ: x < 0, BGEZ: x >= 0, BLEZ: x <= 0, BGTZ: x > 0}[op]
+                if taken:
+                    target = c
+            elif op == J:
+                target = a
+            elif op == JAL:
+                r[31] = TEXT_BASE + 4 * (pc + (2 if delayed else 1))
+                target = a
+            elif op == JR:
+                target = (r[a] - TEXT_BASE) >> 2
+            elif op == JALR:
+                target = (r[a] - TEXT_BASE) >> 2
+                r[31] = TEXT_BASE + 4 * (pc + (2 if delayed else 1))
+            elif op == SYSCALL:
+                halt = self.syscall()
+            else:
+                self.execute_simple(op, a, b, c)
+
+            if timing is not None:
+                timing.step(pc, address, target is not None)
+            if halt:
+                break
+            if not delayed:
+                if target is not None:
+                    next_pc = target
+            else:
+                if pending is not None:
+                    next_pc, pending = pending, None
+                if target is not None:
+                    pending = target
+            pc = next_pc
+        self.steps = steps
+
+    def execute_simple(self, op, a, b, c):
+        r = self.registers
+        if op == ADDIU:
+            r[a] = wrap(r[b] + c)
+        elif op == ADDU:
+            r[a] = wrap(r[b] + r[c])
+        elif op == LW:
+            r[a] = self.memory.get(r[b] + c, 0)
+        elif op == SW:
+            self.memory[r[b] + c] = r[a]
+        elif op == MOVE:
+            r[a] = r[b]
+        elif op == LI:
+            r[a] = b
+        elif op == SLT:
+            r[a] = 1 if r[b] < r[c] else 0
+        elif op == SLTI:
+            r[a] = 1 if r[b] < c else 0
+        elif op == SUBU:
+            r[a] = wrap(r[b] - r[c])
+        elif op == SLL:
+            r[a] = wrap(r[b] << c)
+        elif op == MUL:
+            r[a] = wrap(r[b] * r[c])
+        else:
+            self.execute_other(op, a, b, c)
+
+    def syscall(self):
+        # Returns True when the program asks to exit
+        r = self.registers
+        service = r[2]
+        if service == 1:
+            self.output.append(str(r[4]))
+        elif service == 4:
+            self.output.append(self.read_string(r[4]).encode("latin-1").decode("utf-8", "replace"))
+        elif service == 5:
+            r[2] = int(self.input.pop(0)) if self.input else 0
+        elif service == 9:
+            r[2] = self.heap
+            self.heap += (r[4] + 7) & ~7
+        elif service == 10:
+            return True
+        elif service == 11:
+            self.output.append(chr(r[4] & 0xFF))
+        elif service == 17:
+            self.exit_code = r[4]
+            return True
+        else:
+            raise SimulationError(f"syscall {service} is not supported")
+        return False
+
+    def read_string(self, address):
+        if address in self.strings:
+            return self.strings[address]
+        # Address inside a string literal
+        for start, text in self.strings.items():
+            if start <= address < start + len(text):
+                return text[address - start:]
+        raise SimulationError(f"no string at address {address:#x}")
+
+
+# Python expression templates for instructions the translator inlines; {a}/{b}/{c} are the
+# destination and source operands (register locals or literals), {imm} the raw immediate.
+# Results of the WRAPPED ones may leave the 32-bit range and get a range check.
+TRANSLATED = {
+    ADDIU: "{b} + {imm}",
+    ADDU: "{b} + {c}",
+    SUBU: "{b} - {c}",
+    MUL: "{b} * {c}",
+    SLL: "{b} << {imm}",
+    SRA: "{b} >> {imm}",
+    SRL: "({b} & 0xFFFFFFFF) >> {imm}",
+    MOVE: "{b}",
+    LI: "{imm_b}",
+    LA: "{imm_b}",
+    LW: "memory.get({b} + {imm}, 0)",
+    SLT: "1 if {b} < {c} else 0",
+    SLTI: "1 if {b} < {imm} else 0",
+    SLE: "1 if {b} <= {c} else 0",
+    SGT: "1 if {b} > {c} else 0",
+    SGE: "1 if {b} >= {c} else 0",
+    SEQ: "1 if {b} == {c} else 0",
+    SNE: "1 if {b} != {c} else 0",
+    SLTU: "1 if ({b} & 0xFFFFFFFF) < ({c} & 0xFFFFFFFF) else 0",
+    AND: "{b} & {c}",
+    OR: "{b} | {c}",
+    XOR: "{b} ^ {c}",
+    ANDI: "{b} & {imm}",
+    ORI: "{b} | {imm}",
+    XORI: "{b} ^ {imm}",
+    DIV3: "divide({b}, {c})",
+    REM3: "{b} - divide({b}, {c}) * {c}",
+}
+WRAPPED = {ADDIU, ADDU, SUBU, MUL, SLL, SRL, DIV3, REM3}
+WRAP_CHECK = "if not -0x80000000 <= {a} <= 0x7FFFFFFF: {a} = (({a} + 0x80000000) & 0xFFFFFFFF) - 0x80000000"
+# Division by a positive constant never overflows and needs no helper call
+CONSTANT_DIVISION = {
+    DIV3: "{b} // {c} if {b} >= 0 else -(-{b} // {c})",
+    REM3: "{b} % {c} if {b} >= 0 else -(-{b} % {c})",
+}
+CONDITIONS = {
+    BEQ: "{a} == {b}", BNE: "{a} != {b}", BLT: "{a} < {b}", BGE: "{a} >= {b}", BLE: "{a} <= {b}",
+    BGT: "{a} > {b}", BEQZ: "{a} == 0", BNEZ: "{a} != 0", BLTZ: "{a} < 0", BGEZ: "{a} >= 0",
+    BLEZ: "{a} <= 0", BGTZ: "{a} > 0",
+}
+MAX_REGION = 256  # Instructions per translated region
+
+
+class BlockTranslator:
+    # Fast path for MipsSimulator: each region of straight-line code reached from a PC
+    # (following fall-throughs and unconditional jumps) becomes one generated Python
+    # function that keeps registers in locals. A branch back to the region's start turns
+    # into a while loop, so tight loops never leave Python code. Functions are cached by
+    # PC and return their successor function; static successors are linked on first use.
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.program = simulator.program
+        self.regions = [None] * (len(self.program) + 1)
+        self.steps = [0]
+        self.max_steps = 0
+
+    def execute(self, pc, max_steps):
+        self.max_steps = max_steps
+        steps = self.steps
+        region = self.region(pc)
+        while region is not None:
+            region = region()
+            if steps[0] > max_steps:
+                raise SimulationError(f"step limit of {max_steps} exceeded")
+        return steps[0]
+
+    def region(self, pc):
+        if not 0 <= pc <= len(self.program):
+            raise SimulationError(f"jump outside the program (instruction {pc})")
+        if self.regions[pc] is None:
+            self.regions[pc] = self.translate(pc)
+        return self.regions[pc]
+
+    def link(self, links, index, pc):
+        # Resolve a static exit once; later executions return links[index] directly
+        links[index] = self.region(pc)
+        return links[index]
+
+    def lookup(self, address):
+        return self.region((address - TEXT_BASE) >> 2)
+
+    def translate(self, start):
+        registers = set()
+        targets = []   # Static exit PCs, indexes into links
+        body = []
+        looped = False
+        count = 0      # Instructions executed from the region start to the current point
+        known = {}     # Registers holding a constant at the current point
+
+        def operand(register):
+            if register == 0:
+                return "0"
+            if register >= 32:
+                return repr(self.simulator.registers[register])
+            if register in known:
+                return repr(known[register])
+            registers.add(register)
+            return f"r{register}"
+
+        def destination(register):
+            known.pop(register, None)
+            registers.add(register)
+            return f"r{register}"
+
+        def leave(target_code, indent="    "):
+            # Write registers back, count the steps taken and return the successor
+            body.append(f"{indent}steps[0] += n + {count}")
+            body.append(f"{indent}" + "{flush}")
+            body.append(f"{indent}return {target_code}")
+
+        def leave_to(pc, indent="    "):
+            targets.append(pc)
+            index = len(targets) - 1
+            leave(f"links[{index}] or link(links, {index}, {pc})", indent)
+
+        def back_edge(indent):
+            # Steps are counted in a local while the loop stays inside the region
+            body.append(f"{indent}n += {count}")
+            body.append(f"{indent}if n > budget: break")
+            body.append(f"{indent}continue")
+
+        pc = start
+        visited = set()
+        while True:
+            if pc in visited or count >= MAX_REGION:
+                if pc == start:
+                    looped = True
+                    back_edge("    ")
+                else:
+                    leave_to(pc)
+                break
+            if pc == len(self.program):
+                leave("None")
+                break
+            visited.add(pc)
+
+            op, a, b, c = self.program[pc].decoded()
+            count += 1
+            if op in TRANSLATED:
+                template = TRANSLATED[op]
+                if op in CONSTANT_DIVISION and isinstance(known.get(c), int) and known[c] > 0:
+                    template = CONSTANT_DIVISION[op]
+                values = {"imm": c, "imm_b": b}
+                if "{b}" in template:
+                    values["b"] = operand(b)
+                if "{c}" in template:
+                    values["c"] = operand(c)
+                expression = template.format(**values)
+                if a != 0:
+                    target = destination(a)
+                    body.append(f"    {target} = {expression}")
+                    if op in WRAPPED and template is TRANSLATED[op]:
+                        body.append("    " + WRAP_CHECK.format(a=target))
+                    if op in (LI, LA):
+                        known[a] = b
+                pc += 1
+            elif op == SW:
+                body.append(f"    memory[{operand(b)} + {c}] = {operand(a)}")
+                pc += 1
+            elif op == NOP:
+                pc += 1
+            elif op == J:
+                pc = a
+            elif op in CONDITIONS:
+                condition = CONDITIONS[op].format(a=operand(a), b=operand(b))
+                body.append(f"    if {condition}:")
+                if c == start:
+                    looped = True
+                    back_edge("        ")
+                else:
+                    leave_to(c, "        ")
+                pc += 1
+            elif op == JAL:
+                body.append(f"    r31 = {TEXT_BASE + 4 * (pc + 1)}")
+                registers.add(31)
+                leave_to(a)
+                break
+            elif op == JR:
+                leave(f"lookup({operand(a)})")
+                break
+            elif op == JALR:
+                body.append(f"    _target = {operand(a)}")
+                body.append(f"    r31 = {TEXT_BASE + 4 * (pc + 1)}")
+                registers.add(31)
+                leave("lookup(_target)")
+                break
+            elif op == SYSCALL:
+                body.append("    {flush}")
+                body.append("    if syscall():")
+                body.append(f"        steps[0] += n + {count}")
+                body.append("        return None")
+                body.append("    {reload}")
+                known.clear()
+                pc += 1
+            else:
+                # Rare instructions run through the interpreter on the register file
+                body.append("    {flush}")
+                body.append(f"    execute_other({op}, {a}, {b}, {c})")
+                body.append("    {reload}")
+                known.clear()
+                destination(a)
+                pc += 1
+
+        names = sorted(registers)
+        flush = "; ".join(f"r[{n}] = r{n}" for n in names) or "pass"
+        reload = "; ".join(f"r{n} = r[{n}]" for n in names) or "pass"
+        lines = [line.replace("{flush}", flush).replace("{reload}", reload) for line in body]
+        if looped:
+            lines = ["    while True:"] + ["    " + line for line in lines]
+            # A back edge over the step limit breaks out of the loop
+            lines += ["    steps[0] += n", f"    {flush}", "    return None"]
+
+        source = [f"def region_{start}(r=r, memory=memory, steps=steps, links=links, link=link, lookup=lookup,",
+                  "                syscall=syscall, execute_other=execute_other, divide=divide,",
+                  "                max_steps=max_steps):",
+                  "    n = 0",
+                  "    budget = max_steps - steps[0]",
+                  f"    {reload}"] + lines
+        namespace = {
+            "r": self.simulator.registers, "memory": self.simulator.memory, "steps": self.steps,
+            "links": [None] * len(targets), "link": self.link, "lookup": self.lookup,
+            "syscall": self.simulator.syscall, "execute_other": self.simulator.execute_other,
+            "divide": truncated_division, "max_steps": self.max_steps,
+        }
+        exec("\n".join(source), namespace)
+        return namespace[f"region_{start}"]
+
+
+def run(source, stdin=None, max_steps=50_000_000):
+    simulator = MipsSimulator(source, stdin)
+    output = simulator.run(max_steps)
+    return output, simulator.steps
+
+
+def compile_program(path, regalloc="graph", delay_slots=False):
+    # Assembly for a .cps file, or None after printing its errors
+    from antlr4 import FileStream
+    from Driver import analyze
+    from MipsGenerator import MipsGenerator
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(FileStream(path, encoding="utf-8"))
+    errors = syntax_errors + visitor.errors
+    generator = None
+    if not errors:
+        generator = MipsGenerator(visitor.generated_code, visitor.symbol_table, regalloc, delay_slots=delay_slots,
+                                  source_lines=visitor.source_lines)
+        assembly = generator.generate()
+        errors = generator.errors
+    for error in errors:
+        print(error)
+    return None if errors else assembly
+
+
+def main(argv):
+    # python3 MipsSimulator.py program.cps|program.asm ... [--regalloc=linear] [--delay-slots=on] [--translate=off]
+    #                          [--timing=on] [--cache=size,line,ways,miss_penalty]
+    from Driver import parse_options
+    from TimingModel import PipelineModel, Cache
+
+    options, arguments = parse_options(argv)
+    delay_slots = options.get("delay-slots") == "on"
+    translate = options.get("translate") != "off"
+    failed = False
+    for path in arguments:
+        print(f"== {path}")
+        if path.endswith(".asm"):
+            with open(path) as source:
+                assembly = source.read()
+        else:
+            assembly = compile_program(path, options.get("regalloc", "graph"), delay_slots)
+            if assembly is None:
+                failed = True
+                continue
+
+        simulator = MipsSimulator(assembly, delayed_branches=delay_slots, translate=translate)
+        if options.get("timing") == "on":
+            cache = options.get("cache")
+            simulator.timing = PipelineModel(simulator.program, Cache.parse(cache) if cache else None,
+                                             Cache.parse(cache) if cache else None, delay_slots=delay_slots)
+        start = time.perf_counter()
+        try:
+            output = simulator.run()
+        except SimulationError as error:
+            print(f"simulation error: {error}")
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        print(output, end="" if output.endswith("\n") or not output else "\n")
+        rate = simulator.steps / elapsed / 1e6 if elapsed else 0
+        print(f"-- {simulator.steps} instructions, {rate:.1f}M instructions/s")
+        if simulator.timing is not None:
+            source_lines = None
+            if not path.endswith(".asm"):
+                with open(path) as source:
+                    source_lines = source.read().splitlines()
+            for line in simulator.timing.report(source_lines):
+                print(line)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,224 @@
+from MipsInstruction import MipsInstruction, Mem, BRANCHES
+
+INVERTED_BRANCHES = {
+    "beq": "bne", "bne": "beq", "blt": "bge", "bge": "blt", "ble": "bgt", "bgt": "ble",
+    "beqz": "bnez", "bnez": "beqz", "bltz": "bgez", "bgez": "bltz", "blez": "bgtz", "bgtz": "blez",
+}
+CONTROL_TRANSFERS = BRANCHES | {"j", "jal", "jalr", "jr"}
+# Registers a control transfer writes before its delay slot runs
+TRANSFER_DEFS = {"jal": ["$ra"], "jalr": ["$ra"]}
+
+
+class PeepholeRule:
+    # Rewrites a window of 'size' consecutive instructions. rewrite(window) returns the
+    # replacement list, or None when the rule does not apply. The example is a window
+    # the rule must turn into the expected result, checked by tests/test_peephole.py.
+    def __init__(self, name, size, rewrite, example, expected):
+        self.name = name
+        self.size = size
+        self.rewrite = rewrite
+        self.example = example
+        self.expected = expected
+
+    def __repr__(self):
+        return f"PeepholeRule({self.name})"
+
+
+def i(op, *operands):
+    return MipsInstruction(op, *operands)
+
+
+def self_move(window):
+    # move $t0, $t0
+    move, = window
+    if move.op == "move" and move.operands[0] == move.operands[1]:
+        return []
+    return None
+
+
+def move_back(window):
+    # move $t0, $t1 ; move $t1, $t0  ->  the second move copies the value back
+    first, second = window
+    if first.op == second.op == "move" and first.operands == second.operands[::-1]:
+        return [first]
+    return None
+
+
+def add_zero(window):
+    # addiu $t0, $t0, 0 and sll $t0, $t0, 0 do nothing; with different registers they are moves
+    instruction, = window
+    if instruction.op in ["addiu", "sll", "sra", "srl"] and instruction.operands[2] == 0:
+        if instruction.operands[0] == instruction.operands[1]:
+            return []
+        return [MipsInstruction("move", instruction.operands[0], instruction.operands[1])]
+    return None
+
+
+def store_load(window):
+    # sw $t0, M ; lw $t1, M  ->  the value is still in $t0
+    store, load = window
+    if store.op == "sw" and load.op == "lw" and store.operands[1] == load.operands[1]:
+        if load.operands[0] == store.operands[0]:
+            return [store]
+        return [store, MipsInstruction("move", load.operands[0], store.operands[0])]
+    return None
+
+
+def load_store(window):
+    # lw $t0, M ; sw $t0, M  ->  memory already holds $t0, unless the load overwrote the base of M
+    load, store = window
+    if load.op == "lw" and store.op == "sw" and load.operands == store.operands:
+        address = load.operands[1]
+        if isinstance(address, Mem) and address.base == load.operands[0]:
+            return None
+        return [load]
+    return None
+
+
+def load_load(window):
+    # lw $t0, M ; lw $t1, M  ->  reuse $t0, unless the first load overwrote the base of M
+    first, second = window
+    if first.op == second.op == "lw" and first.operands[1] == second.operands[1]:
+        address = first.operands[1]
+        if isinstance(address, Mem) and address.base == first.operands[0]:
+            return None
+        if second.operands[0] == first.operands[0]:
+            return [first]
+        return [first, MipsInstruction("move", second.operands[0], first.operands[0])]
+    return None
+
+
+def jump_to_next(window):
+    # j L ; L:  and  beqz $t0, L ; L:  fall through anyway
+    jump, label = window
+    if label.op == "label" and (jump.op == "j" or jump.op in BRANCHES) \
+            and jump.operands[-1] == label.operands[0]:
+        return [label]
+    return None
+
+
+def branch_over_jump(window):
+    # beqz $t0, L1 ; j L2 ; L1:  ->  bnez $t0, L2 ; L1:
+    branch, jump, label = window
+    if branch.op in INVERTED_BRANCHES and jump.op == "j" and label.op == "label" \
+            and branch.operands[-1] == label.operands[0]:
+        inverted = MipsInstruction(INVERTED_BRANCHES[branch.op], *branch.operands[:-1], jump.operands[0])
+        return [inverted, label]
+    return None
+
+
+def unreachable(window):
+    # Nothing after an unconditional jump runs until the next label
+    jump, following = window
+    if jump.op in ["j", "jr"] and following.op != "label":
+        return [jump]
+    return None
+
+
+RULES = [
+    PeepholeRule("self_move", 1, self_move, [i("move", "$t0", "$t0")], []),
+    PeepholeRule("move_back", 2, move_back,
+                 [i("move", "$t0", "$t1"), i("move", "$t1", "$t0")], [i("move", "$t0", "$t1")]),
+    PeepholeRule("add_zero", 1, add_zero, [i("addiu", "$t0", "$t1", 0)], [i("move", "$t0", "$t1")]),
+    PeepholeRule("store_load", 2, store_load,
+                 [i("sw", "$t0", Mem(-12, "$fp")), i("lw", "$t1", Mem(-12, "$fp"))],
+                 [i("sw", "$t0", Mem(-12, "$fp")), i("move", "$t1", "$t0")]),
+    PeepholeRule("load_store", 2, load_store,
+                 [i("lw", "$t0", "var_x"), i("sw", "$t0", "var_x")], [i("lw", "$t0", "var_x")]),
+    PeepholeRule("load_load", 2, load_load,
+                 [i("lw", "$t0", Mem(8, "$t2")), i("lw", "$t1", Mem(8, "$t2"))],
+                 [i("lw", "$t0", Mem(8, "$t2")), i("move", "$t1", "$t0")]),
+    PeepholeRule("jump_to_next", 2, jump_to_next, [i("j", "L1"), i("label", "L1")], [i("label", "L1")]),
+    PeepholeRule("branch_over_jump", 3, branch_over_jump,
+                 [i("blt", "$t0", "$t1", "L1"), i("j", "L2"), i("label", "L1")],
+                 [i("bge", "$t0", "$t1", "L2"), i("label", "L1")]),
+    PeepholeRule("unreachable", 2, unreachable, [i("j", "L1"), i("move", "$t0", "$t1")], [i("j", "L1")]),
+]
+
+
+def optimize(instructions, stats=None, rules=RULES):
+    # Slide every rule's window over the code, rewriting in place, until a pass changes nothing
+    code = list(instructions)
+    changed = True
+    while changed:
+        changed = False
+        position = 0
+        while position < len(code):
+            for rule in rules:
+                window = code[position:position + rule.size]
+                if len(window) < rule.size:
+                    continue
+                replacement = rule.rewrite(window)
+                if replacement is None:
+                    continue
+                code[position:position + rule.size] = replacement
+                if stats is not None:
+                    stats[rule.name] = stats.get(rule.name, 0) + 1
+                changed = True
+                # A rewrite can enable a rule whose window starts a little earlier
+                position = max(0, position - 2)
+                break
+            else:
+                position += 1
+    return code
+
+
+MEMORY_OPS = {"lw", "sw", "syscall"}
+DELAY_SLOT_SEARCH = 8  # How far back in the block to look for a filler
+
+
+def transfer_reads(transfer):
+    # Registers the transfer itself reads before its delay slot runs. Implicit uses (the
+    # arguments of jal, the result of jr) are read by the target, after the slot.
+    return {operand for operand in transfer.registers() if operand in transfer.uses()} - set(transfer.extra_uses)
+
+
+def can_swap(earlier, later):
+    # Whether two adjacent instructions may trade places
+    earlier_defs, later_defs = set(earlier.defs()), set(later.defs())
+    if earlier_defs & (set(later.uses()) | later_defs) or later_defs & set(earlier.uses()):
+        return False
+    if earlier.op in MEMORY_OPS and later.op in MEMORY_OPS and not (earlier.op == later.op == "lw"):
+        return False
+    return True
+
+
+def delay_slot_candidate(code, transfer, fillers):
+    # Index of an instruction in the current block that can move past everything after it
+    # and into the delay slot of transfer, or None
+    start = len(code) - 1
+    for index in range(start, max(-1, start - DELAY_SLOT_SEARCH), -1):
+        candidate = code[index]
+        if candidate.op in CONTROL_TRANSFERS or candidate.op in ["label", "nop", "syscall"] \
+                or id(candidate) in fillers:
+            return None
+        writes = set(candidate.defs())
+        transfer_writes = set(TRANSFER_DEFS.get(transfer.op, []))
+        independent = not (writes & transfer_reads(transfer)) \
+            and not (transfer_writes & (writes | set(candidate.uses())))
+        if independent and all(can_swap(candidate, later) for later in code[index + 1:]):
+            return index
+    return None
+
+
+def fill_delay_slots(instructions, stats=None):
+    # Every branch and jump gets an earlier instruction of its block moved into its delay
+    # slot when nothing depends on the order, and a nop otherwise
+    code = []
+    fillers = set()  # ids of instructions already sitting in a delay slot
+    for instruction in instructions:
+        if instruction.op not in CONTROL_TRANSFERS:
+            code.append(instruction)
+            continue
+        index = delay_slot_candidate(code, instruction, fillers)
+        if index is not None:
+            filler = code.pop(index)
+            key = "filled"
+        else:
+            filler = MipsInstruction("nop")
+            key = "nop"
+        fillers.add(id(filler))
+        code += [instruction, filler]
+        if stats is not None:
+            stats[key] = stats.get(key, 0) + 1
+    return code
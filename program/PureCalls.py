@@ -0,0 +1,359 @@
+from CodeFragment import TacLine
+from ControlFlowGraph import ControlFlowGraph
+from ThreeAddressCode import parse_line, is_constant, is_temp, constant_value, wrap_integer
+from TacInterpreter import truncated_division
+from BoundsCheck import split_functions
+
+# Pure function calls over the visitor's TAC. A function is pure when it only computes
+# with its parameters and locals: no globals, no print, no arrays or objects, no try,
+# and nothing but pure functions among its callees (recursion included). A call to a
+# pure function whose arguments are integer or boolean constants is evaluated here, by
+# an interpreter with a step budget, and replaced by its result. Otherwise a pure call
+# can reuse the result of the same call earlier in its block, or move in front of the
+# loop it sits at the top of when its arguments do not change in the loop.
+
+PURE_OPS = {"label", "goto", "iffalse", "iftrue", "ifrel", "copy", "binary", "unary", "param", "call", "return"}
+SAFE_OPS = {"param", "copy", "unary"}  # Cannot fail and change nothing outside their dest
+CONSTANT_TYPES = {"integer", "boolean"}
+MEMO_TYPES = {"integer", "boolean", "string"}  # Parameter types a memo table can key on
+EVALUATION_STEPS = 20000
+EVALUATION_DEPTH = 100
+
+
+class EvaluationAborted(Exception):
+    # The call failed or ran out of steps
+    pass
+
+
+def function_info(symbol_table, name):
+    info = symbol_table.get(name, {})
+    return info if "params" in info else None
+
+
+def find_pure_functions(functions, symbol_table):
+    # Labels of the pure functions among split_functions(code), assuming every candidate
+    # pure and dropping those that call one that is not until nothing changes
+    candidates = {}
+    for function in functions[1:]:
+        info = function_info(symbol_table, function.name)
+        if info is None or function.handlers:
+            continue
+        own = set(info["params"]) | set(info.get("locals", []))
+        if all(instruction.op in PURE_OPS
+               and all(is_temp(name) or name in own for name in instruction.uses() + instruction.defs())
+               for instruction in function.instructions):
+            candidates[function.name] = {instruction.target for instruction in function.instructions
+                                         if instruction.op == "call"}
+    pure = set(candidates)
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not candidates[name] <= pure:
+                pure.discard(name)
+                changed = True
+    return pure
+
+
+def memoizable_functions(code, symbol_table):
+    # Labels of the pure functions in the TAC text whose parameters are all integers, booleans
+    # or strings: a call to one returns the same value, or fails the same way, for the same arguments
+    return {name for name in find_pure_functions(split_functions(code.splitlines()), symbol_table)
+            if all(kind in MEMO_TYPES for kind in function_info(symbol_table, name)["params"].values())}
+
+
+class Evaluator:
+    # Runs pure functions on constant arguments; every call shares one step budget
+    BINARY = {
+        "+": lambda x, y: x + y, "-": lambda x, y: x - y, "*": lambda x, y: x * y,
+        "/": truncated_division, "%": lambda x, y: x - truncated_division(x, y) * y,
+        "<": lambda x, y: x < y, "<=": lambda x, y: x <= y, ">": lambda x, y: x > y,
+        ">=": lambda x, y: x >= y, "==": lambda x, y: x == y, "!=": lambda x, y: x != y,
+        "&&": lambda x, y: x and y, "||": lambda x, y: x or y,
+    }
+
+    def __init__(self, functions, symbol_table, steps=EVALUATION_STEPS):
+        self.functions = functions  # Label -> FunctionCode of every pure function
+        self.symbol_table = symbol_table
+        self.steps = steps
+
+    def call(self, name, arguments, depth=0):
+        if depth > EVALUATION_DEPTH:
+            raise EvaluationAborted("too deep")
+        function = self.functions[name]
+        params = list(function_info(self.symbol_table, name)["params"])
+        if len(params) != len(arguments):
+            raise EvaluationAborted("wrong number of arguments")
+        frame = dict(zip(params, arguments))
+        labels = {instruction.target: index for index, instruction in enumerate(function.instructions)
+                  if instruction.op == "label"}
+        pending = []
+        pc = 0
+        while pc < len(function.instructions):
+            self.steps -= 1
+            if self.steps < 0:
+                raise EvaluationAborted("out of steps")
+            instruction = function.instructions[pc]
+            op = instruction.op
+            pc += 1
+            if op == "label":
+                continue
+            values = [self.value(frame, arg) for arg in instruction.args]
+            if op == "copy":
+                frame[instruction.dest] = values[0]
+            elif op == "binary":
+                frame[instruction.dest] = self.checked(self.apply(instruction.operator, *values))
+            elif op == "unary":
+                frame[instruction.dest] = self.checked(-values[0] if instruction.operator == "-" else not values[0])
+            elif op == "param":
+                pending.append(values[0])
+            elif op == "call":
+                start = len(pending) - instruction.args_count
+                frame[instruction.dest] = self.call(instruction.target, pending[start:], depth + 1)
+                del pending[start:]
+            elif op == "return":
+                return values[0] if values else None
+            elif op == "goto":
+                pc = labels[instruction.target]
+            elif op in ["iffalse", "iftrue"]:
+                if bool(values[0]) == (op == "iftrue"):
+                    pc = labels[instruction.target]
+            elif op == "ifrel":
+                if self.apply(instruction.operator, *values):
+                    pc = labels[instruction.target]
+        return None
+
+    def apply(self, operator, x, y):
+        try:
+            return self.BINARY[operator](x, y)
+        except Exception as error:
+            raise EvaluationAborted(str(error))
+
+    def value(self, frame, operand):
+        if is_constant(operand):
+            value = constant_value(operand)
+            if not isinstance(value, (bool, int)):
+                raise EvaluationAborted("not an integer or boolean")
+            return value
+        if operand not in frame:
+            raise EvaluationAborted(f"'{operand}' read before it is set")
+        return frame[operand]
+
+    def checked(self, value):
+        # Results wrap to 32 bits as they do when the program runs
+        return value if isinstance(value, bool) else wrap_integer(value)
+
+
+def literal(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class PureCallOptimizer:
+    def __init__(self, code, symbol_table, new_temp):
+        self.code = list(code)
+        self.symbol_table = symbol_table
+        self.new_temp = new_temp
+        self.stats = {"functions": 0, "pure": 0, "evaluated": 0, "reused": 0, "hoisted": 0}
+
+    def run(self):
+        functions = split_functions(self.code)
+        self.pure = find_pure_functions(functions, self.symbol_table)
+        self.stats["functions"] = len(functions) - 1
+        self.stats["pure"] = len(self.pure)
+        if not self.pure:
+            return self.code
+        self.evaluator = Evaluator({function.name: function for function in functions
+                                    if function.name in self.pure}, self.symbol_table)
+        self.globals = set()
+        for function in functions[1:]:
+            info = function_info(self.symbol_table, function.name) or {}
+            own = set(info.get("params", {})) | set(info.get("locals", []))
+            for instruction in function.instructions:
+                self.globals |= {name for name in instruction.uses() + instruction.defs()
+                                 if not is_temp(name) and name not in own}
+
+        replaced, removed = {}, set()
+        self.folded = {}  # id of a line "t = constant" made from a call -> t
+        for function in functions:
+            self.fold(function, replaced, removed)
+        code = [replaced.get(index, line) for index, line in enumerate(self.code) if index not in removed]
+        # A result that only fed the arguments of another evaluated call is not needed
+        used = {name for line in code for name in parse_line(line).uses()}
+        self.code = [line for line in code if id(line) not in self.folded or self.folded[id(line)] in used]
+
+        for function in split_functions(self.code):
+            self.hoist_all(function)
+        return self.code
+
+    def returns_constant(self, name):
+        info = function_info(self.symbol_table, name)
+        return (info is not None and info["type"] in CONSTANT_TYPES
+                and all(kind in CONSTANT_TYPES for kind in info["params"].values()))
+
+    def is_global(self, function, name):
+        if is_temp(name) or is_constant(name):
+            return False
+        if function.name is None:
+            return name in self.globals
+        info = function_info(self.symbol_table, function.name) or {}
+        return name not in info.get("params", {}) and name not in info.get("locals", [])
+
+    # ******************************
+    # *** Evaluation and reuse   ***
+    # ******************************
+
+    def fold(self, function, replaced, removed):
+        # Walks each block with the params still waiting for their call, evaluating
+        # constant pure calls and reusing earlier pure calls with the same arguments
+        definitions = {}
+        for instruction in function.instructions:
+            for name in instruction.defs():
+                definitions[name] = definitions.get(name, 0) + 1
+        constants = {}  # Temp -> literal it always holds
+        for instruction in function.instructions:
+            if (instruction.op == "copy" and is_temp(instruction.dest) and definitions[instruction.dest] == 1
+                    and is_constant(instruction.args[0])):
+                constants[instruction.dest] = instruction.args[0]
+
+        pending = []    # (line index, operand) of every param since the block began
+        available = {}  # (function, arguments) -> temp holding the result of that call
+        for offset, instruction in enumerate(function.instructions):
+            index = function.lines[offset]
+            if instruction.op == "label" or instruction.jump_targets() or not instruction.falls_through():
+                pending, available = [], {}
+                continue
+            if instruction.op == "param":
+                pending.append((index, instruction.args[0]))
+                continue
+            if instruction.op in ["call", "callvirt"]:
+                count = instruction.args_count
+                params = None
+                if count <= len(pending):
+                    params = pending[len(pending) - count:]
+                    pending = pending[:len(pending) - count]
+                else:
+                    pending = []
+                if instruction.op == "call" and instruction.target in self.pure and params is not None:
+                    # Its only definition is a new temp, which nothing available mentions
+                    result = self.pure_call(function, instruction, params, constants, available)
+                    if result is not None:
+                        removed.update(line for line, _ in params)
+                        replaced[index] = self.tagged(f"{instruction.dest} = {result}", self.code[index])
+                        if is_constant(result):
+                            self.folded[id(replaced[index])] = instruction.dest
+                            if definitions.get(instruction.dest) == 1:
+                                constants[instruction.dest] = result
+                    continue
+                # Whatever else it is, it may assign any global
+                available = {key: temp for key, temp in available.items()
+                             if not any(self.is_global(function, arg) for arg in key[1])}
+            for name in instruction.defs():
+                available = {key: temp for key, temp in available.items() if name not in key[1] and name != temp}
+
+    def pure_call(self, function, instruction, params, constants, available):
+        # The result of the call as a literal or an earlier temp, or None to keep it
+        arguments = [constants.get(arg, arg) for _, arg in params]
+        if self.returns_constant(instruction.target) and all(is_constant(arg) for arg in arguments):
+            self.evaluator.steps = EVALUATION_STEPS
+            try:
+                values = [self.evaluator.value({}, arg) for arg in arguments]
+                value = self.evaluator.call(instruction.target, values)
+            except (EvaluationAborted, RecursionError):
+                value = None
+            if isinstance(value, (bool, int)):
+                self.stats["evaluated"] += 1
+                return literal(value)
+        key = (instruction.target, tuple(arguments))
+        info = function_info(self.symbol_table, instruction.target)
+        if key in available:
+            self.stats["reused"] += 1
+            return available[key]
+        if info["type"] != "void":
+            available[key] = instruction.dest
+        return None
+
+    def tagged(self, text, like):
+        return TacLine(text, like.line) if isinstance(like, TacLine) else text
+
+    # ******************************
+    # *** Loop-invariant calls   ***
+    # ******************************
+
+    def hoist_all(self, function):
+        # Innermost loops first; the code is split again after every move
+        done = set()
+        while True:
+            function = next(item for item in split_functions(self.code) if item.name == function.name)
+            cfg = ControlFlowGraph(function.instructions)
+            loops = sorted(cfg.loops, key=lambda loop: len(loop[1]))
+            loop = next(((header, body) for header, body in loops if header.label() not in done), None)
+            if loop is None:
+                return
+            done.add(loop[0].label())
+            self.hoist(function, cfg, *loop)
+
+    def hoist(self, function, cfg, header, body):
+        # Pure calls with invariant arguments at the top of the first block of the loop move
+        # before the loop, behind a copy of its test so they only run if the loop does
+        outside = [block for block in header.predecessors if block.index not in body]
+        preheader = cfg.blocks[header.index - 1] if header.index > 0 else None
+        if len(outside) != 1 or outside[0] is not preheader or header.index + 1 not in body:
+            return
+        last = preheader.instructions[-1]
+        if not last.falls_through() or header.label() in last.jump_targets():
+            return
+        test = header.instructions[1:]
+        if not test:
+            return
+        exit_jump = test[-1]
+        if (exit_jump.op not in ["iffalse", "iftrue", "ifrel"]
+                or any(instruction.op not in ["copy", "binary", "unary"] or not is_temp(instruction.dest)
+                       for instruction in test[:-1])):
+            return
+        first = cfg.blocks[header.index + 1]
+        if first.predecessors != [header]:
+            return
+
+        loop = [instruction for index in sorted(body) for instruction in cfg.blocks[index].instructions]
+        defined = {name for instruction in loop for name in instruction.defs()}
+        calls = any(instruction.op in ["callvirt"] or (instruction.op == "call" and instruction.target not in self.pure)
+                    for instruction in loop)
+
+        def invariant(arg):
+            return is_constant(arg) or (arg not in defined and not (calls and self.is_global(function, arg)))
+
+        # The leading instructions of the block that cannot fail or be seen, up to the
+        # first pure call that has to stay
+        moved = []
+        instructions = first.instructions
+        for position, instruction in enumerate(instructions):
+            if instruction.op == "call" and instruction.target in self.pure:
+                count = instruction.args_count
+                params = instructions[position - count:position] if count else []
+                if (len(params) != count or any(param.op != "param" or param in moved for param in params)
+                        or not all(invariant(param.args[0]) for param in params)):
+                    break
+                moved += params + [instruction]
+            elif instruction.op not in SAFE_OPS | {"label"} and not (instruction.op == "binary"
+                                                         and instruction.operator not in ["/", "%"]):
+                break
+        if not moved:
+            return
+
+        position = {id(instruction): index for index, instruction in enumerate(function.instructions)}
+        lines = [function.lines[position[id(instruction)]] for instruction in moved]
+        label = function.lines[position[id(header.instructions[0])]]
+        renamed = {}
+        guard = []
+        for instruction in test:
+            copy = parse_line(str(instruction))
+            copy.args = [renamed.get(arg, arg) for arg in copy.args]
+            if copy.dest is not None:
+                renamed[copy.dest] = copy.dest = self.new_temp()
+            guard.append(self.tagged(str(copy), self.code[label]))
+        hoisted = guard + [self.code[line] for line in lines]
+        self.code = [line for index, line in enumerate(self.code) if index not in lines]
+        self.code[label:label] = hoisted
+        self.stats["hoisted"] += sum(1 for instruction in moved if instruction.op == "call")
@@ -0,0 +1,688 @@
+import sys
+import io
+import math
+import time
+import contextlib
+from array import array
+from ThreeAddressCode import TACProgram, HandlerTable, is_constant, is_temp, constant_value, constant_array, literal_fills, ARRAY_TYPECODES
+from ThreeAddressCode import wrap_integer, run_deep
+from ControlFlowGraph import ControlFlowGraph
+from ClassLayout import Record
+from Vectorizer import numpy, find_foreach_loops, vectorized_prologue, vector_load, vector_bound, vector_sum
+from Vectorizer import vector_storable, vector_store
+
+INDENT = "    "
+PYTHON_OPERATORS = {"+": "+", "-": "-", "*": "*", "<": "<", "<=": "<=", ">": ">", ">=": ">=",
+                    "==": "==", "!=": "!=", "&&": "and", "||": "or"}
+INVERTED = {"<": ">=", ">=": "<", "<=": ">", ">": "<=", "==": "!=", "!=": "=="}
+# Tests for an integer result of + - * or negation that has to wrap to 32 bits
+ABOVE, BELOW, OUTSIDE = "{} > 2147483647", "{} < -2147483648", "not -2147483648 <= {} <= 2147483647"
+
+
+class PythonRuntimeError(Exception):
+    pass
+
+
+class PythonException(PythonRuntimeError):
+    # A runtime error of the program itself, which a catch block can handle
+    pass
+
+
+class NotStructured(Exception):
+    # The function's control flow has no if/while shape; it is emitted as a block dispatch loop
+    pass
+
+
+def python_identifier(label):
+    # Labels may hold "." (nested functions, methods) and "$" (made-up names). Doubling "_"
+    # first keeps the escapes apart, so distinct labels give distinct identifiers.
+    return label.replace("_", "__").replace(".", "_d").replace("$", "_s")
+
+
+# ******************************
+# *** Runtime helpers        ***
+# ******************************
+# Operations with no single Python equivalent. They are only called when the inline
+# fast path written by the generator does not apply.
+
+def runtime_div(x, y):
+    if type(x) is int and type(y) is int:
+        if y == 0:
+            raise PythonException("division by zero")
+        quotient = abs(x) // abs(y)
+        return -quotient if (x < 0) != (y < 0) else wrap_integer(quotient)  # Only -2**31 / -1 overflows
+    if y == 0:
+        raise PythonException("division by zero")
+    return x / y
+
+
+def runtime_mod(x, y):
+    if y == 0:
+        raise PythonException("division by zero")
+    if type(x) is int and type(y) is int:
+        remainder = abs(x) % abs(y)  # The sign follows the dividend
+        return -remainder if x < 0 else remainder
+    return math.fmod(x, y)
+
+
+def runtime_bounds(values, index):
+    raise PythonException(f"index {index} out of bounds for array of length {len(values)}")
+
+
+def runtime_null():
+    # Reached through "(obj or runtime_null())": records are never empty, so only null is false
+    raise PythonException("null reference")
+
+
+def runtime_iterations(limit):
+    raise PythonRuntimeError(f"more than {limit} loop iterations")
+
+
+class PythonGenerator:
+    # Turns every TAC function into a Python function: variables become Python locals
+    # (module globals for the ones functions share), calls are Python calls, and loops and
+    # conditionals are rebuilt from the control flow graph as native while/if statements.
+    # The module is compiled once, so CPython's own bytecode does the dispatching.
+    def __init__(self, code, symbol_table, max_iterations=10_000_000, vectorize=True):
+        self.program = TACProgram(code, symbol_table)
+        self.max_iterations = max_iterations  # Per call of a function, counted at loop heads
+        self.vectorize = vectorize and numpy is not None
+        self.stats = {"structured": 0, "dispatch": 0, "vectorized": 0}
+        self.source = None
+        self.code_object = None
+        self.output = []
+        self.arrays = {}  # Constant array literal -> (name, prebuilt buffer)
+        self.handler_tables = []  # (name, [(first block, end block, catch block)]) of functions with tries
+
+    # ******************************
+    # *** Operands               ***
+    # ******************************
+
+    def name(self, function, operand):
+        if is_constant(operand):
+            return repr(constant_value(operand))
+        if is_temp(operand):
+            return operand
+        if operand in self.program.globals and not function.is_local(operand):
+            return "g_" + operand
+        return "v_" + operand
+
+    def function_name(self, name):
+        return "_main" if name == "main" else "f_" + python_identifier(name)
+
+    def class_name(self, name):
+        # Module-level template record that every "new" of the class copies
+        return "_class_" + python_identifier(name)
+
+    def array_name(self, instruction):
+        # Module-level buffer that every run of the literal copies
+        key = (instruction.type, tuple(instruction.args))
+        if key not in self.arrays:
+            self.arrays[key] = (f"_array{len(self.arrays)}", constant_array(instruction))
+        return self.arrays[key][0]
+
+    # ******************************
+    # *** Generation             ***
+    # ******************************
+
+    def generate(self):
+        lines = []
+        for function in self.program.all_functions():
+            lines += self.function_source(function)
+            lines.append("")
+        # Templates go last, once the functions in their vtables exist
+        for name, (size, vtable) in self.program.classes.items():
+            functions = ", ".join(self.function_name(function) for function in vtable)
+            lines.append(f"{self.class_name(name)} = Record([[{functions}]] + [None] * {size - 1})")
+        for name, entries in self.handler_tables:
+            lines.append(f"{name} = HandlerTable({entries!r})")
+        self.source = "\n".join(lines)
+        return self.source
+
+    def function_source(self, function):
+        params = ", ".join(self.name(function, param) for param in function.params)
+        header = [f"def {self.function_name(function.name)}({params}):"]
+        written = sorted({self.name(function, name) for instruction in function.instructions
+                          for name in instruction.defs() if self.name(function, name).startswith("g_")})
+        if written:
+            header.append(f"{INDENT}global {', '.join(written)}")
+
+        cfg = ControlFlowGraph(function.instructions)
+        self.inline = self.inlinable(function)
+        self.vector_loops = find_foreach_loops(function.instructions) if self.vectorize else {}
+        self.stats["vectorized"] += len(self.vector_loops)
+        if cfg.loops or function.handlers:
+            header.append(f"{INDENT}_n = 0")
+        try:
+            body = StructuredEmitter(self, function, cfg).emit()
+            self.stats["structured"] += 1
+        except NotStructured:
+            body = self.dispatch_source(function, cfg)
+            self.stats["dispatch"] += 1
+        return header + body + [f"{INDENT}return None"]
+
+    def inlinable(self, function):
+        # Temps defined once and read once, by the very next instruction, are folded into
+        # that instruction as a subexpression instead of being stored
+        counts = {}
+        for instruction in function.instructions:
+            for name in instruction.uses() + instruction.defs():
+                counts[name] = counts.get(name, 0) + 1
+        inline = set()
+        instructions = function.instructions
+        for index, instruction in enumerate(instructions[:-1]):
+            dest = instruction.dest
+            consumer = instructions[index + 1]
+            # Arguments wait for their call, and %, checked load and checked store read an operand twice
+            if consumer.op == "param" or (consumer.op in ["load", "store"] and consumer.checked) or consumer.operator == "%":
+                continue
+            if (instruction.op in ["binary", "unary", "copy", "len"] and is_temp(dest) and counts.get(dest) == 2
+                    and dest in consumer.uses()):
+                inline.add(dest)
+        return inline
+
+    def loop_guard(self, indent):
+        return [f"{indent}_n += 1",
+                f"{indent}if _n > {self.max_iterations}: runtime_iterations({self.max_iterations})"]
+
+    def dispatch_source(self, function, cfg):
+        # Fallback for any control flow: one branch of a while/if chain per basic block.
+        # With tries the chain runs inside a try statement, which costs nothing until an
+        # error; the block that failed is then looked up in the function's handler table.
+        labels = {block.label(): block.index for block in cfg.blocks if block.label()}
+        catches = [labels[catch] for _, _, catch in function.handlers]
+        reachable = sorted(cfg.reachable(catches))
+        outer = INDENT * 2 if not catches else INDENT * 4
+        lines = []
+        translator = StatementTranslator(self, function)
+        for position, index in enumerate(reachable):
+            block = cfg.blocks[index]
+            keyword = "if" if position == 0 else "elif"
+            lines.append(f"{outer}{keyword} _block == {index}:")
+            indent = outer + INDENT
+            body = []
+            for instruction in block.instructions:
+                body += translator.statement(instruction, indent)
+            last = block.instructions[-1] if block.instructions else None
+            following = cfg.blocks[index + 1].index if index + 1 < len(cfg.blocks) else None
+
+            def go(target, index=index, indent=indent):
+                if target is None:
+                    return [f"{indent}return None"]
+                lines = [f"{indent}_block = {target}"]
+                if target <= index:
+                    lines = self.loop_guard(indent) + lines
+                return lines + [f"{indent}continue"]
+
+            if last is not None and last.op == "return":
+                pass
+            elif last is not None and last.op == "goto":
+                body += go(labels[last.target])
+            elif last is not None and last.op in ["iffalse", "iftrue", "ifrel"]:
+                body.append(f"{indent}if {translator.condition(last, taken=True)}:")
+                body += [INDENT + line for line in go(labels[last.target])]
+                body += go(following)
+            else:
+                body += go(following)
+            lines += body
+
+        if not catches:
+            return [f"{INDENT}_block = 0", f"{INDENT}while True:"] + lines
+        table = f"_handlers_{python_identifier(function.name)}"
+        self.handler_tables.append((table, [(labels[start], labels[end], labels[catch])
+                                            for start, end, catch in function.handlers]))
+        return ([f"{INDENT}_block = 0", f"{INDENT}while True:", f"{INDENT * 2}try:", f"{INDENT * 3}while True:"]
+                + lines
+                + [f"{INDENT * 2}except PythonException as _error:",
+                   f"{INDENT * 3}_block = {table}.lookup(_block)",
+                   f"{INDENT * 3}if _block is None:",
+                   f"{INDENT * 4}raise",
+                   f"{INDENT * 3}_caught = str(_error)"])
+
+    # ******************************
+    # *** Execution              ***
+    # ******************************
+
+    def compile(self):
+        if self.code_object is None:
+            self.code_object = compile(self.generate(), "<compiscript>", "exec")
+        return self.code_object
+
+    def run(self):
+        self.output = []
+        code = self.compile()
+        namespace = {
+            "runtime_div": runtime_div, "runtime_mod": runtime_mod, "runtime_bounds": runtime_bounds,
+            "runtime_iterations": runtime_iterations, "runtime_null": runtime_null, "_out": self.output.append,
+            "array": array, "Record": Record, "HandlerTable": HandlerTable, "PythonException": PythonException,
+            "numpy": numpy, "vector_load": vector_load, "vector_bound": vector_bound, "vector_sum": vector_sum,
+            "vector_storable": vector_storable, "vector_store": vector_store, "wrap_integer": wrap_integer,
+        }
+        namespace.update(self.arrays.values())
+        for name in self.program.globals:
+            namespace["g_" + name] = None
+        exec(code, namespace)
+        try:
+            run_deep(namespace["_main"], 1)
+        except RecursionError:
+            raise PythonRuntimeError("call stack overflow")
+        except OverflowError:
+            raise PythonRuntimeError("value out of range for an integer[] element")
+        return "".join(self.output)
+
+
+class StatementTranslator:
+    # Python statements for the straight-line TAC instructions of one function
+    def __init__(self, generator, function):
+        self.generator = generator
+        self.function = function
+        self.pending = {}   # Inlined temp -> expression
+        self.params = []    # Argument expressions of the next call
+        self.snapshots = 0
+        self.fills = literal_fills(function.instructions)  # Literals allocated at full length
+
+    def operand(self, operand):
+        if operand in self.pending:
+            return self.pending.pop(operand)
+        return self.generator.name(self.function, operand)
+
+    def atom(self, operand):
+        # Operands that the generated code may evaluate more than once
+        if operand in self.pending:
+            return f"({self.pending.pop(operand)})"
+        return self.generator.name(self.function, operand)
+
+    def expression(self, instruction):
+        op = instruction.op
+        args = instruction.args
+        if op == "copy":
+            return self.operand(args[0])
+        if op == "unary":
+            value = self.atom(args[0])
+            return f"-{value}" if instruction.operator == "-" else f"not {value}"
+        if op == "len":
+            return f"len({self.operand(args[0])})"
+        operator = instruction.operator
+        if operator == "/":
+            left = self.operand(args[0])
+            return f"runtime_div({left}, {self.operand(args[1])})"
+        if operator == "%":
+            # Python's % agrees with truncation for a non-negative dividend and positive divisor
+            left, right = self.atom(args[0]), self.atom(args[1])
+            if is_constant(args[1]) and type(constant_value(args[1])) is int and constant_value(args[1]) > 0:
+                return f"{left} % {right} if {left} >= 0 else runtime_mod({left}, {right})"
+            return f"{left} % {right} if {left} >= 0 and {right} > 0 else runtime_mod({left}, {right})"
+        left = self.atom(args[0])
+        return f"{left} {PYTHON_OPERATORS[operator]} {self.atom(args[1])}"
+
+    def overflow_test(self, instruction):
+        # Test on the result for when it left 32 bits, or None when it cannot. Adding or
+        # subtracting a constant can only go past one end, which is a single comparison.
+        operator = instruction.operator
+        if instruction.op == "unary":
+            return ABOVE if operator == "-" else None
+        if instruction.op != "binary" or operator not in ["+", "-", "*"]:
+            return None
+        right = instruction.args[1]
+        if operator == "*" or not is_constant(right) or type(constant_value(right)) is not int:
+            return OUTSIDE
+        step = constant_value(right) if operator == "+" else -constant_value(right)
+        return ABOVE if step > 0 else BELOW if step < 0 else None
+
+    def condition(self, instruction, taken):
+        # Test that is true when the jump is taken (or not taken, when taken is False)
+        if instruction.op == "ifrel":
+            operator = instruction.operator if taken else INVERTED[instruction.operator]
+            return f"{self.atom(instruction.args[0])} {operator} {self.atom(instruction.args[1])}"
+        value = self.atom(instruction.args[0])
+        jumps_when_true = instruction.op == "iftrue"
+        return value if jumps_when_true == taken else f"not {value}"
+
+    def statement(self, instruction, indent):
+        op = instruction.op
+        args = instruction.args
+        lines = []
+
+        # A pending argument that is about to be overwritten keeps its current value
+        for dest in instruction.defs():
+            for position, expression in enumerate(self.params):
+                if expression == self.generator.name(self.function, dest):
+                    self.snapshots += 1
+                    snapshot = f"_arg{self.snapshots}"
+                    lines.append(f"{indent}{snapshot} = {expression}")
+                    self.params[position] = snapshot
+
+        if op in ["binary", "unary", "copy", "len"]:
+            expression = self.expression(instruction)
+            test = self.overflow_test(instruction)
+            if instruction.dest in self.generator.inline:
+                if test is not None:
+                    expression = f"wrap_integer(_v) if {test.format(f'(_v := {expression})')} else _v"
+                self.pending[instruction.dest] = expression
+                return lines
+            dest = self.generator.name(self.function, instruction.dest)
+            lines.append(f"{indent}{dest} = {expression}")
+            if test is not None:
+                lines.append(f"{indent}if {test.format(dest)}: {dest} = wrap_integer({dest})")
+            loop = self.generator.vector_loops.get(id(instruction))
+            if loop is not None:
+                name = lambda operand: self.generator.name(self.function, operand)
+                lines += vectorized_prologue(loop, name, indent, INDENT, self.generator.max_iterations)
+        elif op == "param":
+            self.params.append(self.operand(args[0]))
+        elif op == "call":
+            count = instruction.args_count
+            arguments = self.params[len(self.params) - count:]
+            del self.params[len(self.params) - count:]
+            call = f"{self.generator.function_name(instruction.target)}({', '.join(arguments)})"
+            lines.append(f"{indent}{self.generator.name(self.function, instruction.dest)} = {call}")
+        elif op == "callvirt":
+            count = instruction.args_count
+            arguments = self.params[len(self.params) - count:]
+            del self.params[len(self.params) - count:]
+            call = f"({arguments[0]} or runtime_null())[0][{args[1]}]({', '.join(arguments)})"
+            lines.append(f"{indent}{self.generator.name(self.function, instruction.dest)} = {call}")
+        elif op == "new":
+            dest = self.generator.name(self.function, instruction.dest)
+            lines.append(f"{indent}{dest} = Record({self.generator.class_name(instruction.target)})")
+        elif op == "getfield":
+            dest = self.generator.name(self.function, instruction.dest)
+            lines.append(f"{indent}{dest} = ({self.atom(args[0])} or runtime_null())[{args[1]}]")
+        elif op == "setfield":
+            lines.append(f"{indent}({self.atom(args[0])} or runtime_null())[{args[1]}] = {self.operand(args[2])}")
+        elif op == "nullcheck":
+            lines.append(f"{indent}if {self.atom(args[0])} is None: runtime_null()")
+        elif op == "caught":
+            lines.append(f"{indent}{self.generator.name(self.function, instruction.dest)} = _caught")
+        elif op == "return":
+            value = self.operand(args[0]) if args else "None"
+            lines.append(f"{indent}return {value}")
+        elif op == "print":
+            value = self.operand(args[0])
+            if instruction.type == "string" and is_constant(args[0]):
+                lines.append(f"{indent}_out({constant_value(args[0]) + chr(10)!r})")
+            elif instruction.type == "boolean":
+                lines.append(f"{indent}_out('true\\n' if {value} else 'false\\n')")
+            elif value.isidentifier():
+                lines.append(f"{indent}_out(f'{{{value}}}\\n')")
+            else:
+                lines.append(f"{indent}_out(str({value}) + '\\n')")
+        elif op == "newarray":
+            typecode = ARRAY_TYPECODES.get(instruction.type)
+            length = self.fills.get(id(instruction), 0)
+            if typecode and length:
+                value = f"array('{typecode}', bytes({length * array(typecode).itemsize}))"
+            elif typecode:
+                value = f"array('{typecode}')"
+            else:
+                value = f"[None] * {length}" if length else "[]"
+            lines.append(f"{indent}{self.generator.name(self.function, instruction.dest)} = {value}")
+        elif op == "constarray":
+            dest = self.generator.name(self.function, instruction.dest)
+            lines.append(f"{indent}{dest} = {self.generator.array_name(instruction)}[:]")
+        elif op == "push":
+            if id(instruction) in self.fills:
+                lines.append(f"{indent}{self.operand(args[0])}[{self.fills[id(instruction)]}] = {self.operand(args[1])}")
+            else:
+                lines.append(f"{indent}{self.operand(args[0])}.append({self.operand(args[1])})")
+        elif op == "load":
+            values, index = self.atom(args[0]), self.atom(args[1])
+            dest = self.generator.name(self.function, instruction.dest)
+            if instruction.checked:
+                lines.append(f"{indent}{dest} = {values}[{index}] if 0 <= {index} < len({values}) "
+                             f"else runtime_bounds({values}, {index})")
+            else:
+                lines.append(f"{indent}{dest} = {values}[{index}]")
+        elif op == "store":
+            values, index = self.atom(args[0]), self.atom(args[1])
+            if instruction.checked:
+                lines.append(f"{indent}if not 0 <= {index} < len({values}): runtime_bounds({values}, {index})")
+            lines.append(f"{indent}{values}[{index}] = {self.operand(args[2])}")
+        elif op in ["label", "goto", "iffalse", "iftrue", "ifrel"]:
+            pass  # Control flow is rebuilt by the emitters
+        else:
+            raise PythonRuntimeError(f"cannot translate '{instruction}'")
+        return lines
+
+
+class StructuredEmitter:
+    # Rebuilds if/else and while from the CFG of a reducible function. A conditional
+    # becomes an if whose branches run until they meet again at its immediate
+    # post-dominator; a natural loop becomes 'while True' where edges back to the header
+    # are 'continue' and edges to its single exit are 'break'.
+    def __init__(self, generator, function, cfg):
+        self.generator = generator
+        self.cfg = cfg
+        self.translator = StatementTranslator(generator, function)
+        self.labels = {block.label(): block.index for block in cfg.blocks if block.label()}
+        # A try becomes a Python try around the blocks of its range: start block -> (end, catch)
+        self.tries = {self.labels[start]: (self.labels[end], self.labels[catch])
+                      for start, end, catch in function.handlers}
+        self.reachable = cfg.reachable([catch for _, catch in self.tries.values()])
+        self.postdominators = self.immediate_postdominators()
+        dominators = self.dominators()
+
+        # A loop is its natural loop plus the blocks a break runs before leaving it. Its
+        # follow is the exit the other exits lead to; the region is what the header
+        # dominates up to the follow.
+        self.loops = {}
+        for header, body in cfg.loops:
+            exits = {successor.index for index in body for successor in cfg.blocks[index].successors
+                     if successor.index not in body}
+            follow = max(sorted(exits), key=lambda candidate: sum(
+                1 for other in exits if candidate in self.postdominated_by(other)), default=None)
+            region = {index for index in self.reachable if header.index in dominators[index]
+                      and (follow is None or follow not in dominators[index])}
+            self.loops[header.index] = (region, follow)
+        self.emitted = set()
+
+    def dominators(self):
+        # The CFG's dominators, counting an edge from the start of every try to its catch block
+        entered_from = {}
+        for start, (_, catch) in self.tries.items():
+            entered_from.setdefault(catch, []).append(start)
+        nodes = sorted(self.reachable)
+        dominators = {index: set(nodes) for index in nodes}
+        dominators[0] = {0}
+        changed = True
+        while changed:
+            changed = False
+            for index in nodes[1:]:
+                predecessors = [block.index for block in self.cfg.blocks[index].predecessors
+                                if block.index in self.reachable]
+                predecessors += [start for start in entered_from.get(index, []) if start in self.reachable]
+                new = set.intersection(*[dominators[other] for other in predecessors]) if predecessors else set()
+                new = new | {index}
+                if new != dominators[index]:
+                    dominators[index] = new
+                    changed = True
+        return dominators
+
+    def postdominated_by(self, index):
+        chain = []
+        while index is not None:
+            chain.append(index)
+            index = self.postdominators[index]
+        return chain
+
+    def immediate_postdominators(self):
+        # Iterative postdominator sets with a virtual exit (None) after every block without successors
+        nodes = sorted(self.reachable)
+        everything = set(nodes) | {None}
+        postdominators = {index: set(everything) for index in nodes}
+        changed = True
+        while changed:
+            changed = False
+            for index in reversed(nodes):
+                successors = [successor.index for successor in self.cfg.blocks[index].successors]
+                sets = [postdominators[successor] for successor in successors] or [{None}]
+                new = set.intersection(*sets) | {index}
+                if new != postdominators[index]:
+                    postdominators[index] = new
+                    changed = True
+
+        immediate = {}
+        for index in nodes:
+            strict = postdominators[index] - {index}
+            candidates = [node for node in strict if node is not None and postdominators[node] == strict]
+            immediate[index] = candidates[0] if candidates else None
+        return immediate
+
+    def emit(self):
+        lines = self.path(0 if self.cfg.blocks else None, INDENT, loop=None, stop=None)
+        if self.translator.params or self.translator.pending:
+            raise NotStructured()
+        return lines
+
+    def successor(self, index):
+        following = index + 1
+        return following if following < len(self.cfg.blocks) else None
+
+    def path(self, node, indent, loop, stop):
+        # Statements for the blocks from node until stop, a jump out of the loop, or a return
+        lines = []
+        while node is not None and node != stop:
+            if loop is not None and node == loop[0]:
+                return lines + [f"{indent}continue"]
+            if loop is not None and node == loop[1]:
+                return lines + [f"{indent}break"]
+            if node in self.tries:
+                lines += self.try_statement(node, indent, loop)
+                node = self.tries[node][0]
+                continue
+            if node in self.loops:
+                lines += self.loop(node, indent)
+                node = self.loops[node][1]
+                continue
+            return lines + self.block(node, indent, loop, stop)
+        if node is None and indent != INDENT:
+            lines.append(f"{indent}return None")  # Nested code that runs off the end of the function
+        return lines
+
+    def loop(self, header, indent):
+        body, follow = self.loops[header]
+        context = (header, follow, body)
+        inner = indent + INDENT
+        lines = self.statements(header, inner)
+        last = self.last(header)
+        targets = [self.labels[last.target], self.successor(header)] if self.is_branch(last) else []
+        if lines or follow not in targets:
+            return ([f"{indent}while True:"] + self.generator.loop_guard(inner) + lines
+                    + self.terminator(header, inner, context))
+
+        # The header only tests the condition: a native while loop
+        stays = targets[1] if targets[0] == follow else targets[0]
+        condition = self.translator.condition(last, taken=targets[0] != follow)
+        statements = self.path(stays, inner, context, None)
+        if statements and statements[-1] == f"{inner}continue":
+            statements.pop()
+        return [f"{indent}while {condition}:"] + self.generator.loop_guard(inner) + statements
+
+    def try_statement(self, start, indent, loop):
+        # The protected blocks run up to the end of the range; the catch blocks up to where
+        # the code after the try resumes, right behind that end
+        end, catch = self.tries[start]
+        inner = indent + INDENT
+        body = self.block(start, inner, loop, end)
+        handler = self.path(catch, inner, loop, self.successor(end))
+        return ([f"{indent}try:"] + (body or [f"{inner}pass"])
+                + [f"{indent}except PythonException as _error:", f"{inner}_caught = str(_error)"] + handler)
+
+    def last(self, index):
+        instructions = self.cfg.blocks[index].instructions
+        return instructions[-1] if instructions else None
+
+    def is_branch(self, instruction):
+        return instruction is not None and instruction.op in ["iffalse", "iftrue", "ifrel"]
+
+    def statements(self, index, indent):
+        if index in self.emitted:
+            raise NotStructured()
+        self.emitted.add(index)
+        lines = []
+        for instruction in self.cfg.blocks[index].instructions:
+            lines += self.translator.statement(instruction, indent)
+        return lines
+
+    def block(self, index, indent, loop, stop=None):
+        return self.statements(index, indent) + self.terminator(index, indent, loop, stop)
+
+    def terminator(self, index, indent, loop, stop=None):
+        # Where control goes after the statements of a block
+        last = self.last(index)
+        if last is not None and last.op == "return":
+            return []
+        if last is not None and last.op == "goto":
+            return self.path(self.labels[last.target], indent, loop, stop)
+        if not self.is_branch(last):
+            return self.path(self.successor(index), indent, loop, stop)
+
+        # Both branches run up to the merge point, unless it lies outside the current loop
+        merge = self.postdominators[index]
+        if loop is not None and merge is not None and merge not in loop[2] and merge != loop[1]:
+            merge = None
+        inner = merge if merge is not None else stop
+        taken = self.path(self.labels[last.target], indent + INDENT, loop, inner)
+        fallthrough = self.path(self.successor(index), indent + INDENT, loop, inner)
+        if fallthrough:
+            lines = [f"{indent}if {self.translator.condition(last, taken=False)}:"] + fallthrough
+            if taken:
+                lines += [f"{indent}else:"] + taken
+        elif taken:
+            lines = [f"{indent}if {self.translator.condition(last, taken=True)}:"] + taken
+        else:
+            lines = []
+            self.translator.condition(last, taken=True)  # Consumes an inlined test
+        if merge is None:
+            return lines
+        return lines + self.path(merge, indent, loop, stop)
+
+
+def compile_program(path, vectorize=True):
+    # PythonGenerator for a .cps file, or None after printing its errors
+    from antlr4 import FileStream
+    from Driver import analyze
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(FileStream(path, encoding="utf-8"))
+    errors = syntax_errors + visitor.errors
+    for error in errors:
+        print(error)
+    if errors:
+        return None
+    return PythonGenerator(visitor.generated_code, visitor.symbol_table, vectorize=vectorize)
+
+
+def main(argv):
+    # python3 PythonGenerator.py program.cps ... [--source] [--vectorize=off]
+    from Driver import parse_options
+
+    options, arguments = parse_options(argv)
+    failed = False
+    for path in arguments:
+        print(f"== {path}")
+        generator = compile_program(path, options.get("vectorize") != "off")
+        if generator is None:
+            failed = True
+            continue
+        generator.compile()
+        if "source" in options:
+            print(generator.source)
+
+        start = time.perf_counter()
+        try:
+            output = generator.run()
+        except PythonRuntimeError as error:
+            print("".join(generator.output), end="")
+            print(f"runtime error: {error}")
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        print(output, end="")
+        print(f"-- {generator.stats['structured']} structured, {generator.stats['dispatch']} dispatch "
+              f"functions, {generator.stats['vectorized']} vectorized loops, ran in {elapsed * 1000:.1f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
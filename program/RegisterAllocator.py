@@ -0,0 +1,567 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from ControlFlowGraph import ControlFlowGraph
+from MipsInstruction import MipsInstruction, ALLOCATABLE_REGISTERS, CALLEE_SAVED, is_virtual
+
+MAX_ROUNDS = 20
+REMATERIALIZABLE = ["li", "la"]
+
+
+class AllocationError(Exception):
+    pass
+
+
+class GraphColoringAllocator:
+    # Chaitin-Briggs allocator with iterated conservative coalescing (Briggs and George tests),
+    # loop-depth weighted spill costs and rematerialization of constant definitions.
+    def __init__(self, instructions, frame, colors=None):
+        self.instructions = list(instructions)
+        self.frame = frame
+        self.colors = list(colors or ALLOCATABLE_REGISTERS)
+        self.K = len(self.colors)
+        self.no_spill = set()  # Short-lived temporaries introduced by spill code
+        self.stats = {"spilled": 0, "rematerialized": 0, "coalesced": 0, "rounds": 0}
+
+    def allocate(self):
+        # Returns the rewritten instruction list and the vreg -> register mapping
+        for _ in range(MAX_ROUNDS):
+            self.stats["rounds"] += 1
+            spilled = self.run_round()
+            if not spilled:
+                self.stats["coalesced"] = len(self.coalesced_moves)
+                return self.apply_coloring(), self.coloring()
+            self.rewrite_program(spilled)
+
+        raise AllocationError("register allocation did not converge")
+
+    # ***********************
+    # *** Graph building  ***
+    # ***********************
+
+    def is_node(self, register):
+        return is_virtual(register) or register in self.precolored
+
+    def run_round(self):
+        self.precolored = set(self.colors)
+        self.initial = set()
+        self.adj_set = set()
+        self.adj_list = {}
+        self.degree = {}
+        self.move_list = {}
+        self.moves = {}
+        self.cost = {}
+        self.worklist_moves, self.active_moves = set(), set()
+        self.coalesced_moves, self.constrained_moves, self.frozen_moves = set(), set(), set()
+        self.simplify_worklist, self.freeze_worklist, self.spill_worklist = set(), set(), set()
+        self.alias, self.color = {}, {register: register for register in self.colors}
+        self.select_stack, self.coalesced_nodes, self.colored_nodes, self.spilled_nodes = [], set(), set(), set()
+        self.selected = set()  # Mirror of select_stack for fast membership tests
+
+        self.build()
+        self.make_worklist()
+
+        while self.simplify_worklist or self.worklist_moves or self.freeze_worklist or self.spill_worklist:
+            if self.simplify_worklist:
+                self.simplify()
+            elif self.worklist_moves:
+                self.coalesce()
+            elif self.freeze_worklist:
+                self.freeze()
+            else:
+                self.select_spill()
+
+        self.assign_colors()
+        return self.spilled_nodes
+
+    def add_node(self, node):
+        if node not in self.adj_list:
+            self.adj_list[node] = set()
+            self.degree[node] = 0
+            self.move_list[node] = set()
+            self.cost[node] = 0
+            if node not in self.precolored:
+                self.initial.add(node)
+
+    def add_edge(self, u, v):
+        if u == v or (u, v) in self.adj_set:
+            return
+        self.adj_set.add((u, v))
+        self.adj_set.add((v, u))
+        if u not in self.precolored:
+            self.adj_list[u].add(v)
+            self.degree[u] += 1
+        if v not in self.precolored:
+            self.adj_list[v].add(u)
+            self.degree[v] += 1
+
+    def build(self):
+        cfg = ControlFlowGraph(self.instructions)
+        cfg.compute_liveness()
+        self.definitions = {}
+
+        for block in cfg.blocks:
+            weight = 10 ** block.loop_depth
+            live = {node for node in block.live_out if self.is_node(node)}
+
+            for instruction in reversed(block.instructions):
+                uses = [node for node in instruction.uses() if self.is_node(node)]
+                defs = [node for node in instruction.defs() if self.is_node(node)]
+                for node in uses + defs:
+                    self.add_node(node)
+                    self.cost[node] += weight
+                for node in defs:
+                    self.definitions.setdefault(node, []).append(instruction)
+
+                if instruction.is_move() and uses and defs:
+                    live -= set(uses)
+                    move = id(instruction)
+                    self.moves[move] = (defs[0], uses[0])
+                    for node in defs + uses:
+                        self.move_list[node].add(move)
+                    self.worklist_moves.add(move)
+
+                live |= set(defs)
+                for d in defs:
+                    for node in live:
+                        self.add_node(node)
+                        self.add_edge(node, d)
+                live = set(uses) | (live - set(defs))
+
+    def make_worklist(self):
+        for node in self.initial:
+            if self.degree[node] >= self.K:
+                self.spill_worklist.add(node)
+            elif self.move_related(node):
+                self.freeze_worklist.add(node)
+            else:
+                self.simplify_worklist.add(node)
+        self.initial = set()
+
+    def adjacent(self, node):
+        return self.adj_list[node] - self.selected - self.coalesced_nodes
+
+    def node_moves(self, node):
+        return self.move_list[node] & (self.active_moves | self.worklist_moves)
+
+    def move_related(self, node):
+        return bool(self.node_moves(node))
+
+    # *************************************
+    # *** Simplify, coalesce and freeze ***
+    # *************************************
+
+    def simplify(self):
+        node = self.simplify_worklist.pop()
+        self.select_stack.append(node)
+        self.selected.add(node)
+        for neighbor in self.adjacent(node):
+            self.decrement_degree(neighbor)
+
+    def decrement_degree(self, node):
+        if node in self.precolored:
+            return
+        degree = self.degree[node]
+        self.degree[node] = degree - 1
+        if degree == self.K:
+            self.enable_moves({node} | self.adjacent(node))
+            self.spill_worklist.discard(node)
+            if self.move_related(node):
+                self.freeze_worklist.add(node)
+            else:
+                self.simplify_worklist.add(node)
+
+    def enable_moves(self, nodes):
+        for node in nodes:
+            for move in self.node_moves(node):
+                if move in self.active_moves:
+                    self.active_moves.remove(move)
+                    self.worklist_moves.add(move)
+
+    def get_alias(self, node):
+        while node in self.coalesced_nodes:
+            node = self.alias[node]
+        return node
+
+    def add_work_list(self, node):
+        if node not in self.precolored and not self.move_related(node) and self.degree[node] < self.K:
+            self.freeze_worklist.discard(node)
+            self.simplify_worklist.add(node)
+
+    def george(self, t, r):
+        # t can be merged with precolored r if it is insignificant or already interferes with r
+        return self.degree[t] < self.K or t in self.precolored or (t, r) in self.adj_set
+
+    def briggs(self, nodes):
+        # The combined node has fewer than K neighbors of significant degree
+        significant = sum(1 for node in nodes if node in self.precolored or self.degree[node] >= self.K)
+        return significant < self.K
+
+    def coalesce(self):
+        move = self.worklist_moves.pop()
+        x, y = (self.get_alias(node) for node in self.moves[move])
+        u, v = (y, x) if y in self.precolored else (x, y)
+
+        if u == v:
+            self.coalesced_moves.add(move)
+            self.add_work_list(u)
+        elif v in self.precolored or (u, v) in self.adj_set:
+            self.constrained_moves.add(move)
+            self.add_work_list(u)
+            self.add_work_list(v)
+        elif (u in self.precolored and all(self.george(t, u) for t in self.adjacent(v))) or \
+                (u not in self.precolored and self.briggs(self.adjacent(u) | self.adjacent(v))):
+            self.coalesced_moves.add(move)
+            self.combine(u, v)
+            self.add_work_list(u)
+        else:
+            self.active_moves.add(move)
+
+    def combine(self, u, v):
+        if v in self.freeze_worklist:
+            self.freeze_worklist.remove(v)
+        else:
+            self.spill_worklist.discard(v)
+        self.coalesced_nodes.add(v)
+        self.alias[v] = u
+        self.move_list[u] |= self.move_list[v]
+        self.cost[u] += self.cost[v]
+        self.enable_moves({v})
+        for t in self.adjacent(v):
+            self.add_edge(t, u)
+            self.decrement_degree(t)
+        if u not in self.precolored and self.degree[u] >= self.K and u in self.freeze_worklist:
+            self.freeze_worklist.remove(u)
+            self.spill_worklist.add(u)
+
+    def freeze(self):
+        node = self.freeze_worklist.pop()
+        self.simplify_worklist.add(node)
+        self.freeze_moves(node)
+
+    def freeze_moves(self, u):
+        for move in self.node_moves(u):
+            x, y = self.moves[move]
+            v = self.get_alias(x) if self.get_alias(y) == self.get_alias(u) else self.get_alias(y)
+            self.active_moves.discard(move)
+            self.worklist_moves.discard(move)
+            self.frozen_moves.add(move)
+            if v not in self.precolored and not self.move_related(v) and self.degree[v] < self.K:
+                self.freeze_worklist.discard(v)
+                self.simplify_worklist.add(v)
+
+    # ****************************
+    # *** Spilling and colours ***
+    # ****************************
+
+    def spill_priority(self, node):
+        if node in self.no_spill:
+            return float("inf")
+        cost = self.cost[node]
+        # Rematerializing only re-executes the defining li/la, there is no store and no load
+        if self.rematerialization(node) is not None:
+            cost /= 4
+        return cost / max(self.degree[node], 1)
+
+    def select_spill(self):
+        node = min(self.spill_worklist, key=self.spill_priority)
+        self.spill_worklist.remove(node)
+        self.simplify_worklist.add(node)
+        self.freeze_moves(node)
+
+    def assign_colors(self):
+        while self.select_stack:
+            node = self.select_stack.pop()
+            ok_colors = list(self.colors)
+            for neighbor in self.adj_list[node]:
+                alias = self.get_alias(neighbor)
+                if (alias in self.colored_nodes or alias in self.precolored) and self.color[alias] in ok_colors:
+                    ok_colors.remove(self.color[alias])
+            if not ok_colors:
+                self.spilled_nodes.add(node)
+            else:
+                self.colored_nodes.add(node)
+                self.color[node] = ok_colors[0]
+
+        for node in self.coalesced_nodes:
+            self.color[node] = self.color[self.get_alias(node)]
+
+    def rematerialization(self, node):
+        # The defining instruction if node is only ever set by a single li/la
+        definitions = self.definitions.get(node, [])
+        if len(definitions) == 1 and definitions[0].op in REMATERIALIZABLE:
+            return definitions[0]
+        return None
+
+    def rewrite_program(self, spilled):
+        counter = [0]
+
+        def fresh(node):
+            counter[0] += 1
+            name = f"{node}.s{self.stats['rounds']}_{counter[0]}"
+            self.no_spill.add(name)
+            return name
+
+        for node in spilled:
+            definition = self.rematerialization(node)
+            slot = None
+            if definition is None:
+                slot = self.frame.allocate_spill_slot()
+                self.stats["spilled"] += 1
+            else:
+                self.stats["rematerialized"] += 1
+
+            rewritten = []
+            for instruction in self.instructions:
+                if instruction is definition:
+                    continue
+                uses, defs = node in instruction.uses(), node in instruction.defs()
+                if not uses and not defs:
+                    rewritten.append(instruction)
+                    continue
+
+                temp = fresh(node)
+                if uses:
+                    if definition is not None:
+                        rewritten.append(MipsInstruction(definition.op, temp, definition.operands[1], comment="remat"))
+                    else:
+                        rewritten.append(MipsInstruction("lw", temp, slot, comment="reload"))
+                instruction.replace_registers({node: temp})
+                rewritten.append(instruction)
+                if defs:
+                    rewritten.append(MipsInstruction("sw", temp, slot, comment="spill"))
+            self.instructions = rewritten
+
+    def coloring(self):
+        return {node: color for node, color in self.color.items() if is_virtual(node)}
+
+    def apply_coloring(self):
+        mapping = self.coloring()
+        result = []
+        for instruction in self.instructions:
+            instruction.replace_registers(mapping)
+            # Moves between coalesced nodes become no-ops
+            if instruction.is_move() and instruction.operands[0] == instruction.operands[1]:
+                continue
+            result.append(instruction)
+        return result
+
+
+class Interval:
+    def __init__(self, vreg):
+        self.vreg = vreg
+        self.start = None
+        self.end = None
+        self.positions = []  # Positions where the vreg is read or written
+        self.register = None
+        self.hint = None     # Source of the move that defines this vreg, if any
+
+    def extend(self, position):
+        if self.start is None or position < self.start:
+            self.start = position
+        if self.end is None or position > self.end:
+            self.end = position
+
+    def next_use(self, position):
+        index = bisect_left(self.positions, position)
+        return self.positions[index] if index < len(self.positions) else float("inf")
+
+    def __lt__(self, other):
+        return self.end < other.end
+
+
+class LinearScanAllocator:
+    # Poletto-Sarkar linear scan over live intervals of the linearized code.
+    # When registers run out the interval whose next use is farthest away is split:
+    # it keeps its register up to the current point and is reloaded afterwards.
+    # Each scan sorts the intervals once and keeps the active set in a heap, O(n log n).
+    def __init__(self, instructions, frame, colors=None):
+        self.instructions = list(instructions)
+        self.frame = frame
+        self.colors = list(colors or ALLOCATABLE_REGISTERS)
+        self.no_spill = set()
+        self.stats = {"spilled": 0, "rematerialized": 0, "coalesced": 0, "split": 0, "rounds": 0}
+
+    def allocate(self):
+        for _ in range(MAX_ROUNDS):
+            self.stats["rounds"] += 1
+            intervals = self.build_intervals()
+            splits = self.scan(intervals)
+            if not splits:
+                self.assignment = {vreg: interval.register for vreg, interval in intervals.items()}
+                return self.apply_assignment(), dict(self.assignment)
+            self.rewrite_program(intervals, splits)
+
+        raise AllocationError("register allocation did not converge")
+
+    def build_intervals(self):
+        # Instruction i reads its operands at position 2i and writes its results at 2i + 1,
+        # so a value dying at i can share a register with one born at i
+        cfg = ControlFlowGraph(self.instructions)
+        cfg.compute_liveness()
+
+        intervals = {}
+        self.calls = []
+        self.block_entries = {}  # Index of each block's first instruction -> live-in vregs
+        self.definitions = {}
+
+        def interval(vreg):
+            if vreg not in intervals:
+                intervals[vreg] = Interval(vreg)
+            return intervals[vreg]
+
+        def touch(vreg, position):
+            current = interval(vreg)
+            current.extend(position)
+            current.positions.append(position)
+
+        index = 0
+        for block in cfg.blocks:
+            live_in = {vreg for vreg in block.live_in if is_virtual(vreg)}
+            self.block_entries[index] = live_in
+            for vreg in live_in:
+                interval(vreg).extend(2 * index)
+
+            for instruction in block.instructions:
+                for vreg in set(instruction.uses()):
+                    if is_virtual(vreg):
+                        touch(vreg, 2 * index)
+                for vreg in set(instruction.defs()):
+                    if is_virtual(vreg):
+                        touch(vreg, 2 * index + 1)
+                        self.definitions.setdefault(vreg, []).append(instruction)
+                if instruction.is_move() and is_virtual(instruction.operands[0]):
+                    interval(instruction.operands[0]).hint = instruction.operands[1]
+                if instruction.op in ["jal", "jalr"]:
+                    self.calls.append(2 * index)
+                index += 1
+
+            for vreg in block.live_out:
+                if is_virtual(vreg):
+                    interval(vreg).extend(2 * index - 1)
+
+        return intervals
+
+    def crosses_call(self, interval):
+        # A call strictly inside the interval clobbers every caller-saved register
+        index = bisect_right(self.calls, interval.start)
+        return index < len(self.calls) and self.calls[index] + 1 < interval.end
+
+    def scan(self, intervals):
+        free = set(self.colors)
+        active = []     # Heap of intervals ordered by end
+        splits = {}     # vreg -> index of the first instruction where it no longer has a register
+
+        for current in sorted(intervals.values(), key=lambda interval: interval.start):
+            while active and active[0].end < current.start:
+                expired = heapq.heappop(active)
+                if expired.vreg not in splits:
+                    free.add(expired.register)
+
+            allowed = [r for r in self.colors if r in CALLEE_SAVED] if self.crosses_call(current) else self.colors
+            hinted = intervals.get(current.hint)
+            if hinted is not None and hinted.register in free and hinted.register in allowed:
+                register = hinted.register
+            else:
+                register = next((r for r in allowed if r in free), None)
+
+            if register is not None:
+                current.register = register
+                free.remove(register)
+                heapq.heappush(active, current)
+                continue
+
+            # No register left: evict whichever candidate is needed farthest in the future
+            candidates = [interval for interval in active
+                          if interval.vreg not in splits and interval.register in allowed
+                          and interval.vreg not in self.no_spill]
+            if current.vreg not in self.no_spill:
+                candidates.append(current)
+            if not candidates:
+                raise AllocationError(f"no register available for {current.vreg}")
+            victim = max(candidates, key=lambda interval: interval.next_use(current.start + 1))
+
+            splits[victim.vreg] = current.start // 2
+            if victim is not current:
+                current.register = victim.register
+                heapq.heappush(active, current)
+
+        return splits
+
+    def rematerialization(self, vreg):
+        definitions = self.definitions.get(vreg, [])
+        if len(definitions) == 1 and definitions[0].op in REMATERIALIZABLE:
+            return definitions[0]
+        return None
+
+    def rewrite_program(self, intervals, splits):
+        # Up to the split point the vreg keeps its register, stores every new value to its
+        # slot and reloads it where a jump may enter; afterwards every use reloads a temp.
+        counter = [0]
+
+        def fresh(vreg):
+            counter[0] += 1
+            name = f"{vreg}.l{self.stats['rounds']}_{counter[0]}"
+            self.no_spill.add(name)
+            return name
+
+        def reload(vreg, target):
+            definition = remat[vreg]
+            if definition is not None:
+                return MipsInstruction(definition.op, target, definition.operands[1], comment="remat")
+            return MipsInstruction("lw", target, slots[vreg], comment="reload")
+
+        remat, slots = {}, {}
+        for vreg, split in splits.items():
+            remat[vreg] = self.rematerialization(vreg)
+            if remat[vreg] is None:
+                slots[vreg] = self.frame.allocate_spill_slot()
+                self.stats["spilled"] += 1
+            else:
+                self.stats["rematerialized"] += 1
+            if split > intervals[vreg].start // 2:
+                self.stats["split"] += 1
+
+        rewritten = []
+        for index, instruction in enumerate(self.instructions):
+            entry, before, after, mapping = [], [], [], {}
+            uses, defs = instruction.uses(), instruction.defs()
+
+            for vreg, split in splits.items():
+                first_segment = intervals[vreg].start // 2 <= index < split
+                if first_segment and vreg in self.block_entries.get(index, ()):
+                    entry.append(reload(vreg, vreg))
+                if vreg not in uses and vreg not in defs:
+                    continue
+                if first_segment:
+                    if vreg in defs and remat[vreg] is None:
+                        after.append(MipsInstruction("sw", vreg, slots[vreg], comment="spill"))
+                    continue
+                temp = fresh(vreg)
+                mapping[vreg] = temp
+                if vreg in uses:
+                    before.append(reload(vreg, temp))
+                if vreg in defs and remat[vreg] is None:
+                    after.append(MipsInstruction("sw", temp, slots[vreg], comment="spill"))
+
+            if mapping:
+                instruction.replace_registers(mapping)
+            # Reloads at a block entry go after its label
+            if instruction.label_name() is not None:
+                rewritten += [instruction] + entry + before + after
+            else:
+                rewritten += entry + before + [instruction] + after
+        self.instructions = rewritten
+
+    def apply_assignment(self):
+        result = []
+        for instruction in self.instructions:
+            instruction.replace_registers(self.assignment)
+            if instruction.is_move() and instruction.operands[0] == instruction.operands[1]:
+                self.stats["coalesced"] += 1
+                continue
+            result.append(instruction)
+        return result
+
+
+ALLOCATORS = {"graph": GraphColoringAllocator, "linear": LinearScanAllocator}
+
@@ -0,0 +1,212 @@
+from ControlFlowGraph import ControlFlowGraph
+from MipsInstruction import MipsInstruction, Mem, is_register, is_virtual
+
+COMPARE_BRANCHES = {"blt", "ble", "bgt", "bge", "beq", "bne"}
+ZERO_BRANCHES = {"bltz": "blt", "blez": "ble", "bgtz": "bgt", "bgez": "bge", "beqz": "beq", "bnez": "bne"}
+MAX_IMMEDIATE = 32767
+
+
+class StrengthReduction:
+    # Induction-variable strength reduction on selected code, before register allocation.
+    # In a loop without calls, a counter that is only ever "addiu i, i, c" drives element
+    # addresses "data + (i << k)"; each such address becomes a pointer set up before the
+    # loop and advanced by c << k right after the counter. When the counter is then only
+    # used by the loop test, the test compares the pointer against an end pointer instead
+    # and the counter disappears. The setup runs behind a copy of the loop test, so a loop
+    # that never runs reads nothing.
+    def __init__(self, code, new_vreg):
+        self.code = code
+        self.new_vreg = new_vreg
+        self.stats = {"pointers": 0, "tests": 0}
+
+    def run(self):
+        headers = [block.label() for block, _ in ControlFlowGraph(self.code).loops]
+        for label in headers:
+            cfg = ControlFlowGraph(self.code)
+            for header, body in cfg.loops:
+                if header.label() == label:
+                    self.reduce_loop(cfg, header, body)
+                    break
+        return self.code
+
+    def reduce_loop(self, cfg, header, body):
+        blocks = [cfg.blocks[index] for index in sorted(body)]
+        loop = [instruction for block in blocks for instruction in block.instructions]
+        if any(instruction.op in ["jal", "jalr"] for instruction in loop):
+            return  # A call may push to an array and move its elements
+
+        # The only way in is falling through from the block right before the header, and
+        # the header is nothing but the test that leaves the loop
+        outside = [block for block in header.predecessors if block.index not in body]
+        if len(outside) != 1 or outside[0].index != header.index - 1 or len(header.instructions) != 2:
+            return
+        preheader = outside[0]
+        last = preheader.instructions[-1] if preheader.instructions else None
+        if last is not None and (not last.falls_through() or header.label() in last.jump_targets()):
+            return
+        test = header.instructions[1]
+        exits = [block for block in header.successors if block.index not in body]
+        if ((test.op not in COMPARE_BRANCHES and test.op not in ZERO_BRANCHES) or len(exits) != 1
+                or exits[0].label() != test.operands[-1]):
+            return
+
+        definitions = {}
+        for instruction in loop:
+            for register in instruction.defs():
+                definitions.setdefault(register, []).append(instruction)
+        counters = {}  # Register -> its increment
+        for register, defined in definitions.items():
+            step = defined[0]
+            if (is_virtual(register) and len(defined) == 1 and step.op == "addiu"
+                    and step.operands[1] == register and isinstance(step.operands[2], int)):
+                counters[register] = step
+
+        groups = {}  # (counter, shift, base) -> addresses, as (block, addu)
+        for block in blocks:
+            for position, instruction in enumerate(block.instructions):
+                key = self.address(block, position, instruction, counters, definitions)
+                if key is not None:
+                    groups.setdefault(key, []).append((block, instruction))
+        if not groups:
+            return
+
+        # Setup, behind a copy of the test: from here on the loop runs at least once
+        setup = [MipsInstruction(test.op, *test.operands)]
+        pointers = {}
+        for key, addresses in groups.items():
+            counter, shift, base = key
+            if base[0] == "data":
+                data = self.new_vreg()
+                setup.append(MipsInstruction("lw", data, Mem(8, base[1])))
+            else:
+                data = base[1]
+            scaled, pointer = self.new_vreg(), self.new_vreg()
+            setup.append(MipsInstruction("sll", scaled, counter, shift))
+            setup.append(MipsInstruction("addu", pointer, data, scaled))
+            pointers[key] = (pointer, data)
+
+            step = counters[counter]
+            advance = MipsInstruction("addiu", pointer, pointer, step.operands[2] << shift)
+            advance.line = step.line
+            self.code.insert(self.code.index(step) + 1, advance)
+            for block, addu in addresses:
+                old = addu.operands[0]
+                for instruction in block.instructions:
+                    instruction.operands = [Mem(operand.offset, pointer)
+                                            if isinstance(operand, Mem) and operand.base == old else operand
+                                            for operand in instruction.operands]
+                self.code.remove(addu)
+                self.stats["pointers"] += 1
+        self.remove_dead(loop)
+        self.replace_test(cfg, blocks, test, counters, pointers, setup, exits[0])
+
+        for instruction in setup:
+            instruction.line = test.line
+        position = self.code.index(header.instructions[0])
+        self.code[position:position] = setup
+
+    def address(self, block, position, instruction, counters, definitions):
+        # (counter, shift, base) when instruction is "addu p, data, s" with s = counter << shift
+        # computed earlier in the block, and p only used as a memory base after it in the block
+        # while the counter keeps its value
+        if instruction.op != "addu" or not is_virtual(instruction.operands[0]):
+            return None
+        earlier = block.instructions[:position]
+        for scaled, data in [instruction.operands[1:], reversed(instruction.operands[1:])]:
+            shift = next((item for item in reversed(earlier) if scaled in item.defs()), None)
+            if (shift is None or shift.op != "sll" or shift.operands[1] not in counters
+                    or len(definitions.get(scaled, [])) != 1):
+                continue
+            counter = shift.operands[1]
+            between = earlier[earlier.index(shift) + 1:]
+            if any(counter in item.defs() for item in between):
+                continue
+            base = self.base(data, earlier, definitions)
+            if base is None:
+                continue
+            if not self.only_addressed(instruction.operands[0], block, position, counter, definitions):
+                continue
+            return counter, shift.operands[2], base
+        return None
+
+    def base(self, data, earlier, definitions):
+        # ("reg", r) for a register the loop never writes, ("data", array) for the element
+        # pointer of an array the loop never reassigns, loaded earlier in the block
+        if not is_register(data):
+            return None
+        if data not in definitions:
+            return ("reg", data)
+        load = definitions[data][0]
+        if (len(definitions[data]) == 1 and load.op == "lw" and any(item is load for item in earlier)
+                and isinstance(load.operands[1], Mem) and load.operands[1].offset == 8
+                and is_virtual(load.operands[1].base) and load.operands[1].base not in definitions):
+            return ("data", load.operands[1].base)
+        return None
+
+    def only_addressed(self, register, block, position, counter, definitions):
+        if len(definitions.get(register, [])) != 1:
+            return False
+        users = [instruction for instruction in self.code if register in instruction.uses()]
+        later = block.instructions[position + 1:]
+        for instruction in users:
+            if not any(item is instruction for item in later):
+                return False
+            if register in instruction.extra_uses or register in [operand for operand in instruction.operands
+                                                                  if not isinstance(operand, Mem)]:
+                return False
+            if any(counter in item.defs() for item in later[:later.index(instruction)]):
+                return False
+        return True
+
+    def replace_test(self, cfg, blocks, test, counters, pointers, setup, exit_block):
+        # Compare the pointer against its value at the limit when the counter has no other use
+        cfg.compute_liveness()
+        remaining = {id(instruction) for instruction in self.code}
+        loop = [instruction for block in blocks for instruction in block.instructions if id(instruction) in remaining]
+        # A loop left only through its test runs the counter all the way to the limit, so the
+        # element at the limit is in memory and the end pointer does not wrap around
+        inside = {block.index for block in blocks}
+        single_exit = all(successor.index in inside for block in blocks
+                          if not any(item is test for item in block.instructions) for successor in block.successors)
+        operands = test.operands[:-1]
+        if test.op in ZERO_BRANCHES:
+            operands.append(0)
+        for (counter, shift, _), (pointer, data) in pointers.items():
+            if counter not in operands or counter in exit_block.live_in:
+                continue
+            limit = operands[1] if operands[0] == counter else operands[0]
+            if is_register(limit) and any(limit in instruction.defs() for instruction in loop):
+                continue
+            step = counters[counter]
+            users = [instruction for instruction in loop
+                     if counter in instruction.uses() and instruction is not test and instruction is not step]
+            if users:
+                continue
+
+            end = self.new_vreg()
+            if limit == 0:
+                end = data
+            elif isinstance(limit, int) and abs(limit << shift) <= MAX_IMMEDIATE:
+                setup.append(MipsInstruction("addiu", end, data, limit << shift))
+            elif is_register(limit) and single_exit:
+                scaled = self.new_vreg()
+                setup += [MipsInstruction("sll", scaled, limit, shift), MipsInstruction("addu", end, data, scaled)]
+            else:
+                continue
+            test.op = ZERO_BRANCHES.get(test.op, test.op)
+            test.operands = [pointer if operand == counter else end for operand in operands] + test.operands[-1:]
+            self.code.remove(step)
+            self.stats["tests"] += 1
+            return
+
+    def remove_dead(self, loop):
+        # Shifts and element pointer loads of the loop that nothing reads any more
+        changed = True
+        while changed:
+            changed = False
+            used = {register for instruction in self.code for register in instruction.uses()}
+            for instruction in loop:
+                if (instruction.op in ["sll", "lw"] and instruction.defs() and is_virtual(instruction.defs()[0])
+                        and instruction.defs()[0] not in used and any(item is instruction for item in self.code)):
+                    self.code.remove(instruction)
+                    changed = True
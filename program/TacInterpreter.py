@@ -0,0 +1,625 @@
+import sys
+import io
+import time
+import math
+import contextlib
+from array import array
+from collections import OrderedDict
+from ThreeAddressCode import TACProgram, HandlerTable, is_constant, constant_value, constant_array, literal_fills, ARRAY_TYPECODES
+from ThreeAddressCode import wrap_integer, run_deep, INT_MIN, INT_MAX, MAX_CALL_DEPTH
+from ClassLayout import Record
+
+RESULT = 0  # Frame slot that receives the value of a return; parameters follow it
+MEMO_ENTRIES = 65536  # Results a memo table keeps before it evicts the least recently used
+FRAMES_PER_CALL = 4  # Python calls per program call: invoke, the call handler and the profiling wrappers
+
+
+class TacRuntimeError(Exception):
+    pass
+
+
+class TacException(TacRuntimeError):
+    # A runtime error of the program itself, which a catch block can handle. Running out
+    # of iterations or call stack stops the interpreter instead.
+    pass
+
+
+def truncated_division(x, y):
+    # Integer division rounds toward zero, like the MIPS div instruction
+    if y == 0:
+        raise TacException("division by zero")
+    quotient = abs(x) // abs(y)
+    return -quotient if (x < 0) != (y < 0) else quotient
+
+
+# ******************************
+# *** Instruction handlers   ***
+# ******************************
+# Every handler takes (frame, a, b, c, next) and returns the index of the next
+# instruction; a, b and c are frame slots unless the compiler says otherwise.
+
+def op_copy(frame, a, b, c, nxt):
+    frame[a] = frame[b]
+    return nxt
+
+
+def op_add(frame, a, b, c, nxt):
+    value = frame[b] + frame[c]
+    frame[a] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+    return nxt
+
+
+def op_sub(frame, a, b, c, nxt):
+    value = frame[b] - frame[c]
+    frame[a] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+    return nxt
+
+
+def op_mul(frame, a, b, c, nxt):
+    value = frame[b] * frame[c]
+    frame[a] = value if INT_MIN <= value <= INT_MAX else wrap_integer(value)
+    return nxt
+
+
+def op_div(frame, a, b, c, nxt):
+    x, y = frame[b], frame[c]
+    if type(x) is int and type(y) is int:
+        frame[a] = wrap_integer(truncated_division(x, y))  # Only -2**31 / -1 overflows
+    elif y == 0:
+        raise TacException("division by zero")
+    else:
+        frame[a] = x / y
+    return nxt
+
+
+def op_mod(frame, a, b, c, nxt):
+    x, y = frame[b], frame[c]
+    if type(x) is int and type(y) is int:
+        frame[a] = x - truncated_division(x, y) * y
+    elif y == 0:
+        raise TacException("division by zero")
+    else:
+        frame[a] = math.fmod(x, y)
+    return nxt
+
+
+def op_lt(frame, a, b, c, nxt):
+    frame[a] = frame[b] < frame[c]
+    return nxt
+
+
+def op_le(frame, a, b, c, nxt):
+    frame[a] = frame[b] <= frame[c]
+    return nxt
+
+
+def op_gt(frame, a, b, c, nxt):
+    frame[a] = frame[b] > frame[c]
+    return nxt
+
+
+def op_ge(frame, a, b, c, nxt):
+    frame[a] = frame[b] >= frame[c]
+    return nxt
+
+
+def op_eq(frame, a, b, c, nxt):
+    frame[a] = frame[b] == frame[c]
+    return nxt
+
+
+def op_ne(frame, a, b, c, nxt):
+    frame[a] = frame[b] != frame[c]
+    return nxt
+
+
+def op_and(frame, a, b, c, nxt):
+    frame[a] = frame[b] and frame[c]
+    return nxt
+
+
+def op_or(frame, a, b, c, nxt):
+    frame[a] = frame[b] or frame[c]
+    return nxt
+
+
+def op_neg(frame, a, b, c, nxt):
+    value = -frame[b]
+    frame[a] = value if value <= INT_MAX else wrap_integer(value)
+    return nxt
+
+
+def op_not(frame, a, b, c, nxt):
+    frame[a] = not frame[b]
+    return nxt
+
+
+def op_goto(frame, a, b, c, nxt):
+    # a is the target index
+    return a
+
+
+def op_iffalse(frame, a, b, c, nxt):
+    # b is the target index
+    return nxt if frame[a] else b
+
+
+def op_iftrue(frame, a, b, c, nxt):
+    return b if frame[a] else nxt
+
+
+def if_lt(frame, a, b, c, nxt):
+    # c is the target index
+    return c if frame[a] < frame[b] else nxt
+
+
+def if_le(frame, a, b, c, nxt):
+    return c if frame[a] <= frame[b] else nxt
+
+
+def if_gt(frame, a, b, c, nxt):
+    return c if frame[a] > frame[b] else nxt
+
+
+def if_ge(frame, a, b, c, nxt):
+    return c if frame[a] >= frame[b] else nxt
+
+
+def if_eq(frame, a, b, c, nxt):
+    return c if frame[a] == frame[b] else nxt
+
+
+def if_ne(frame, a, b, c, nxt):
+    return c if frame[a] != frame[b] else nxt
+
+
+def op_newarray(frame, a, b, c, nxt):
+    # b is the number of elements the literal stores right after, 0 when it pushes them
+    frame[a] = [None] * b
+    return nxt
+
+
+def op_newarray_typed(frame, a, b, c, nxt):
+    # b is the typecode, c the size in bytes of the elements the literal stores right after
+    frame[a] = array(b, bytes(c))
+    return nxt
+
+
+def op_constarray(frame, a, b, c, nxt):
+    # b is the prebuilt buffer of the literal
+    frame[a] = b[:]
+    return nxt
+
+
+def op_push(frame, a, b, c, nxt):
+    frame[a].append(frame[b])
+    return nxt
+
+
+def op_len(frame, a, b, c, nxt):
+    frame[a] = len(frame[b])
+    return nxt
+
+
+def op_load(frame, a, b, c, nxt):
+    array, index = frame[b], frame[c]
+    if not 0 <= index < len(array):
+        raise TacException(f"index {index} out of bounds for array of length {len(array)}")
+    frame[a] = array[index]
+    return nxt
+
+
+def op_store(frame, a, b, c, nxt):
+    array, index = frame[a], frame[b]
+    if not 0 <= index < len(array):
+        raise TacException(f"index {index} out of bounds for array of length {len(array)}")
+    array[index] = frame[c]
+    return nxt
+
+
+def op_load_unchecked(frame, a, b, c, nxt):
+    frame[a] = frame[b][frame[c]]
+    return nxt
+
+
+def op_store_unchecked(frame, a, b, c, nxt):
+    frame[a][frame[b]] = frame[c]
+    return nxt
+
+
+def op_new(frame, a, b, c, nxt):
+    # b is the class's template record: its vtable and empty fields
+    frame[a] = Record(b)
+    return nxt
+
+
+def op_getfield(frame, a, b, c, nxt):
+    # c is the field offset
+    record = frame[b]
+    if record is None:
+        raise TacException("null reference")
+    frame[a] = record[c]
+    return nxt
+
+
+def op_setfield(frame, a, b, c, nxt):
+    # b is the field offset
+    record = frame[a]
+    if record is None:
+        raise TacException("null reference")
+    record[b] = frame[c]
+    return nxt
+
+
+def op_nullcheck(frame, a, b, c, nxt):
+    if frame[a] is None:
+        raise TacException("null reference")
+    return nxt
+
+
+def op_return(frame, a, b, c, nxt):
+    frame[RESULT] = frame[a]
+    return -1
+
+
+def op_return_void(frame, a, b, c, nxt):
+    frame[RESULT] = None
+    return -1
+
+
+BINARY_HANDLERS = {
+    "+": op_add, "-": op_sub, "*": op_mul, "/": op_div, "%": op_mod,
+    "<": op_lt, "<=": op_le, ">": op_gt, ">=": op_ge, "==": op_eq, "!=": op_ne,
+    "&&": op_and, "||": op_or,
+}
+UNARY_HANDLERS = {"-": op_neg, "!": op_not}
+BRANCH_HANDLERS = {"<": if_lt, "<=": if_le, ">": if_gt, ">=": if_ge, "==": if_eq, "!=": if_ne}
+PRINTERS = {
+    "integer": str, "float": str, "string": str,
+    "boolean": lambda value: "true" if value else "false",
+}
+
+
+def instruction_kind(instruction):
+    # Name of an instruction for pair statistics: its op, plus the operator and whether
+    # the second operand is a constant for binary instructions and conditional jumps
+    if instruction.op in ["binary", "ifrel"]:
+        constant = " const" if is_constant(instruction.args[1]) else ""
+        return f"{instruction.op} {instruction.operator}{constant}"
+    if instruction.op == "unary":
+        return f"unary {instruction.operator}"
+    return instruction.op
+
+
+class CompiledFunction:
+    # A TAC function turned into handler tuples over a frame of numbered slots:
+    # the result, the parameters, locals, temps and shadows of globals, then constants.
+    def __init__(self, name):
+        self.name = name
+        self.slots = {}     # Operand text -> slot
+        self.template = []  # Initial frame; constants are filled in once here
+        self.code = []      # (handler, a, b, c, next)
+        self.params = 0
+        self.handlers = HandlerTable([])  # Instruction ranges of the tries and their catch blocks
+
+    def slot(self, operand):
+        if operand not in self.slots:
+            self.slots[operand] = len(self.template)
+            self.template.append(constant_value(operand) if is_constant(operand) else None)
+        return self.slots[operand]
+
+
+class TacInterpreter:
+    # Runs the visitor's TAC directly. Labels are resolved to instruction indexes and
+    # operands to frame slots once, so executing an instruction is a tuple unpack and a
+    # call through the handler stored in it.
+    def __init__(self, code, symbol_table, max_iterations=10_000_000, pair_counts=None,
+                 memoize=(), memo_entries=MEMO_ENTRIES):
+        # pair_counts, when given, is a dict that collects how often each kind of instruction
+        # (see instruction_kind) runs right after another one, for choosing superinstructions.
+        # Calls to the functions in memoize (see PureCalls.memoizable_functions) go through
+        # one LRU table of at most memo_entries results, keyed on the function and arguments.
+        self.program = TACProgram(code, symbol_table)
+        self.max_iterations = max_iterations
+        self.pair_counts = pair_counts
+        self.memoize = set(memoize)
+        self.memo_entries = memo_entries
+        self.previous_kind = None
+        self.globals = {name: index for index, name in enumerate(sorted(self.program.globals))}
+        self.functions = {function.name: CompiledFunction(function.name)
+                          for function in self.program.all_functions()}
+        # Every object starts as a copy of its class's template: the vtable, then the fields
+        self.templates = {name: Record([[self.functions[function] for function in vtable]] + [None] * (size - 1))
+                          for name, (size, vtable) in self.program.classes.items()}
+        for function in self.program.all_functions():
+            self.compile(function, self.functions[function.name])
+        self.output = []
+        self.steps = 0
+
+    # ******************************
+    # *** Compilation            ***
+    # ******************************
+
+    def compile(self, function, compiled):
+        compiled.slot(None)  # RESULT
+        for param in function.params:
+            compiled.slot(param)
+        compiled.params = len(function.params)
+
+        labels = {}
+        self.fills = literal_fills(function.instructions)
+        pending = []  # [handler, a, b, c] with label names where targets go
+        kinds = []
+        for instruction in function.instructions:
+            if instruction.op == "label":
+                labels[instruction.target] = len(pending)
+                continue
+            # Globals are copied into a shadow slot before use and back after a definition
+            for name in instruction.uses():
+                if name in self.globals and not function.is_local(name):
+                    pending.append([self.load_global, compiled.slot(name), self.globals[name], 0])
+                    kinds.append("load_global")
+            pending.append(self.translate(instruction, compiled))
+            kinds.append(instruction_kind(instruction))
+            for name in instruction.defs():
+                if name in self.globals and not function.is_local(name):
+                    pending.append([self.store_global, compiled.slot(name), self.globals[name], 0])
+                    kinds.append("store_global")
+        pending.append([op_return_void, 0, 0, 0])
+        kinds.append("return")
+        compiled.handlers = HandlerTable([(labels[start], labels[end], labels[catch])
+                                          for start, end, catch in function.handlers])
+
+        for index, (handler, a, b, c) in enumerate(pending):
+            if handler is op_goto:
+                a = labels[a]
+                target = a
+            elif handler in (op_iffalse, op_iftrue):
+                b = labels[b]
+                target = b
+            elif handler in BRANCH_HANDLERS.values():
+                c = labels[c]
+                target = c
+            else:
+                target = None
+            if target is not None and target <= index:
+                handler = self.counted(handler)
+            if self.pair_counts is not None:
+                handler = self.profiled(handler, kinds[index])
+            compiled.code.append((handler, a, b, c, index + 1))
+
+    def translate(self, instruction, compiled):
+        # One TAC instruction as [handler, a, b, c]; jump targets are still label names
+        slot = compiled.slot
+        args = instruction.args
+        op = instruction.op
+        if op == "goto":
+            return [op_goto, instruction.target, 0, 0]
+        if op == "iffalse":
+            return [op_iffalse, slot(args[0]), instruction.target, 0]
+        if op == "iftrue":
+            return [op_iftrue, slot(args[0]), instruction.target, 0]
+        if op == "ifrel":
+            return [BRANCH_HANDLERS[instruction.operator], slot(args[0]), slot(args[1]), instruction.target]
+        if op == "copy":
+            return [op_copy, slot(instruction.dest), slot(args[0]), 0]
+        if op == "binary":
+            return [BINARY_HANDLERS[instruction.operator], slot(instruction.dest), slot(args[0]), slot(args[1])]
+        if op == "unary":
+            return [UNARY_HANDLERS[instruction.operator], slot(instruction.dest), slot(args[0]), 0]
+        if op == "param":
+            return [self.param, slot(args[0]), 0, 0]
+        if op == "call":
+            if instruction.target not in self.functions:
+                raise TacRuntimeError(f"call to unknown function '{instruction.target}'")
+            handler = self.memo_call if instruction.target in self.memoize else self.call
+            return [handler, slot(instruction.dest), self.functions[instruction.target], instruction.args_count]
+        if op == "callvirt":
+            return [self.call_virtual, slot(instruction.dest), int(args[1]), instruction.args_count]
+        if op == "new":
+            return [op_new, slot(instruction.dest), self.templates[instruction.target], 0]
+        if op == "getfield":
+            return [op_getfield, slot(instruction.dest), slot(args[0]), int(args[1])]
+        if op == "setfield":
+            return [op_setfield, slot(args[0]), int(args[1]), slot(args[2])]
+        if op == "nullcheck":
+            return [op_nullcheck, slot(args[0]), 0, 0]
+        if op == "caught":
+            return [self.caught, slot(instruction.dest), 0, 0]
+        if op == "return":
+            if args:
+                return [op_return, slot(args[0]), 0, 0]
+            return [op_return_void, 0, 0, 0]
+        if op == "print":
+            return [self.printer(instruction.type), slot(args[0]), 0, 0]
+        if op == "newarray":
+            # A literal whose pushes all follow is allocated at its full length up front
+            length = self.fills.get(id(instruction), 0)
+            if instruction.type in ARRAY_TYPECODES:
+                typecode = ARRAY_TYPECODES[instruction.type]
+                return [op_newarray_typed, slot(instruction.dest), typecode, length * array(typecode).itemsize]
+            return [op_newarray, slot(instruction.dest), length, 0]
+        if op == "constarray":
+            return [op_constarray, slot(instruction.dest), constant_array(instruction), 0]
+        if op == "push":
+            if id(instruction) in self.fills:
+                return [op_store_unchecked, slot(args[0]), slot(str(self.fills[id(instruction)])), slot(args[1])]
+            return [op_push, slot(args[0]), slot(args[1]), 0]
+        if op == "len":
+            return [op_len, slot(instruction.dest), slot(args[0]), 0]
+        if op == "load":
+            handler = op_load if instruction.checked else op_load_unchecked
+            return [handler, slot(instruction.dest), slot(args[0]), slot(args[1])]
+        if op == "store":
+            handler = op_store if instruction.checked else op_store_unchecked
+            return [handler, slot(args[0]), slot(args[1]), slot(args[2])]
+        raise TacRuntimeError(f"cannot interpret '{instruction}'")
+
+    def counted(self, handler):
+        # Backward jumps count loop iterations, so a runaway program stops with an error
+        def run(frame, a, b, c, nxt):
+            self.iterations += 1
+            if self.iterations > self.max_iterations:
+                raise TacRuntimeError(f"more than {self.max_iterations} loop iterations")
+            return handler(frame, a, b, c, nxt)
+        return run
+
+    def profiled(self, handler, kind):
+        def run(frame, a, b, c, nxt):
+            pair = (self.previous_kind, kind)
+            self.pair_counts[pair] = self.pair_counts.get(pair, 0) + 1
+            self.previous_kind = kind
+            return handler(frame, a, b, c, nxt)
+        return run
+
+    # ******************************
+    # *** Handlers with state    ***
+    # ******************************
+
+    def load_global(self, frame, a, b, c, nxt):
+        frame[a] = self.global_values[b]
+        return nxt
+
+    def store_global(self, frame, a, b, c, nxt):
+        self.global_values[b] = frame[a]
+        return nxt
+
+    def param(self, frame, a, b, c, nxt):
+        self.arguments.append(frame[a])
+        return nxt
+
+    def call(self, frame, a, function, count, nxt):
+        arguments = self.arguments
+        start = len(arguments) - count
+        frame[a] = self.invoke(function, arguments[start:])
+        del arguments[start:]
+        return nxt
+
+    def memo_call(self, frame, a, function, count, nxt):
+        # A call that fails is not stored, so it fails again the next time
+        arguments = self.arguments
+        start = len(arguments) - count
+        key = (function.name, *arguments[start:])
+        memo = self.memo
+        if key in memo:
+            memo.move_to_end(key)
+            self.memo_stats["hits"] += 1
+            frame[a] = memo[key]
+        else:
+            self.memo_stats["misses"] += 1
+            frame[a] = memo[key] = self.invoke(function, arguments[start:])
+            if len(memo) > self.memo_entries:
+                memo.popitem(last=False)
+                self.memo_stats["evicted"] += 1
+        del arguments[start:]
+        return nxt
+
+    def call_virtual(self, frame, a, vtable_slot, count, nxt):
+        # The object is the first pending argument; its vtable picks the function
+        arguments = self.arguments
+        start = len(arguments) - count
+        record = arguments[start]
+        if record is None:
+            raise TacException("null reference")
+        frame[a] = self.invoke(record[0][vtable_slot], arguments[start:])
+        del arguments[start:]
+        return nxt
+
+    def caught(self, frame, a, b, c, nxt):
+        frame[a] = self.error_message
+        return nxt
+
+    def printer(self, type_):
+        convert = PRINTERS.get(type_, str)
+
+        def print_value(frame, a, b, c, nxt):
+            self.output.append(convert(frame[a]) + "\n")
+            return nxt
+        return print_value
+
+    # ******************************
+    # *** Execution              ***
+    # ******************************
+
+    def invoke(self, function, arguments):
+        self.depth += 1
+        if self.depth > MAX_CALL_DEPTH:
+            raise TacRuntimeError("call stack overflow")
+        frame = function.template[:]
+        frame[1:1 + function.params] = arguments
+        code = function.code
+        pc = 0
+        steps = 0
+        while True:
+            try:
+                while pc >= 0:
+                    handler, a, b, c, nxt = code[pc]
+                    pc = handler(frame, a, b, c, nxt)
+                    steps += 1
+                break
+            except TacException as error:
+                # pc is still the failing instruction, or the call a callee failed in. Arguments
+                # of abandoned calls stay in self.arguments; calls take theirs from the end.
+                catch = function.handlers.lookup(pc) if function.handlers else None
+                if catch is None:
+                    self.steps += steps
+                    self.depth -= 1
+                    raise
+                self.error_message = str(error)
+                pc = catch
+        self.steps += steps
+        self.depth -= 1
+        return frame[RESULT]
+
+    def run(self):
+        self.global_values = [None] * len(self.globals)
+        self.arguments = []  # Values of pending param instructions
+        self.error_message = None  # Message of the error the running catch block handles
+        self.iterations = 0
+        self.steps = 0
+        self.output = []
+        self.memo = OrderedDict()  # (function label, arguments...) -> result
+        self.memo_stats = {"hits": 0, "misses": 0, "evicted": 0}
+        self.depth = -1  # Calls below main
+        try:
+            run_deep(lambda: self.invoke(self.functions["main"], []), FRAMES_PER_CALL)
+        except OverflowError:
+            raise TacRuntimeError("value out of range for an integer[] element")
+        return "".join(self.output)
+
+
+def main(argv):
+    # python3 TacInterpreter.py program.cps ...
+    from antlr4 import FileStream
+    from Driver import analyze
+
+    failed = False
+    for path in argv[1:]:
+        print(f"== {path}")
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, _, syntax_errors, visitor = analyze(FileStream(path, encoding="utf-8"))
+        errors = syntax_errors + visitor.errors
+        for error in errors:
+            print(error)
+        if errors:
+            failed = True
+            continue
+
+        interpreter = TacInterpreter(visitor.generated_code, visitor.symbol_table)
+        start = time.perf_counter()
+        try:
+            output = interpreter.run()
+        except TacRuntimeError as error:
+            print("".join(interpreter.output), end="")
+            print(f"runtime error: {error}")
+            failed = True
+            continue
+        elapsed = time.perf_counter() - start
+        print(output, end="")
+        rate = interpreter.steps / elapsed / 1e6 if elapsed else 0
+        print(f"-- {interpreter.steps} TAC instructions, {rate:.1f}M instructions/s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
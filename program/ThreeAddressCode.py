@@ -0,0 +1,437 @@
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+
+BINARY_OPERATORS = ["+", "-", "*", "/", "%", "<", "<=", ">", ">=", "==", "!=", "&&", "||"]
+RELATIONAL_OPERATORS = ["<", "<=", ">", ">=", "==", "!="]
+
+# An operand is either a string literal (which may contain spaces) or a plain token
+OPERAND = r'"[^"]*"|[^\s,()\[\]]+'
+NAME = r'[A-Za-z_$][\w.$]*'  # Labels of nested functions and methods hold ".", made-up names "$"
+ELEMENT = r'-?\d+(?:\.\d+)?|true|false'
+OPERATOR = "|".join(re.escape(op) for op in sorted(BINARY_OPERATORS, key=len, reverse=True))
+
+PATTERNS = [
+    ("label", re.compile(rf"^({NAME}):$")),
+    ("label", re.compile(r"^(L\d+)$")),
+    ("begin_func", re.compile(rf"^begin_func ({NAME})$")),
+    ("end_func", re.compile(rf"^end_func ({NAME})$")),
+    ("goto", re.compile(rf"^goto ({NAME})$")),
+    ("iffalse", re.compile(rf"^(?:ifFalse|if False) ({OPERAND}) goto ({NAME})$")),
+    ("iftrue", re.compile(rf"^ifTrue ({OPERAND}) goto ({NAME})$")),
+    ("ifrel", re.compile(rf"^if ({OPERAND}) ({OPERATOR}) ({OPERAND}) goto ({NAME})$")),
+    ("iftrue", re.compile(rf"^if ({OPERAND}) goto ({NAME})$")),
+    ("param", re.compile(rf"^param ({OPERAND})$")),
+    ("return", re.compile(rf"^return(?: ({OPERAND}))?$")),
+    ("print", re.compile(rf"^print_(\w+) ({OPERAND})$")),
+    ("push", re.compile(rf"^push\(({NAME}), ({OPERAND})\)$")),
+    ("call", re.compile(rf"^({NAME}) = call ({NAME}), (\d+)$")),
+    ("callvirt", re.compile(rf"^({NAME}) = callvirt ({NAME}), (\d+), (\d+)$")),
+    ("class", re.compile(rf"^class ({NAME}), (\d+)(?:: ({NAME}(?:, {NAME})*))?$")),
+    ("new", re.compile(rf"^({NAME}) = new ({NAME})$")),
+    ("getfield", re.compile(rf"^({NAME}) = getfield ({NAME}), (\d+)$")),
+    ("setfield", re.compile(rf"^setfield ({NAME}), (\d+), ({OPERAND})$")),
+    ("nullcheck", re.compile(rf"^nullcheck ({NAME})$")),
+    ("handler", re.compile(rf"^handler ({NAME}), ({NAME}), ({NAME})$")),
+    ("caught", re.compile(rf"^({NAME}) = caught\(\)$")),
+    ("newarray", re.compile(rf"^({NAME}) = \[\](?: ([\w\[\]]+), (\d+))?$")),
+    ("constarray", re.compile(rf"^({NAME}) = \[((?:{ELEMENT})(?:, (?:{ELEMENT}))*)\] (\w+)$")),
+    ("len", re.compile(rf"^({NAME}) = len\(({NAME})\)$")),
+    ("load", re.compile(rf"^({NAME}) = ({NAME})\[({OPERAND})\]( unchecked)?$")),
+    ("store", re.compile(rf"^({NAME})\[({OPERAND})\] = ({OPERAND})( unchecked)?$")),
+    ("binary", re.compile(rf"^({NAME}) = ({OPERAND}) ({OPERATOR}) ({OPERAND})$")),
+    ("unary", re.compile(rf"^({NAME}) = (-|!)({OPERAND})$")),
+    ("copy", re.compile(rf"^({NAME}) = ({OPERAND})$")),
+]
+
+
+# Runtimes keep arrays of these element types in array.array with the given typecode
+# (8 bytes per integer or float, 1 per boolean) and everything else in a list
+ARRAY_TYPECODES = {"integer": "q", "float": "d", "boolean": "b"}
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1  # Integers are 32 bits, as in a MIPS register
+MAX_CALL_DEPTH = 10_000  # Nested calls a backend runs before "call stack overflow"
+CALL_STACK_BYTES = 512 * 1024 * 1024  # Thread stack for backends that recurse in Python
+HELPER_FRAMES = 3  # Room for runtime helpers called from the deepest function
+
+
+def constant_array(instruction):
+    # Buffer holding the elements of a constarray instruction; runtimes build it once
+    # and give every execution of the literal its own copy
+    return array(ARRAY_TYPECODES[instruction.type], [constant_value(value) for value in instruction.args])
+
+
+def literal_fills(instructions):
+    # Array literals the runtimes can preallocate: "t = [] type, n" followed, in straight-line
+    # code that does not otherwise touch t, by exactly n pushes to it. Maps the id of each
+    # such newarray to n and the id of each of its pushes to the index the element goes to.
+    fills = {}
+    for position, instruction in enumerate(instructions):
+        if instruction.op != "newarray" or not is_temp(instruction.dest) or instruction.args[0] == "0":
+            continue
+        count = int(instruction.args[0])
+        pushes = []
+        for later in instructions[position + 1:]:
+            if later.op == "push" and later.args[0] == instruction.dest:
+                pushes.append(later)
+                if len(pushes) == count:
+                    break
+            elif (later.op in ["label", "goto", "iffalse", "iftrue", "ifrel", "return"]
+                  or instruction.dest in later.uses() + later.defs()):
+                break
+        if len(pushes) == count:
+            fills[id(instruction)] = count
+            for index, push in enumerate(pushes):
+                fills[id(push)] = index
+    return fills
+
+
+def is_constant(operand):
+    # Literals that can be materialized without reading any variable
+    if operand is None:
+        return False
+    return (re.fullmatch(r"-?\d+(\.\d+)?", operand) is not None
+            or (operand.startswith('"') and operand.endswith('"'))
+            or operand in ["true", "false", "null"])
+
+
+def is_name(operand):
+    return operand is not None and not is_constant(operand) and re.fullmatch(NAME, operand) is not None
+
+
+def is_temp(operand):
+    return operand is not None and re.fullmatch(r"t\d+", operand) is not None
+
+
+def constant_value(operand):
+    # Python value of a literal operand
+    if operand in ["true", "false"]:
+        return operand == "true"
+    if operand == "null":
+        return None
+    if operand.startswith('"'):
+        return operand[1:-1]
+    if "." in operand:
+        return float(operand)
+    return int(operand)
+
+
+def wrap_integer(value):
+    # An integer result outside 32 bits wraps around in two's complement, like the MIPS
+    # add/sub/mul; floats pass through
+    if type(value) is int and not INT_MIN <= value <= INT_MAX:
+        return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+    return value
+
+
+# The stack size applies to every thread started from now on; it is set once here because
+# changing it per run races with threads other runs (or a threaded server) start meanwhile
+threading.stack_size(CALL_STACK_BYTES)
+# The recursion limit is process-wide, so runs that set it take turns
+DEEP_RUN_LOCK = threading.Lock()
+
+
+def run_deep(function, frames_per_call):
+    # Runs function() in a thread whose stack and recursion limit hold MAX_CALL_DEPTH nested
+    # calls of the program, for backends that make each one frames_per_call Python calls.
+    # Past that Python raises RecursionError, give or take the few frames of a helper. The
+    # limit is left as is afterwards: the next run sets its own before it starts.
+    results, errors = [], []
+
+    def target():
+        frame, depth = sys._getframe(), 0
+        while frame is not None:
+            frame, depth = frame.f_back, depth + 1
+        sys.setrecursionlimit(depth + (MAX_CALL_DEPTH + 1) * frames_per_call + HELPER_FRAMES)
+        try:
+            results.append(function())
+        except BaseException as error:
+            errors.append(error)
+
+    with DEEP_RUN_LOCK:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results[0]
+
+
+class Instruction:
+    def __init__(self, op, dest=None, args=None, operator=None, target=None, type_=None):
+        self.op = op
+        self.dest = dest
+        self.args = args or []
+        self.operator = operator
+        self.target = target  # Label for jumps, function name for calls, class for new
+        self.type = type_     # Value type for print instructions, element type for newarray/constarray
+        self.args_count = 0   # Number of preceding params consumed by a call
+        self.protected = None  # (start, end) labels of the code a handler covers
+        self.checked = True   # Whether a load or store tests its index against the array's length
+        self.line = None      # Source line of the statement it came from, when known
+
+    def uses(self):
+        return [arg for arg in self.args if is_name(arg)]
+
+    def defs(self):
+        return [self.dest] if self.dest else []
+
+    def label_name(self):
+        return self.target if self.op == "label" else None
+
+    def jump_targets(self):
+        if self.op in ["goto", "iffalse", "iftrue", "ifrel"]:
+            return [self.target]
+        return []
+
+    def falls_through(self):
+        return self.op not in ["goto", "return"]
+
+    def __str__(self):
+        if self.op == "label":
+            return f"{self.target}:"
+        if self.op in ["begin_func", "end_func"]:
+            return f"{self.op} {self.target}"
+        if self.op == "goto":
+            return f"goto {self.target}"
+        if self.op == "iffalse":
+            return f"ifFalse {self.args[0]} goto {self.target}"
+        if self.op == "iftrue":
+            return f"ifTrue {self.args[0]} goto {self.target}"
+        if self.op == "ifrel":
+            return f"if {self.args[0]} {self.operator} {self.args[1]} goto {self.target}"
+        if self.op == "param":
+            return f"param {self.args[0]}"
+        if self.op == "return":
+            return f"return {self.args[0]}" if self.args else "return"
+        if self.op == "print":
+            return f"print_{self.type} {self.args[0]}"
+        if self.op == "push":
+            return f"push({self.args[0]}, {self.args[1]})"
+        if self.op == "call":
+            return f"{self.dest} = call {self.target}, {self.args_count}"
+        if self.op == "callvirt":
+            return f"{self.dest} = callvirt {self.args[0]}, {self.args[1]}, {self.args_count}"
+        if self.op == "class":
+            header = f"class {self.target}, {self.args[0]}"
+            return f"{header}: {', '.join(self.args[1:])}" if len(self.args) > 1 else header
+        if self.op == "new":
+            return f"{self.dest} = new {self.target}"
+        if self.op == "getfield":
+            return f"{self.dest} = getfield {self.args[0]}, {self.args[1]}"
+        if self.op == "setfield":
+            return f"setfield {self.args[0]}, {self.args[1]}, {self.args[2]}"
+        if self.op == "nullcheck":
+            return f"nullcheck {self.args[0]}"
+        if self.op == "handler":
+            return f"handler {self.protected[0]}, {self.protected[1]}, {self.target}"
+        if self.op == "caught":
+            return f"{self.dest} = caught()"
+        if self.op == "newarray":
+            return f"{self.dest} = [] {self.type}, {self.args[0]}" if self.type else f"{self.dest} = []"
+        if self.op == "constarray":
+            return f"{self.dest} = [{', '.join(self.args)}] {self.type}"
+        if self.op == "len":
+            return f"{self.dest} = len({self.args[0]})"
+        suffix = "" if self.checked else " unchecked"
+        if self.op == "load":
+            return f"{self.dest} = {self.args[0]}[{self.args[1]}]{suffix}"
+        if self.op == "store":
+            return f"{self.args[0]}[{self.args[1]}] = {self.args[2]}{suffix}"
+        if self.op == "binary":
+            return f"{self.dest} = {self.args[0]} {self.operator} {self.args[1]}"
+        if self.op == "unary":
+            return f"{self.dest} = {self.operator}{self.args[0]}"
+        return f"{self.dest} = {self.args[0]}"
+
+    def __repr__(self):
+        return f"Instruction({self})"
+
+
+def parse_line(line):
+    # Translate one line of the visitor's TAC into an Instruction
+    line = line.strip()
+    for op, pattern in PATTERNS:
+        match = pattern.match(line)
+        if not match:
+            continue
+        groups = match.groups()
+
+        if op in ["label", "begin_func", "end_func", "goto"]:
+            return Instruction(op, target=groups[0])
+        if op in ["iffalse", "iftrue"]:
+            return Instruction(op, args=[groups[0]], target=groups[1])
+        if op == "ifrel":
+            return Instruction(op, args=[groups[0], groups[2]], operator=groups[1], target=groups[3])
+        if op == "param":
+            return Instruction(op, args=[groups[0]])
+        if op == "return":
+            return Instruction(op, args=[groups[0]] if groups[0] else [])
+        if op == "print":
+            return Instruction(op, args=[groups[1]], type_=groups[0])
+        if op == "push":
+            return Instruction(op, args=[groups[0], groups[1]])
+        if op == "call":
+            instruction = Instruction(op, dest=groups[0], target=groups[1])
+            instruction.args_count = int(groups[2])
+            return instruction
+        if op == "callvirt":
+            # Object (also the first param), vtable slot and number of params
+            instruction = Instruction(op, dest=groups[0], args=[groups[1], groups[2]])
+            instruction.args_count = int(groups[3])
+            return instruction
+        if op == "class":
+            # Record size (vtable pointer included) and the functions in vtable order
+            return Instruction(op, args=[groups[1]] + (groups[2].split(", ") if groups[2] else []), target=groups[0])
+        if op == "new":
+            return Instruction(op, dest=groups[0], target=groups[1])
+        if op == "getfield":
+            return Instruction(op, dest=groups[0], args=[groups[1], groups[2]])
+        if op == "setfield":
+            return Instruction(op, args=[groups[0], groups[1], groups[2]])
+        if op == "nullcheck":
+            # Fails on a null object; kept where a devirtualized call replaced a callvirt
+            return Instruction(op, args=[groups[0]])
+        if op == "handler":
+            # Exception table entry, not executed: failures between the first two labels go to the third
+            instruction = Instruction(op, target=groups[2])
+            instruction.protected = (groups[0], groups[1])
+            return instruction
+        if op == "caught":
+            # First instruction of a catch block: the message of the error being handled
+            return Instruction(op, dest=groups[0])
+        if op == "newarray":
+            # Element type and the number of elements about to be pushed, when the visitor knows them
+            return Instruction(op, dest=groups[0], args=[groups[2] or "0"], type_=groups[1])
+        if op == "constarray":
+            # Array literal whose elements are all constants, stored as one pooled table
+            return Instruction(op, dest=groups[0], args=groups[1].split(", "), type_=groups[2])
+        if op == "len":
+            return Instruction(op, dest=groups[0], args=[groups[1]])
+        if op in ["load", "store"]:
+            # "unchecked" marks an access that bounds-check elimination proved in range
+            if op == "load":
+                instruction = Instruction(op, dest=groups[0], args=[groups[1], groups[2]])
+            else:
+                instruction = Instruction(op, args=[groups[0], groups[1], groups[2]])
+            instruction.checked = groups[3] is None
+            return instruction
+        if op == "binary":
+            return Instruction(op, dest=groups[0], args=[groups[1], groups[3]], operator=groups[2])
+        if op == "unary":
+            return Instruction(op, dest=groups[0], args=[groups[2]], operator=groups[1])
+        return Instruction(op, dest=groups[0], args=[groups[1]])
+
+    raise ValueError(f"Unrecognized three-address instruction: '{line}'")
+
+
+def parse_tac(code, source_lines=None):
+    # source_lines, when given, holds the source line of every line of code
+    instructions = []
+    for index, line in enumerate(code.splitlines()):
+        if line.strip():
+            instruction = parse_line(line)
+            if source_lines:
+                instruction.line = source_lines[index]
+            instructions.append(instruction)
+    return instructions
+
+
+class TACFunction:
+    def __init__(self, name, params=None, locals_=None):
+        self.name = name
+        self.params = params or []
+        self.locals = set(locals_ or []) | set(self.params)
+        self.instructions = []
+        self.handlers = []  # (start, end, catch) labels of every try in the function
+        self.line = None  # Source line of the declaration
+
+    def is_local(self, name):
+        return is_temp(name) or name in self.locals
+
+    def __repr__(self):
+        return f"TACFunction({self.name}, params={self.params})"
+
+
+class HandlerTable:
+    # Exception table of one function (or program) as (start, end, handler) positions, each
+    # protecting [start, end). Nothing runs on entering a try; a failure looks itself up here.
+    # Ranges nest, so they are flattened once into disjoint intervals, each mapped to the
+    # handler of the innermost range covering it (None where no range does), and a lookup
+    # is one bisection.
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: (entry[0], -entry[1]))
+        self.bounds = []    # Start of each interval; it runs up to the next bound
+        self.handlers = []  # Handler of each interval
+        bounds = sorted({position for start, end, _ in self.entries for position in (start, end)})
+        active = []  # Ranges covering the current bound, innermost last
+        following = 0
+        for bound in bounds:
+            while active and active[-1][1] <= bound:
+                active.pop()
+            while following < len(self.entries) and self.entries[following][0] == bound:
+                active.append(self.entries[following])
+                following += 1
+            handler = active[-1][2] if active else None
+            if not self.handlers or self.handlers[-1] != handler:
+                self.bounds.append(bound)
+                self.handlers.append(handler)
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def lookup(self, position):
+        index = bisect_right(self.bounds, position) - 1
+        return self.handlers[index] if index >= 0 else None
+
+
+class TACProgram:
+    def __init__(self, code, symbol_table, source_lines=None):
+        self.symbol_table = symbol_table
+        self.main = TACFunction("main")
+        self.functions = {}  # Declared functions in source order, main excluded
+        self.classes = {}    # Class -> (record size, vtable functions)
+
+        # Split nested begin_func/end_func regions into separate functions
+        stack = [self.main]
+        for instruction in parse_tac(code, source_lines):
+            if instruction.op == "begin_func":
+                info = symbol_table.get(instruction.target, {})
+                function = TACFunction(instruction.target, list(info.get("params", {}).keys()), info.get("locals", []))
+                function.line = instruction.line
+                self.functions[function.name] = function
+                stack.append(function)
+            elif instruction.op == "end_func":
+                stack.pop()
+            elif instruction.op == "class":
+                self.classes[instruction.target] = (int(instruction.args[0]), instruction.args[1:])
+            elif instruction.op == "handler":
+                stack[-1].handlers.append(instruction.protected + (instruction.target,))
+            else:
+                stack[-1].instructions.append(instruction)
+
+        # Variables touched by a function that are not its own live in global storage.
+        # Everything else referenced from the top level is private to main.
+        self.globals = set()
+        for function in self.functions.values():
+            for instruction in function.instructions:
+                for name in instruction.uses() + instruction.defs():
+                    if not function.is_local(name):
+                        self.globals.add(name)
+
+        for instruction in self.main.instructions:
+            for name in instruction.uses() + instruction.defs():
+                if name not in self.globals:
+                    self.main.locals.add(name)
+
+        # String pool: every distinct literal once, with a symbol numbered by first use
+        self.strings = {}
+        for function in self.all_functions():
+            for instruction in function.instructions:
+                for arg in instruction.args:
+                    if arg.startswith('"') and arg not in self.strings:
+                        self.strings[arg] = f"str${len(self.strings) + 1}"  # "$" keeps it apart from functions
+
+    def all_functions(self):
+        return [self.main] + list(self.functions.values())
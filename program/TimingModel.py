@@ -0,0 +1,178 @@
+from MipsSimulator import (TEXT_BASE, ADDIU, ADDU, LW, SW, MOVE, BEQ, BNE, J, SLT, SLTI, SUBU, SLL, MUL,
+                           BLT, BGE, BLE, BGT, BEQZ, BNEZ, JAL, JR, JALR, SYSCALL, AND, OR, XOR, XORI, ANDI, ORI,
+                           SLE, SGT, SGE, SEQ, SNE, DIV3, REM3, DIV2, MFLO, MFHI, SRA, SRL, SLLV, SRAV, SRLV,
+                           NOR, BLTZ, BGEZ, BLEZ, BGTZ, SLTU, NEG, NOT, WRITES_REGISTER)
+
+HI_LO = 32  # Pseudo register for the HI/LO pair written by two-operand div
+
+THREE_REGISTER = {ADDU, SUBU, SLT, MUL, AND, OR, XOR, SLE, SGT, SGE, SEQ, SNE, SLLV, SRAV, SRLV, NOR, SLTU,
+                  DIV3, REM3}
+TWO_REGISTER = {ADDIU, SLTI, SLL, SRA, SRL, XORI, ANDI, ORI, MOVE, NEG, NOT, LW}
+COMPARE_BRANCHES = {BEQ, BNE, BLT, BGE, BLE, BGT}
+ZERO_BRANCHES = {BEQZ, BNEZ, BLTZ, BGEZ, BLEZ, BGTZ}
+
+
+def registers_read(op, a, b, c):
+    if op in THREE_REGISTER:
+        registers = [b, c]
+    elif op in TWO_REGISTER:
+        registers = [b]
+    elif op in COMPARE_BRANCHES or op in (SW, DIV2):
+        registers = [a, b]
+    elif op in ZERO_BRANCHES or op in (JR, JALR):
+        registers = [a]
+    elif op in (MFLO, MFHI):
+        return [HI_LO]
+    elif op == SYSCALL:
+        registers = [2, 4]
+    else:
+        registers = []
+    # $zero and the simulator's constant slots are never written
+    return [register for register in registers if 0 < register < 32]
+
+
+def registers_written(op, a):
+    if op in WRITES_REGISTER:
+        return [a] if a else []
+    if op == DIV2:
+        return [HI_LO]
+    if op in (JAL, JALR):
+        return [31]
+    if op == SYSCALL:
+        return [2]
+    return []
+
+
+class Cache:
+    # Set-associative cache with LRU replacement. access() returns the stall cycles.
+    def __init__(self, size=4096, line=16, ways=1, miss_penalty=20):
+        self.line = line
+        self.ways = ways
+        self.miss_penalty = miss_penalty
+        self.sets = [[] for _ in range(max(1, size // (line * ways)))]  # Tags, most recent last
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def parse(cls, text):
+        # "size,line,ways,miss_penalty", trailing fields optional
+        return cls(*[int(field) for field in text.split(",")])
+
+    def access(self, address):
+        block = address // self.line
+        tags = self.sets[block % len(self.sets)]
+        tag = block // len(self.sets)
+        if tag in tags:
+            self.hits += 1
+            if tags[-1] != tag:
+                tags.remove(tag)
+                tags.append(tag)
+            return 0
+        self.misses += 1
+        if len(tags) == self.ways:
+            tags.pop(0)
+        tags.append(tag)
+        return self.miss_penalty
+
+    def describe(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 100
+        return f"{rate:.1f}% hits, {self.misses} misses"
+
+
+class PipelineModel:
+    # Cycle estimate for a classic five-stage pipeline (IF ID EX MEM WB) with full forwarding.
+    # Every instruction issues one cycle after the previous one unless it waits for an operand
+    # (a load result is ready one cycle late, mul/div results later), for a cache miss, or for
+    # the pipeline to refill after a taken branch or jump. Branches are predicted not taken and
+    # resolve in EX; jumps resolve in ID. With delay slots the slot hides one of those cycles.
+    def __init__(self, program, icache=None, dcache=None, branch_penalty=2, jump_penalty=1,
+                 load_latency=2, multiply_latency=4, divide_latency=12, delay_slots=False):
+        self.program = program
+        self.icache = icache or Cache()
+        self.dcache = dcache or Cache()
+        hidden = 1 if delay_slots else 0
+        self.branch_penalty = max(0, branch_penalty - hidden)
+        self.jump_penalty = max(0, jump_penalty - hidden)
+        self.latency = {LW: load_latency, MUL: multiply_latency, DIV3: divide_latency,
+                        REM3: divide_latency, DIV2: divide_latency}
+
+        # Hazard information per instruction, computed once
+        self.reads = [registers_read(*instruction.decoded()) for instruction in program]
+        self.writes = [registers_written(instruction.op, instruction.a) for instruction in program]
+
+        self.cycle = 4  # Filling the pipeline before the first instruction completes
+        self.instructions = 0
+        self.ready = {}     # Register -> first cycle a consumer can issue without stalling
+        self.producer = {}  # Register -> opcode that wrote it, to name the stall
+        self.stalls = {"load-use": 0, "mul/div": 0, "branch": 0, "jump": 0, "icache": 0, "dcache": 0}
+        self.pc_cycles = [0] * len(program)
+        self.pc_counts = [0] * len(program)
+
+    def step(self, pc, address, transferred):
+        # Account for one executed instruction. address is the effective address of a load or
+        # store (None otherwise), transferred whether it sent control somewhere else.
+        op = self.program[pc].op
+        start = self.cycle
+        cycle = start + 1
+
+        miss = self.icache.access(TEXT_BASE + 4 * pc)
+        self.stalls["icache"] += miss
+        cycle += miss
+
+        ready = self.ready
+        for register in self.reads[pc]:
+            if ready.get(register, 0) > cycle:
+                kind = "load-use" if self.producer[register] == LW else "mul/div"
+                self.stalls[kind] += ready[register] - cycle
+                cycle = ready[register]
+
+        if address is not None:
+            miss = self.dcache.access(address)
+            self.stalls["dcache"] += miss
+            cycle += miss
+
+        latency = self.latency.get(op, 1)
+        for register in self.writes[pc]:
+            ready[register] = cycle + latency
+            self.producer[register] = op
+
+        if transferred:
+            penalty = self.jump_penalty if op in (J, JAL, JR, JALR) else self.branch_penalty
+            self.stalls["jump" if op in (J, JAL, JR, JALR) else "branch"] += penalty
+            cycle += penalty
+
+        self.cycle = cycle
+        self.instructions += 1
+        self.pc_cycles[pc] += cycle - start
+        self.pc_counts[pc] += 1
+
+    def report(self, source_lines=None, top=5):
+        # Summary lines; hot spots are grouped by the "# line N" markers of the assembly
+        cpi = self.cycle / self.instructions if self.instructions else 0
+        lines = [f"{self.cycle} cycles, {self.instructions} instructions, CPI {cpi:.2f}",
+                 "stalls: " + ", ".join(f"{kind} {count}" for kind, count in self.stalls.items()),
+                 f"icache: {self.icache.describe()}; dcache: {self.dcache.describe()}"]
+
+        by_line = {}
+        for pc, instruction in enumerate(self.program):
+            if self.pc_cycles[pc]:
+                by_line[instruction.source_line] = by_line.get(instruction.source_line, 0) + self.pc_cycles[pc]
+        lines.append("hottest source lines:")
+        for line, cycles in sorted(by_line.items(), key=lambda item: -item[1])[:top]:
+            text = ""
+            if line is not None and source_lines and 0 < line <= len(source_lines):
+                text = source_lines[line - 1].strip()
+            label = f"line {line}" if line is not None else "runtime"
+            lines.append(f"  {label:<10}{100 * cycles / self.cycle:>6.1f}%{cycles:>12} cycles  {text}")
+
+        lines.append("hottest instructions:")
+        hottest = sorted(range(len(self.program)), key=lambda pc: -self.pc_cycles[pc])[:top]
+        for pc in hottest:
+            if not self.pc_cycles[pc]:
+                break
+            instruction = self.program[pc]
+            where = f"line {instruction.source_line}" if instruction.source_line is not None else ""
+            lines.append(f"  {TEXT_BASE + 4 * pc:#010x}{100 * self.pc_cycles[pc] / self.cycle:>6.1f}%"
+                         f"{self.pc_cycles[pc]:>12} cycles  {instruction.text:<28}{where}")
+        return lines
@@ -0,0 +1,284 @@
+from array import array
+from ThreeAddressCode import is_constant, is_temp, constant_value, wrap_integer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Every foreach then runs on the scalar path
+
+NUMPY_TYPES = {"q": "int64", "d": "float64"}
+INT64_LIMIT = 2 ** 63
+VECTOR_OPERATORS = ["+", "-", "*"]
+
+
+# ******************************
+# *** Runtime helpers        ***
+# ******************************
+
+def vector_load(values):
+    # Copy of a non-empty integer[] or float[] as a NumPy array, or None when the loop
+    # over it has to run on the scalar path
+    if numpy is None or not isinstance(values, array) or values.typecode not in NUMPY_TYPES or not values:
+        return None
+    return numpy.frombuffer(values, dtype=NUMPY_TYPES[values.typecode]).copy()
+
+
+def vector_bound(vector):
+    # Largest magnitude in the vector, as a Python number
+    return max(abs(vector.min().item()), abs(vector.max().item()))
+
+
+def wrapped(values):
+    # Integer elements wrapped to 32 bits, as the scalar arithmetic leaves them. The bound
+    # checks keep them within int64, and wrapping once at the end of + - * gives the same
+    # result as wrapping every step.
+    if values.dtype.kind != "i":
+        return values
+    return ((values + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def vector_sum(total, terms):
+    # total + terms[0] + terms[1] + ..., added left to right like the scalar loop
+    return wrap_integer(numpy.add.accumulate(numpy.concatenate(([total], wrapped(terms))))[-1].item())
+
+
+def vector_storable(target, source, start, results):
+    # Whether results can be written to target[start:] in one step with the same
+    # effect as the scalar stores: a distinct typed array, in bounds, no float to integer
+    if not isinstance(target, array) or target.typecode not in NUMPY_TYPES or target is source:
+        return False
+    if start < 0 or start + len(results) > len(target):
+        return False
+    return target.typecode == "d" or results.dtype.kind == "i"
+
+
+def vector_store(target, start, results):
+    view = numpy.frombuffer(target, dtype=NUMPY_TYPES[target.typecode])
+    view[start:start + len(results)] = wrapped(results)
+
+
+# ******************************
+# *** Pattern                ***
+# ******************************
+# Element expressions are tuples: ("x",) the element, ("const", value),
+# ("name", operand) a value the body does not change, ("var", operand) a variable the
+# body updates, ("binary", operator, left, right) and ("neg", operand).
+
+class ForeachLoop:
+    # A foreach whose body is straight-line + - * arithmetic on the element that only
+    # feeds sums (total = total + e), stores through a counter (b[j] = e; j = j + 1)
+    # and variables assigned before they are read
+    def __init__(self, index, array_operand, variable):
+        self.index = index              # Temp counting the elements
+        self.array = array_operand
+        self.variable = variable        # The foreach variable
+        self.reductions = []            # (accumulator, expression)
+        self.store = None               # (array, counter, offset, expression)
+        self.counters = []
+        self.locals = []                # (variable, expression), in body order
+
+
+def find_foreach_loops(instructions):
+    # ForeachLoop for every vectorisable foreach, keyed by its "index = 0" instruction
+    loops = {}
+    for position in range(len(instructions)):
+        loop = match_foreach(instructions, position)
+        if loop is not None:
+            loops[id(instructions[position])] = loop
+    return loops
+
+
+def match_foreach(instructions, position):
+    # The shape visitForeachStatement emits:
+    #   i = 0 / L1: / n = len(a) / if i >= n goto L3 / e = a[i] / x = e / body
+    #   L2: / i = i + 1 / goto L1 / L3:
+    # or the same with n = len(a) moved before L1 by bounds-check elimination
+    window = instructions[position:position + 6]
+    if len(window) < 6:
+        return None
+    start, head, length, test, load, assign = window
+    if head.op == "len":
+        head, length = length, head
+    if not (start.op == "copy" and is_temp(start.dest) and start.args == ["0"] and head.op == "label"
+            and length.op == "len" and test.op == "ifrel" and test.operator == ">="
+            and test.args == [start.dest, length.dest] and load.op == "load"
+            and load.args == [length.args[0], start.dest] and assign.op == "copy" and assign.args == [load.dest]):
+        return None
+
+    end = position + 6
+    while end < len(instructions) and instructions[end].op != "label":
+        end += 1
+    tail = instructions[end:end + 4]
+    if len(tail) < 4:
+        return None
+    _, increment, back, exit_label = tail  # The continue label, then i = i + 1 / goto L1 / L3:
+    if not (increment.op == "binary" and increment.dest == start.dest and increment.operator == "+"
+            and increment.args == [start.dest, "1"] and back.op == "goto" and back.target == head.target
+            and exit_label.op == "label" and exit_label.target == test.target):
+        return None
+
+    loop = ForeachLoop(start.dest, length.args[0], assign.dest)
+    return loop if analyze_body(loop, instructions[position + 6:end]) else None
+
+
+def analyze_body(loop, body):
+    defined = {instruction.dest for instruction in body if instruction.dest and not is_temp(instruction.dest)}
+    if loop.variable in defined or loop.array in defined:
+        return False
+    trees = {}
+    locals_ = {}
+    updates = {}  # Variable -> (increment expression, position of the assignment)
+    stores = []
+
+    def tree(operand):
+        if operand == loop.variable:
+            return ("x",)
+        if is_constant(operand):
+            value = constant_value(operand)
+            return ("const", value) if type(value) in [int, float] else None
+        if operand in trees:
+            return trees[operand]
+        if operand in locals_:
+            return locals_[operand]
+        if operand in defined:
+            return ("var", operand)
+        return None if is_temp(operand) else ("name", operand)
+
+    for position, instruction in enumerate(body):
+        op = instruction.op
+        if op == "binary" and instruction.operator in VECTOR_OPERATORS and is_temp(instruction.dest):
+            value = ("binary", instruction.operator, tree(instruction.args[0]), tree(instruction.args[1]))
+        elif op == "unary" and instruction.operator == "-" and is_temp(instruction.dest):
+            value = ("neg", tree(instruction.args[0]))
+        elif op == "copy":
+            value = tree(instruction.args[0])
+        elif op == "store":
+            stores.append((instruction.args[0], instruction.args[1], tree(instruction.args[2]), position))
+            continue
+        else:
+            return False
+        if value is None or None in value:
+            return False
+
+        dest = instruction.dest
+        if is_temp(dest):
+            trees[dest] = value
+        elif dest in updates or dest in locals_:
+            return False  # Assigned twice in one iteration
+        elif value[0] == "binary" and value[1] == "+" and ("var", dest) in value[2:]:
+            other = value[3] if value[2] == ("var", dest) else value[2]
+            if uses_variables(other):
+                return False
+            updates[dest] = (other, position)
+        elif not uses_variables(value) and dest not in read_before(body, position):
+            locals_[dest] = value
+        else:
+            return False
+
+    if len(stores) > 1:
+        return False
+    for target, counter, value, position in stores:
+        if target in defined or is_temp(target) or value is None or uses_variables(value) or counter not in updates:
+            return False
+        increment, assigned = updates.pop(counter)
+        if increment != ("const", 1):
+            return False
+        loop.counters.append(counter)
+        loop.store = (target, counter, 1 if assigned < position else 0, value)
+    loop.reductions = [(name, expression) for name, (expression, _) in updates.items()]
+    loop.locals = list(locals_.items())
+    return bool(loop.reductions or loop.store)
+
+
+def uses_variables(expression):
+    if expression[0] == "var":
+        return True
+    return any(uses_variables(part) for part in expression[1:] if isinstance(part, tuple))
+
+
+def read_before(body, position):
+    return {name for instruction in body[:position] for name in instruction.uses()}
+
+
+def depends_on_element(expression):
+    if expression[0] == "x":
+        return True
+    return any(depends_on_element(part) for part in expression[1:] if isinstance(part, tuple))
+
+
+# ******************************
+# *** Code                   ***
+# ******************************
+
+def vector_expression(expression, name, element="_x"):
+    # NumPy expression over _x, the elements; name maps operands to Python names
+    kind = expression[0]
+    if kind == "x":
+        return element
+    if kind == "const":
+        return repr(expression[1])
+    if kind == "name":
+        return name(expression[1])
+    if kind == "neg":
+        return f"(-{vector_expression(expression[1], name, element)})"
+    left, right = (vector_expression(part, name, element) for part in expression[2:])
+    return f"({left} {expression[1]} {right})"
+
+
+def bound_expression(expression, name):
+    # Upper bound of the expression's magnitude given _m, the largest element magnitude
+    kind = expression[0]
+    if kind == "x":
+        return "_m"
+    if kind == "const":
+        return repr(abs(expression[1]))
+    if kind == "name":
+        return f"abs({name(expression[1])})"
+    if kind == "neg":
+        return bound_expression(expression[1], name)
+    left, right = (bound_expression(part, name) for part in expression[2:])
+    return f"({left} {'*' if expression[1] == '*' else '+'} {right})"
+
+
+def vectorized_prologue(loop, name, indent, step, limit):
+    # Lines that run the whole loop with NumPy right after "index = 0" and then move the
+    # index past the end, so the scalar loop that follows does nothing. Whenever a check
+    # fails the index stays 0 and the scalar loop runs as usual.
+    inner = indent + step
+    body = inner + step
+
+    def values(expression):
+        code = vector_expression(expression, name)
+        return code if depends_on_element(expression) else f"numpy.full(len(_x), {code})"
+
+    checks = [f"{bound_expression(expression, name)} * len(_x) + abs({name(accumulator)}) < {INT64_LIMIT}"
+              for accumulator, expression in loop.reductions]
+    if loop.store is not None:
+        checks.append(f"{bound_expression(loop.store[3], name)} < {INT64_LIMIT}")
+
+    lines = [f"{indent}_x = vector_load({name(loop.array)})",
+             f"{indent}if _x is not None and _n + len(_x) <= {limit}:",
+             f"{inner}_m = vector_bound(_x)",
+             f"{inner}if {' and '.join(checks)}:"]
+    commit = []
+    for position, (accumulator, expression) in enumerate(loop.reductions):
+        lines.append(f"{body}_r{position} = {values(expression)}")
+        commit.append(f"{name(accumulator)} = vector_sum({name(accumulator)}, _r{position})")
+    condition = "True"
+    if loop.store is not None:
+        target, counter, offset, expression = loop.store
+        start = f"{name(counter)} + {offset}" if offset else name(counter)
+        lines.append(f"{body}_s = {values(expression)}")
+        condition = f"vector_storable({name(target)}, {name(loop.array)}, {start}, _s)"
+        commit.append(f"vector_store({name(target)}, {start}, _s)")
+        commit.append(f"{name(counter)} = {name(counter)} + len(_x)")
+
+    # Variables the scalar loop leaves holding values from the last element
+    for variable, expression in loop.locals:
+        commit.append(f"{name(variable)} = wrap_integer({vector_expression(expression, name, '_x[-1].item()')})")
+    commit += [f"{name(loop.variable)} = _x[-1].item()", "_n += len(_x)", f"{name(loop.index)} = len(_x)"]
+
+    lines.append(f"{body}if {condition}:")
+    lines += [body + step + line for line in commit]
+    lines.append(f"{indent}_x = None")
+    return lines
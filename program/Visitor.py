@@ -1,21 +1,58 @@
+import re
 from CompiscriptParser import CompiscriptParser
 from CompiscriptVisitor import CompiscriptVisitor
-from CodeFragment import CodeFragment
+from CodeFragment import CodeFragment, TacLine, tag_lines
 from CodeGenerator import CodeGenerator
+from ThreeAddressCode import ARRAY_TYPECODES, ELEMENT, INT_MIN, INT_MAX
+from ClassLayout import ClassLayout, ClassHierarchy, FIELD_DEFAULTS
+from ClosureConversion import ClosureConverter
+from BoundsCheck import BoundsCheckElimination
+from PureCalls import PureCallOptimizer
+
+CALLVIRT = re.compile(r"^(t\d+) = callvirt (\w+), (\d+), (\d+)$")
+
 
 class Visitor(CompiscriptVisitor):
-    def __init__(self):
+    def __init__(self, eliminate_checks=True, pure_calls=True):
         self.symbol_table = {}
         self.errors = []  # List to store semantic errors
         self.loop_depth = 0  # Track loop depth for break/continue statements
         self.function_stack = []  # Track function context for return type checking
+        self.function_locals = []  # Names declared inside each function being visited
+        self.function_labels = []  # TAC label of each function being visited
+        self.nested_functions = {}  # Label -> symbol entry of the functions nested in the current one
+        self.closure_classes = set()  # Record classes already declared by closure conversion
+        self.loop_labels = []  # (continue, break) labels of the enclosing loops
+        self.catch_code = [[]]  # Out-of-line catch blocks of the program and of each function being visited
+        self.catch_labels = [[]]  # Catch labels of the tries around the current statement, per function
         self.cg = CodeGenerator()  # Generation of temporal code with format t or L
+        self.source_lines = []  # Source line of every line of generated_code
+        self.classes = {}  # Class name -> ClassLayout
+        self.virtual_calls = {}  # Result temp of a callvirt -> static class of its receiver
+        self.devirtualization = {"sites": 0, "devirtualized": 0}
+        self.eliminate_checks = eliminate_checks  # Run bounds-check elimination on the finished TAC
+        self.bounds_checks = {"accesses": 0, "unchecked": 0, "hoisted": 0}
+        self.pure_calls = pure_calls  # Evaluate, reuse and hoist calls to pure functions
+        self.purity = {"functions": 0, "pure": 0, "evaluated": 0, "reused": 0, "hoisted": 0}
 
     def add_error(self, message, ctx):
         # Add an error message with line information to the errors list
         line = ctx.start.line if ctx and ctx.start else "unknown"
         self.errors.append(f"Error at line {line}: {message}")
 
+    def declare_local(self, name):
+        # Remember names declared inside a function body so backends can tell them from globals
+        if self.function_locals:
+            self.function_locals[-1].append(name)
+
+    def assignable(self, target, source):
+        # Same type, or a subclass object (or null) where a class is expected
+        if target == source:
+            return True
+        if target not in self.classes:
+            return False
+        return source == "null" or (source in self.classes and self.classes[source].is_subclass_of(target))
+
     # ************************
     # *** Variable Methods ***
     # ************************
@@ -44,6 +81,9 @@ class Visitor(CompiscriptVisitor):
 
         # Determine the type of the literal
         if text.isdigit():
+            # Integers are 32 bits in every backend, so a wider literal has no value
+            if int(text) > INT_MAX:
+                self.add_error(f"Integer literal {text} does not fit in 32 bits", ctx)
             return CodeFragment([], text, "integer")
         elif text.replace('.', '', 1).isdigit() and text.count('.') < 2:
             return CodeFragment([], text, "float")
@@ -51,6 +91,8 @@ class Visitor(CompiscriptVisitor):
             return CodeFragment([], text, "string")
         elif text in ["true", "false"]:
             return CodeFragment([], text, "boolean")
+        elif text == "null":
+            return CodeFragment([], text, "null")
         else:
             self.add_error(f"Unknown literal: {text}", ctx)
         return CodeFragment([], None, "unknown")
@@ -65,14 +107,14 @@ class Visitor(CompiscriptVisitor):
             return self.visitChildren(ctx)
 
         declared_type = ctx.typeAnnotation().getText().replace(":", "").strip() if ctx.typeAnnotation() else None
-        expression = self.visit(ctx.initializer().expression())
+        expression = self.visit(ctx.initializer().expression()) if ctx.initializer() else None
 
         if isinstance(expression, str):
             expression: CodeFragment = CodeFragment([], expression, expression)
 
         # Check initializer type and compare with declared type
         if ctx.initializer():
-            if expression and declared_type and declared_type != expression.type:
+            if expression and declared_type and not self.assignable(declared_type, expression.type):
                 decl_t = declared_type if isinstance(declared_type, str) else None
                 expr_t = expression.type if isinstance(expression.type, str) else None
 
@@ -86,13 +128,14 @@ class Visitor(CompiscriptVisitor):
                     self.add_error(f"Type error: variable '{var_name}' declared as {declared_type} but initialized with {expression.type}", ctx)
 
             else:
-                declared_type = expression.type
+                declared_type = declared_type or expression.type
 
         # Store variable in symbol table
         self.symbol_table[var_name] = {
             "type": declared_type or "unknown",
             "const": False
         }
+        self.declare_local(var_name)
 
         if expression:
             # Use initializer type if no declared type
@@ -114,7 +157,7 @@ class Visitor(CompiscriptVisitor):
         expression: CodeFragment = self.visit(ctx.expression())
 
         # Check type consistency for constants
-        if expression and declared_type and declared_type != expression.type:
+        if expression and declared_type and not self.assignable(declared_type, expression.type):
                 if declared_type in ["integer", "float", "string", "boolean"]:
                     self.add_error(f"Type error: constant '{const_name}' declared as {declared_type} but initialized with {expression.type}.", ctx)
                 else:
@@ -124,6 +167,7 @@ class Visitor(CompiscriptVisitor):
             "type": declared_type if declared_type else expression.type,
             "const": True
         }
+        self.declare_local(const_name)
 
         if expression:
             code = expression.code + [f"{const_name} = {expression.place}"]
@@ -133,6 +177,11 @@ class Visitor(CompiscriptVisitor):
 
     def visitAssignment(self, ctx:CompiscriptParser.AssignmentContext):
         # Handle assignment statements
+        if ctx.getChildCount() == 6:
+            # obj.field = value;
+            target = self.visit(ctx.expression(0))
+            return self.property_store(target, ctx.Identifier().getText(), self.visit(ctx.expression(1)), ctx)
+
         var_name = ctx.Identifier().getText()
 
         if var_name not in self.symbol_table:
@@ -158,8 +207,8 @@ class Visitor(CompiscriptVisitor):
 
         expression: CodeFragment = self.visit(expression)
 
-        if expression.type != var_info["type"]:
-            self.add_error(f"Type mismatch: variable '{var_name}' declared as {var_info['type']} but initialized with {expression.type}", ctx)
+        if not self.assignable(var_info["type"], expression.type):
+            self.add_error(f"Type mismatch: variable '{var_name}' declared as {var_info['type']} but assigned {expression.type}", ctx)
             return CodeFragment([], None, "unknown")
 
         code = expression.code + [f"{var_name} = {expression.place}"]
@@ -173,14 +222,80 @@ class Visitor(CompiscriptVisitor):
         # Handle expression statements
         return self.visit(ctx.expression())
 
+    def visitPrintStatement(self, ctx:CompiscriptParser.PrintStatementContext):
+        # Handle print statements, tagging the instruction with the printed type
+        expression = self.visit(ctx.expression())
+
+        if expression.type not in ["integer", "float", "string", "boolean"]:
+            self.add_error(f"Type error: cannot print value of type {expression.type}", ctx)
+            return CodeFragment([], None, "unknown")
+
+        code = expression.code + [f"print_{expression.type} {expression.place}"]
+        return CodeFragment(code, None, "void")
+
+    def visitAssignExpr(self, ctx:CompiscriptParser.AssignExprContext):
+        # Handle assignments used as expressions (e.g. for loop updates and a[i] = x)
+        value: CodeFragment = self.visit(ctx.assignmentExpr())
+        lhs = ctx.lhs
+
+        # Array element assignment
+        if lhs.getChildCount() == 2 and isinstance(lhs.getChild(1), CompiscriptParser.IndexExprContext):
+            base_name = lhs.getChild(0).getText()
+            if base_name not in self.symbol_table:
+                self.add_error(f"Variable '{base_name}' not declared", ctx)
+                return CodeFragment([], None, "unknown")
+
+            base_type = self.symbol_table[base_name]["type"]
+            index: CodeFragment = self.visit(lhs.getChild(1).expression())
+
+            if not base_type.endswith("[]"):
+                self.add_error(f"Type error: '{base_name}' is not an array", ctx)
+                return CodeFragment([], None, "unknown")
+
+            if index.type != "integer":
+                self.add_error(f"Type error: array index must be integer, got {index.type}", ctx)
+                return CodeFragment([], None, "unknown")
+
+            element_type = base_type.replace("[]", "", 1)
+            if value.type != element_type:
+                self.add_error(f"Type mismatch: cannot assign {value.type} to element of {base_type}", ctx)
+                return CodeFragment([], None, "unknown")
+
+            code = index.code + value.code + [f"{base_name}[{index.place}] = {value.place}"]
+            return CodeFragment(code, value.place, value.type)
+
+        if lhs.getChildCount() != 1:
+            self.add_error(f"Invalid assignment target '{lhs.getText()}'", ctx)
+            return CodeFragment([], None, "unknown")
+
+        var_name = lhs.getText()
+
+        if var_name not in self.symbol_table:
+            self.add_error(f"Variable '{var_name}' not declared", ctx)
+            return CodeFragment([], None, "unknown")
+
+        var_info = self.symbol_table[var_name]
+
+        if var_info.get("const", False):
+            self.add_error(f"Reassignment to constant '{var_name}' is not allowed.", ctx)
+            return CodeFragment([], None, "unknown")
+
+        if not self.assignable(var_info["type"], value.type):
+            self.add_error(f"Type mismatch: variable '{var_name}' declared as {var_info['type']} but assigned {value.type}", ctx)
+            return CodeFragment([], None, "unknown")
+
+        code = value.code + [f"{var_name} = {value.place}"]
+        return CodeFragment(code, var_name, value.type)
+
     # Arithmetic methods
 
     def visitAdditiveExpr(self, ctx:CompiscriptParser.AdditiveExprContext):
-        # Handle additive expressions (+, -)
-        if ctx.getChildCount() == 3:
-            left = self.visit(ctx.getChild(0))
-            right = self.visit(ctx.getChild(2))
-            operator = ctx.getChild(1).getText()
+        # Handle additive expressions (+, -), folding chains from left to right
+        left = self.visit(ctx.getChild(0))
+
+        for i in range(1, ctx.getChildCount(), 2):
+            right = self.visit(ctx.getChild(i + 1))
+            operator = ctx.getChild(i).getText()
 
             if isinstance(left, str):
                 left = CodeFragment([], left, left)
@@ -198,17 +313,17 @@ class Visitor(CompiscriptVisitor):
             
             temp = self.cg.new_temp()
             code = left.code + right.code + [f"{temp} = {left.place} {operator} {right.place}"]
-            return CodeFragment(code, temp, result_type)
+            left = CodeFragment(code, temp, result_type)
             
-        else:
-            return self.visit(ctx.getChild(0))
+        return left
 
     def visitMultiplicativeExpr(self, ctx:CompiscriptParser.MultiplicativeExprContext):
-        # Handle multiplicative expressions (*, /, %)
-        if ctx.getChildCount() == 3:
-            left = self.visit(ctx.getChild(0))
-            right = self.visit(ctx.getChild(2))
-            operator = ctx.getChild(1).getText()
+        # Handle multiplicative expressions (*, /, %), folding chains from left to right
+        left = self.visit(ctx.getChild(0))
+
+        for i in range(1, ctx.getChildCount(), 2):
+            right = self.visit(ctx.getChild(i + 1))
+            operator = ctx.getChild(i).getText()
 
             if isinstance(left, str):
                 left = CodeFragment([], left, left)
@@ -218,7 +333,7 @@ class Visitor(CompiscriptVisitor):
 
             # Allow operations between integers and floats
             if left.type in ["integer", "float"] and right.type in ["integer", "float"]:
-                result_type = "float" if "float" in (left, right) else "integer"
+                result_type = "float" if "float" in (left.type, right.type) else "integer"
 
             else:
                 self.add_error(f"Type error: cannot apply {operator} to {left.type} and {right.type}", ctx)
@@ -226,18 +341,25 @@ class Visitor(CompiscriptVisitor):
             
             temp = self.cg.new_temp()
             code = left.code + right.code + [f"{temp} = {left.place} {operator} {right.place}"]
-            return CodeFragment(code, temp, result_type)
+            left = CodeFragment(code, temp, result_type)
         
-        else:
-            return self.visit(ctx.getChild(0))
+        return left
 
     # Logical methods
 
     def visitLogicalAndExpr(self, ctx:CompiscriptParser.LogicalAndExprContext):
         # Handle logical AND expressions (&&)
-        if ctx.getChildCount() == 3:
-            left = self.visit(ctx.getChild(0))
-            right = self.visit(ctx.getChild(2))
+        if ctx.getChildCount() == 1:
+            result = self.visit(ctx.getChild(0))
+            if not result:
+                result = CodeFragment([], None, "boolean")
+
+            return result
+
+        left = self.visit(ctx.getChild(0))
+
+        for i in range(1, ctx.getChildCount(), 2):
+            right = self.visit(ctx.getChild(i + 1))
 
             if isinstance(left, str):
                 left = CodeFragment([], left, left)
@@ -252,20 +374,23 @@ class Visitor(CompiscriptVisitor):
             
             temp = self.cg.new_temp()
             code = left.code + right.code + [f"{temp} = {left.place} && {right.place}"]
-            return CodeFragment(code, temp, "boolean")
+            left = CodeFragment(code, temp, "boolean")
 
-        else:
+        return left
+
+    def visitLogicalOrExpr(self, ctx:CompiscriptParser.LogicalOrExprContext):
+        # Handle logical OR expressions (||)
+        if ctx.getChildCount() == 1:
             result = self.visit(ctx.getChild(0))
             if not result:
                 result = CodeFragment([], None, "boolean")
 
             return result
 
-    def visitLogicalOrExpr(self, ctx:CompiscriptParser.LogicalOrExprContext):
-        # Handle logical OR expressions (||)
-        if ctx.getChildCount() == 3:
-            left = self.visit(ctx.getChild(0))
-            right = self.visit(ctx.getChild(2))
+        left = self.visit(ctx.getChild(0))
+
+        for i in range(1, ctx.getChildCount(), 2):
+            right = self.visit(ctx.getChild(i + 1))
 
             if isinstance(left, str):
                 left = CodeFragment([], left, left)
@@ -279,19 +404,17 @@ class Visitor(CompiscriptVisitor):
             
             temp = self.cg.new_temp()
             code = left.code + right.code + [f"{temp} = {left.place} || {right.place}"]
-            return CodeFragment(code, temp, "boolean")
+            left = CodeFragment(code, temp, "boolean")
 
-        else:
-            result = self.visit(ctx.getChild(0))
-            if not result:
-                result = CodeFragment([], None, "boolean")
-
-            return result
+        return left
 
     def visitUnaryExpr(self, ctx:CompiscriptParser.UnaryExprContext):
         # Handle unary expressions (-, !)
         if ctx.getChildCount() == 2:
             operator = ctx.getChild(0).getText()
+            # The smallest integer is only written as the negation of a literal one past the largest
+            if operator == "-" and ctx.getChild(1).getText() == str(-INT_MIN):
+                return CodeFragment([], str(INT_MIN), "integer")
             operand = self.visit(ctx.getChild(1))
 
             if isinstance(operand, str):
@@ -314,6 +437,13 @@ class Visitor(CompiscriptVisitor):
                 return CodeFragment([], None, "unknown")
         
         return self.visit(ctx.getChild(0))
+
+    def visitPrimaryExpr(self, ctx:CompiscriptParser.PrimaryExprContext):
+        # Handle parenthesized expressions by returning the inner expression
+        if ctx.expression():
+            return self.visit(ctx.expression())
+
+        return self.visit(ctx.getChild(0))
     
     # Comparison methods
 
@@ -333,7 +463,8 @@ class Visitor(CompiscriptVisitor):
             # Handle equality and strict equality. Based in JavaScript xd
             if operator in ["==", "!=", "===", "!=="]:
                 # Allow equality between same types
-                if left.type == right.type or (left in ["integer", "float"] and right in ["integer", "float"]):
+                if (left.type == right.type or (left.type in ["integer", "float"] and right.type in ["integer", "float"])
+                        or self.assignable(left.type, right.type) or self.assignable(right.type, left.type)):
                     temp = self.cg.new_temp()
                     code = left.code + right.code + [f"{temp} = {left.place} {operator} {right.place}"]
                     return CodeFragment(code, temp, "boolean")
@@ -407,14 +538,30 @@ class Visitor(CompiscriptVisitor):
                 self.add_error(f"Type error: inconsistent types in array literal: found {first_type} instead of {element.type}", ctx)
                 return CodeFragment([], None, "unknown[]")
             
+        # A literal made only of constants is one instruction the backends turn into a
+        # pooled table instead of a push per element
         temp = self.cg.new_temp()
-        code = [f"{temp} = []"]
+        constants = [self.constant_element(element) for element in element_fragments]
+        if first_type in ARRAY_TYPECODES and None not in constants:
+            return CodeFragment([f"{temp} = [{', '.join(constants)}] {first_type}"], temp, f"{first_type}[]")
+
+        # The element type picks the runtime's storage and the length preallocates it
+        code = [f"{temp} = [] {first_type}, {len(element_fragments)}"]
 
         for element in element_fragments:
             code += element.code + [f"push({temp}, {element.place})"]
 
         return CodeFragment(code, temp, f"{first_type}[]")
     
+    def constant_element(self, fragment: CodeFragment):
+        # Text of an element that is a number or boolean literal, or a negated number
+        text = fragment.place or ""
+        if len(fragment.code) == 1 and fragment.code[0].startswith(f"{text} = -"):
+            text = fragment.code[0][len(text) + 3:]
+        elif fragment.code:
+            return None
+        return text if re.fullmatch(ELEMENT, text) else None
+
     def visitIndexExpr(self, ctx:CompiscriptParser.IndexExprContext):
         # Handle array indexing expressions
         base_name = ctx.parentCtx.getChild(0).getText()
@@ -465,15 +612,15 @@ class Visitor(CompiscriptVisitor):
         endLabel = self.cg.new_label()
 
         code = condition.code
-        code.append(f"if False {condition.place} goto {elseLabel}")
+        code.append(f"ifFalse {condition.place} goto {elseLabel}")
         code += thenBlock.code
         code.append(f"goto {endLabel}")
-        code.append(f"{elseLabel}")
+        code.append(f"{elseLabel}:")
 
         if elseBlock:
             code += elseBlock.code
         
-        code.append(f"{endLabel}")
+        code.append(f"{endLabel}:")
         
         return CodeFragment(code, None, "void")
     
@@ -482,7 +629,7 @@ class Visitor(CompiscriptVisitor):
         for stmt in ctx.statement():
             frag = self.visit(stmt)
             if isinstance(frag, CodeFragment):
-                code.extend(frag.code)
+                code.extend(tag_lines(frag.code, stmt.start.line))
         return CodeFragment(code, None, "void")
 
     def visitWhileStatement(self, ctx:CompiscriptParser.WhileStatementContext):
@@ -494,7 +641,9 @@ class Visitor(CompiscriptVisitor):
         end_label = self.cg.new_label()
 
         condition = self.visit(ctx.expression())
+        self.loop_labels.append((start_label, end_label))
         body = self.visit(ctx.block())
+        self.loop_labels.pop()
         
         # Allow only boolean conditions
         if condition.type != "boolean":
@@ -518,7 +667,9 @@ class Visitor(CompiscriptVisitor):
         condition_label = self.cg.new_label()
         end_label = self.cg.new_label()
 
+        self.loop_labels.append((condition_label, end_label))
         body = self.visit(ctx.block())
+        self.loop_labels.pop()
         condition = self.visit(ctx.expression())
 
         if condition.type != "boolean":
@@ -545,12 +696,14 @@ class Visitor(CompiscriptVisitor):
             init_code = self.visit(ctx.assignment()).code
 
         start_label = self.cg.new_label()
-        body_label = self.cg.new_label()
+        step_label = self.cg.new_label()
         end_label = self.cg.new_label()
 
         condition = self.visit(ctx.expression(0)) if ctx.expression(0) else None
         increment = self.visit(ctx.expression(1)) if ctx.expression(1) else None
+        self.loop_labels.append((step_label, end_label))
         body = self.visit(ctx.block())
+        self.loop_labels.pop()
 
         code = []
         code += init_code
@@ -559,6 +712,7 @@ class Visitor(CompiscriptVisitor):
             code += condition.code
             code.append(f"ifFalse {condition.place} goto {end_label}")
         code += body.code
+        code.append(f"{step_label}:")
         if increment:
             code += increment.code
         code.append(f"goto {start_label}")
@@ -567,7 +721,24 @@ class Visitor(CompiscriptVisitor):
         self.loop_depth -= 1
         return CodeFragment(code, None, "void")
 
+    def range_arguments(self, ctx):
+        # The argument expressions when ctx is exactly a call to the built-in range
+        node = ctx
+        while not isinstance(node, CompiscriptParser.LeftHandSideContext):
+            if node.getChildCount() != 1:
+                return None
+            node = node.getChild(0)
+        suffixes = node.suffixOp()
+        if (node.primaryAtom().getText() != "range" or "range" in self.symbol_table or len(suffixes) != 1
+                or not isinstance(suffixes[0], CompiscriptParser.CallExprContext)):
+            return None
+        return suffixes[0].arguments().expression() if suffixes[0].arguments() else []
+
     def visitForeachStatement(self, ctx: CompiscriptParser.ForeachStatementContext):
+        range_args = self.range_arguments(ctx.expression())
+        if range_args is not None:
+            return self.range_foreach(ctx, range_args)
+
         self.loop_depth += 1
 
         iterable = self.visit(ctx.expression())
@@ -581,23 +752,75 @@ class Visitor(CompiscriptVisitor):
 
         # Add loop variable
         self.symbol_table[var_name] = {"type": elem_type, "const": False}
+        self.declare_local(var_name)
 
         start_label = self.cg.new_label()
-        loop_label = self.cg.new_label()
+        step_label = self.cg.new_label()
         end_label = self.cg.new_label()
         index_temp = self.cg.new_temp()
 
+        self.loop_labels.append((step_label, end_label))
         body = self.visit(ctx.block())
+        self.loop_labels.pop()
 
         code = []
         code += iterable.code
         code.append(f"{index_temp} = 0")
         code.append(f"{start_label}:")
-        code.append(f"if {index_temp} >= len({iterable.place}) goto {end_label}")
+        length_temp = self.cg.new_temp()
+        code.append(f"{length_temp} = len({iterable.place})")
+        code.append(f"if {index_temp} >= {length_temp} goto {end_label}")
         temp_elem = self.cg.new_temp()
         code.append(f"{temp_elem} = {iterable.place}[{index_temp}]")
         code.append(f"{var_name} = {temp_elem}")
         code += body.code
+        code.append(f"{step_label}:")
+        code.append(f"{index_temp} = {index_temp} + 1")
+        code.append(f"goto {start_label}")
+        code.append(f"{end_label}:")
+
+        del self.symbol_table[var_name]
+        self.loop_depth -= 1
+        return CodeFragment(code, None, "void")
+
+    def range_foreach(self, ctx, range_args):
+        # foreach (i in range(n)) or range(a, b): a counter loop from a (default 0) up to b,
+        # excluded, with both bounds evaluated once and no array behind it
+        if len(range_args) not in (1, 2):
+            self.add_error(f"Function 'range' expects 1 or 2 args, got {len(range_args)}", ctx)
+            return CodeFragment([], None, "void")
+        bounds = [self.visit(arg) for arg in range_args]
+        if any(bound.type != "integer" for bound in bounds):
+            self.add_error("Type error: range bounds must be integer", ctx)
+            return CodeFragment([], None, "void")
+        if len(bounds) == 1:
+            bounds.insert(0, CodeFragment([], "0", "integer"))
+
+        self.loop_depth += 1
+        var_name = ctx.Identifier().getText()
+        self.symbol_table[var_name] = {"type": "integer", "const": False}
+        self.declare_local(var_name)
+
+        start_label = self.cg.new_label()
+        step_label = self.cg.new_label()
+        end_label = self.cg.new_label()
+        index_temp = self.cg.new_temp()
+        limit_temp = self.cg.new_temp()
+
+        self.loop_labels.append((step_label, end_label))
+        body = self.visit(ctx.block())
+        self.loop_labels.pop()
+
+        code = []
+        code += bounds[0].code
+        code.append(f"{index_temp} = {bounds[0].place}")
+        code += bounds[1].code
+        code.append(f"{limit_temp} = {bounds[1].place}")
+        code.append(f"{start_label}:")
+        code.append(f"if {index_temp} >= {limit_temp} goto {end_label}")
+        code.append(f"{var_name} = {index_temp}")
+        code += body.code
+        code.append(f"{step_label}:")
         code.append(f"{index_temp} = {index_temp} + 1")
         code.append(f"goto {start_label}")
         code.append(f"{end_label}:")
@@ -610,11 +833,54 @@ class Visitor(CompiscriptVisitor):
         # Handle break statements
         if self.loop_depth == 0: # If we are not inside a loop
             self.add_error("'break' used outside of loop", ctx)
+            return CodeFragment([], None, "void")
+
+        return CodeFragment([f"goto {self.loop_labels[-1][1]}"], None, "void")
 
     def visitContinueStatement(self, ctx):
         # Handle continue statements
         if self.loop_depth == 0: # If we are not inside a loop
             self.add_error("'continue' used outside of loop", ctx)
+            return CodeFragment([], None, "void")
+
+        return CodeFragment([f"goto {self.loop_labels[-1][0]}"], None, "void")
+
+    def visitTryCatchStatement(self, ctx: CompiscriptParser.TryCatchStatementContext):
+        # Entering a try runs nothing: "handler start, end, catch" is an exception table entry.
+        # The catch block goes after the last statement of the function, out of the no-error
+        # path, and jumps back to the code following the statement.
+        var_name = ctx.Identifier().getText()
+        if var_name in self.symbol_table:
+            self.add_error(f"Variable '{var_name}' already declared.", ctx)
+            return CodeFragment([], None, "void")
+
+        start_label = self.cg.new_label()
+        end_label = self.cg.new_label()
+        catch_label = self.cg.new_label()
+        resume_label = self.cg.new_label()
+
+        self.catch_labels[-1].append(catch_label)
+        body = self.visit(ctx.block(0))
+        self.catch_labels[-1].pop()
+
+        # The caught value is the runtime error's message
+        self.symbol_table[var_name] = {"type": "string", "const": False}
+        self.declare_local(var_name)
+        handler = self.visit(ctx.block(1))
+        del self.symbol_table[var_name]
+
+        catch_code = [f"{catch_label}:", f"{var_name} = caught()"] + handler.code + [f"goto {resume_label}"]
+        if self.catch_labels[-1]:
+            # Errors inside the catch block go to the try around this statement
+            outer_start, outer_end = self.cg.new_label(), self.cg.new_label()
+            catch_code = ([f"handler {outer_start}, {outer_end}, {self.catch_labels[-1][-1]}", f"{outer_start}:"]
+                          + catch_code + [f"{outer_end}:"])
+        self.catch_code[-1] += tag_lines(catch_code, ctx.start.line)
+
+        code = [f"handler {start_label}, {end_label}, {catch_label}", f"{start_label}:"]
+        code += body.code
+        code += [f"{end_label}:", f"{resume_label}:"]
+        return CodeFragment(code, None, "void")
 
     # *************************
     # *** Functions Methods ***
@@ -626,39 +892,82 @@ class Visitor(CompiscriptVisitor):
         if func_name in self.symbol_table:
             self.add_error(f"Function '{func_name}' already declared", ctx)
             return CodeFragment([], None, "unknown")
+        # The top-level statements compile to a function called main
+        if func_name == "main" and not self.function_labels:
+            self.add_error("Function name 'main' is reserved for the program's entry point", ctx)
+            return CodeFragment([], None, "unknown")
 
         return_type = ctx.type_().getText() if ctx.type_() else "void"
+        param_types = self.parameter_types(ctx)
+        # Nested functions are named after their enclosing function, so siblings can share names.
+        # The "." cannot appear in an identifier, so no top-level function takes the same label.
+        label = f"{self.function_labels[-1]}.{func_name}" if self.function_labels else func_name
+        return self.function_body(func_name, param_types, return_type, lambda: self.visit(ctx.block()).code, label)
 
+    def parameter_types(self, ctx: CompiscriptParser.FunctionDeclarationContext):
         param_types = {}
         if ctx.parameters():
             for param in ctx.parameters().parameter():
                 pname = param.Identifier().getText()
                 ptype = param.type_().getText() if param.type_() else "unknown"
                 param_types[pname] = ptype
+        return param_types
 
+    def function_body(self, func_name, param_types, return_type, body, label=None):
+        # Declare a function and generate its code; body() returns the code of its statements
+        label = label or func_name
         self.symbol_table[func_name] = {
             "type": return_type,
             "params": param_types,
-            "const": True
+            "const": True,
+            "label": label
         }
 
         old_symbols = self.symbol_table.copy()
         for pname, ptype in param_types.items():
-            self.symbol_table[pname] = {"type": ptype, "const": False}
+            self.symbol_table[pname] = {"type": ptype, "const": pname == "this"}
 
         self.function_stack.append(return_type)
-
-        body = self.visit(ctx.block())
-
-        start_label = self.cg.new_label()
-        end_label = self.cg.new_label()
-        code = [f"{func_name}:"] + body.code + [f"{end_label}:"]
+        self.function_locals.append([])
+        self.function_labels.append(label)
+        self.catch_code.append([])
+        self.catch_labels.append([])
+        # Loops of an enclosing function cannot be targeted from inside this one
+        old_loop_depth, old_loop_labels = self.loop_depth, self.loop_labels
+        self.loop_depth, self.loop_labels = 0, []
+
+        code = [f"begin_func {label}"] + body()
+        catch_code = self.catch_code.pop()
+        self.catch_labels.pop()
+        if catch_code:
+            code += ["return"] + catch_code
+        code.append(f"end_func {label}")
 
         self.symbol_table = old_symbols
+        self.symbol_table[func_name]["locals"] = self.function_locals.pop()
         self.function_stack.pop()
+        self.function_labels.pop()
+        self.loop_depth, self.loop_labels = old_loop_depth, old_loop_labels
+
+        if self.function_labels:
+            self.nested_functions[label] = self.symbol_table[func_name]
+        elif self.nested_functions:
+            code = self.convert_closures(code, label, self.symbol_table[func_name])
 
         return CodeFragment(code, func_name, "function")
 
+    def convert_closures(self, code, label, info):
+        # Give the nested functions of a top-level function their environments. Their symbol
+        # entries left scope with the enclosing body, so they come back under their labels.
+        functions = {label: info, **self.nested_functions}
+        converter = ClosureConverter(code, functions, self.cg.new_temp)
+        code = converter.convert()
+        classes = [line for line in converter.classes if line not in self.closure_classes]
+        self.closure_classes.update(classes)
+        self.symbol_table.update(self.nested_functions)
+        self.nested_functions = {}
+        return classes + code
+
     def visitReturnStatement(self, ctx: CompiscriptParser.ReturnStatementContext):
         if not self.function_stack:
             self.add_error("'return' used outside of function", ctx)
@@ -667,7 +976,7 @@ class Visitor(CompiscriptVisitor):
         expected_type = self.function_stack[-1]
         expr = self.visit(ctx.expression()) if ctx.expression() else None
 
-        if expr and expr.type != expected_type and expected_type != "unknown":
+        if expr and not self.assignable(expected_type, expr.type) and expected_type != "unknown":
             self.add_error(f"Type error: function expects {expected_type} but got {expr.type}", ctx)
 
         code = []
@@ -683,6 +992,9 @@ class Visitor(CompiscriptVisitor):
         # Get the function name from the parent context (primaryAtom)
         function_name = ctx.parentCtx.getChild(0).getText()
 
+        if function_name == "range" and function_name not in self.symbol_table:
+            self.add_error("'range' can only be iterated by foreach", ctx)
+            return CodeFragment([], None, "unknown")
         if function_name not in self.symbol_table:
             self.add_error(f"Function '{function_name}' not declared", ctx)
             return CodeFragment([], None, "unknown")
@@ -707,19 +1019,287 @@ class Visitor(CompiscriptVisitor):
             code.append(f"param {arg.place}")
 
         temp = self.cg.new_temp()
-        code.append(f"{temp} = call {function_name}, {len(args)}")
+        code.append(f"{temp} = call {func_info.get('label', function_name)}, {len(args)}")
 
         return CodeFragment(code, temp, func_info["type"])
     
+    # ***********************
+    # *** Classes Methods ***
+    # ***********************
+
+    def visitClassDeclaration(self, ctx: CompiscriptParser.ClassDeclarationContext):
+        # Lay out the class, then emit its TAC declaration, the function that initializes
+        # its fields and one function per method, each taking the object as 'this'
+        class_name = ctx.Identifier(0).getText()
+        parent_name = ctx.Identifier(1).getText() if len(ctx.Identifier()) > 1 else None
+
+        if self.function_stack:
+            self.add_error(f"Class '{class_name}' must be declared at the top level", ctx)
+            return CodeFragment([], None, "unknown")
+        if class_name in self.symbol_table:
+            self.add_error(f"Identifier '{class_name}' already declared", ctx)
+            return CodeFragment([], None, "unknown")
+        if parent_name is not None and parent_name not in self.classes:
+            self.add_error(f"Class '{parent_name}' not declared", ctx)
+            return CodeFragment([], None, "unknown")
+
+        layout = ClassLayout(class_name, self.classes.get(parent_name))
+        self.classes[class_name] = layout
+        self.symbol_table[class_name] = {"type": "class", "const": True}
+
+        # Every field and method signature is known before any body is visited
+        initializers = []  # (offset, initializer expression or None)
+        methods = []
+        for member in ctx.classMember():
+            declaration = member.getChild(0)
+            if isinstance(declaration, CompiscriptParser.FunctionDeclarationContext):
+                name = declaration.Identifier().getText()
+                params = self.parameter_types(declaration)
+                return_type = declaration.type_().getText() if declaration.type_() else "void"
+                if name == "constructor":
+                    layout.constructor = (layout.method_function(name), list(params.values()))
+                elif not layout.add_method(name, params, return_type):
+                    self.add_error(f"Method '{name}' overrides '{parent_name}.{name}' with a different signature", declaration)
+                    continue
+                methods.append((declaration, layout.method_function(name), params, return_type))
+                continue
+
+            name = declaration.Identifier().getText()
+            annotation = declaration.typeAnnotation()
+            if annotation is None:
+                self.add_error(f"Field '{name}' of class '{class_name}' needs a type annotation", declaration)
+                continue
+            if not layout.add_field(name, annotation.type_().getText()):
+                self.add_error(f"Field '{name}' already declared in class '{class_name}'", declaration)
+                continue
+            if isinstance(declaration, CompiscriptParser.VariableDeclarationContext):
+                value = declaration.initializer().expression() if declaration.initializer() else None
+            else:
+                value = declaration.expression()
+            initializers.append((layout.field_offset(name), value))
+
+        code = [layout.declaration()]
+        if layout.fields:
+            code += self.function_body(layout.init_function(), {"this": class_name}, "void",
+                                       lambda: self.field_initialization(layout, initializers)).code
+        for declaration, function, params, return_type in methods:
+            params = {"this": class_name, **params}
+            code += self.function_body(function, params, return_type,
+                                       lambda declaration=declaration: self.visit(declaration.block()).code).code
+        return CodeFragment(code, class_name, "class")
+
+    def field_initialization(self, layout, initializers):
+        # Body of the init function: the parent's fields first, then this class's own
+        code = []
+        parent = layout.parent
+        if parent is not None and parent.fields:
+            temp = self.cg.new_temp()
+            code += ["param this", f"{temp} = call {parent.init_function()}, 1"]
+        for offset, expression in initializers:
+            name, type_ = layout.fields[offset - 1]
+            if expression is None:
+                code.append(f"setfield this, {offset}, {FIELD_DEFAULTS.get(type_, 'null')}")
+                continue
+            value = self.visit(expression)
+            if not self.assignable(type_, value.type):
+                self.add_error(f"Type error: field '{name}' declared as {type_} but initialized with {value.type}", expression)
+                continue
+            code += value.code + [f"setfield this, {offset}, {value.place}"]
+        return code
+
+    def visitNewExpr(self, ctx: CompiscriptParser.NewExprContext):
+        # Allocate the record, initialize its fields, then run the (possibly inherited) constructor
+        class_name = ctx.Identifier().getText()
+        if class_name not in self.classes:
+            self.add_error(f"Class '{class_name}' not declared", ctx)
+            return CodeFragment([], None, "unknown")
+        layout = self.classes[class_name]
+
+        args = [self.visit(arg) for arg in ctx.arguments().expression()] if ctx.arguments() else []
+        function, param_types = layout.constructor or (None, [])
+        if len(args) != len(param_types):
+            self.add_error(f"Constructor of '{class_name}' expects {len(param_types)} args, got {len(args)}", ctx)
+            return CodeFragment([], None, "unknown")
+
+        temp = self.cg.new_temp()
+        code = [f"{temp} = new {class_name}"]
+        if layout.fields:
+            code += [f"param {temp}", f"{self.cg.new_temp()} = call {layout.init_function()}, 1"]
+        if function is not None:
+            code += self.call_arguments([CodeFragment([], temp, class_name)] + args, [class_name] + param_types, ctx)
+            code.append(f"{self.cg.new_temp()} = call {function}, {len(args) + 1}")
+        return CodeFragment(code, temp, class_name)
+
+    def visitThisExpr(self, ctx: CompiscriptParser.ThisExprContext):
+        if "this" not in self.symbol_table:
+            self.add_error("'this' used outside of a method", ctx)
+            return CodeFragment([], None, "unknown")
+        return CodeFragment([], "this", self.symbol_table["this"]["type"])
+
+    def call_arguments(self, args, param_types, ctx):
+        # Code that evaluates and passes the arguments of a call, in order
+        code = []
+        for position, (arg, param_type) in enumerate(zip(args, param_types)):
+            if param_type != "unknown" and not self.assignable(param_type, arg.type):
+                self.add_error(f"Type error: argument {position} expects {param_type}, got {arg.type}", ctx)
+            code += arg.code + [f"param {arg.place}"]
+        return code
+
+    def visitLeftHandSide(self, ctx: CompiscriptParser.LeftHandSideContext):
+        # Variables, and calls or indexing by name, keep their own handlers. Chains that
+        # involve objects (new, this, obj.field, obj.method()) are folded suffix by suffix.
+        atom = ctx.primaryAtom()
+        suffixes = list(ctx.suffixOp())
+        by_name = isinstance(atom, CompiscriptParser.IdentifierExprContext)
+        properties = [suffix for suffix in suffixes if isinstance(suffix, CompiscriptParser.PropertyAccessExprContext)]
+        if by_name and not properties:
+            return self.visitChildren(ctx)
+
+        if by_name and not isinstance(suffixes[0], CompiscriptParser.PropertyAccessExprContext):
+            current = self.visit(suffixes.pop(0))
+        else:
+            current = self.visit(atom)
+
+        while suffixes and current.type != "unknown":
+            suffix = suffixes.pop(0)
+            if isinstance(suffix, CompiscriptParser.PropertyAccessExprContext):
+                name = suffix.Identifier().getText()
+                if suffixes and isinstance(suffixes[0], CompiscriptParser.CallExprContext):
+                    current = self.method_call(current, name, suffixes.pop(0))
+                else:
+                    current = self.field_load(current, name, suffix)
+            elif isinstance(suffix, CompiscriptParser.IndexExprContext):
+                current = self.element_load(current, suffix)
+            else:
+                self.add_error(f"Type error: value of type {current.type} is not callable", suffix)
+                current = CodeFragment([], None, "unknown")
+        return current
+
+    def object_layout(self, target, ctx):
+        if target.type not in self.classes:
+            self.add_error(f"Type error: value of type {target.type} is not an object", ctx)
+            return None
+        return self.classes[target.type]
+
+    def field_load(self, target, name, ctx):
+        layout = self.object_layout(target, ctx)
+        if layout is None:
+            return CodeFragment([], None, "unknown")
+        offset = layout.field_offset(name)
+        if offset is None:
+            self.add_error(f"Class '{layout.name}' has no field '{name}'", ctx)
+            return CodeFragment([], None, "unknown")
+
+        temp = self.cg.new_temp()
+        code = target.code + [f"{temp} = getfield {target.place}, {offset}"]
+        return CodeFragment(code, temp, layout.field_type(name))
+
+    def property_store(self, target, name, value, ctx):
+        # obj.field = value, checked against the field's declared type
+        layout = self.object_layout(target, ctx)
+        if layout is None:
+            return CodeFragment([], None, "unknown")
+        offset = layout.field_offset(name)
+        if offset is None:
+            self.add_error(f"Class '{layout.name}' has no field '{name}'", ctx)
+            return CodeFragment([], None, "unknown")
+
+        field_type = layout.field_type(name)
+        if not self.assignable(field_type, value.type):
+            self.add_error(f"Type mismatch: field '{name}' declared as {field_type} but assigned {value.type}", ctx)
+            return CodeFragment([], None, "unknown")
+
+        code = target.code + value.code + [f"setfield {target.place}, {offset}, {value.place}"]
+        return CodeFragment(code, value.place, field_type)
+
+    def visitPropertyAssignExpr(self, ctx: CompiscriptParser.PropertyAssignExprContext):
+        target = self.visit(ctx.lhs)
+        return self.property_store(target, ctx.Identifier().getText(), self.visit(ctx.assignmentExpr()), ctx)
+
+    def method_call(self, target, name, ctx):
+        # The object is the first argument and picks the function through its vtable
+        layout = self.object_layout(target, ctx)
+        if layout is None:
+            return CodeFragment([], None, "unknown")
+        slot = layout.method_slot(name)
+        if slot is None:
+            self.add_error(f"Class '{layout.name}' has no method '{name}'", ctx)
+            return CodeFragment([], None, "unknown")
+
+        param_types, return_type = layout.signatures[name]
+        args = [self.visit(arg) for arg in ctx.arguments().expression()] if ctx.arguments() else []
+        if len(args) != len(param_types):
+            self.add_error(f"Method '{name}' expects {len(param_types)} args, got {len(args)}", ctx)
+            return CodeFragment([], None, return_type)
+
+        temp = self.cg.new_temp()
+        code = target.code + self.call_arguments([target] + args, [layout.name] + param_types, ctx)
+        code.append(f"{temp} = callvirt {target.place}, {slot}, {len(args) + 1}")
+        self.virtual_calls[temp] = layout.name
+        return CodeFragment(code, temp, return_type)
+
+    def devirtualize(self, code):
+        # Once every class is known, a callvirt whose slot holds the same function in the
+        # receiver's static class and all its subclasses becomes a direct call. A receiver
+        # other than 'this' keeps the null check the vtable load used to do.
+        hierarchy = ClassHierarchy(self.classes)
+        result = []
+        for line in code:
+            match = CALLVIRT.match(line)
+            if match is None or match.group(1) not in self.virtual_calls:
+                result.append(line)
+                continue
+            temp, receiver, slot, count = match.groups()
+            self.devirtualization["sites"] += 1
+            function = hierarchy.direct_target(self.virtual_calls[temp], int(slot))
+            if function is None:
+                result.append(line)
+                continue
+            self.devirtualization["devirtualized"] += 1
+            if receiver != "this":
+                result.append(TacLine(f"nullcheck {receiver}", line.line))
+            result.append(TacLine(f"{temp} = call {function}, {count}", line.line))
+        return result
+
+    def element_load(self, target, ctx):
+        # Indexing a computed array, such as obj.items[i]
+        index = self.visit(ctx.expression())
+        if not target.type.endswith("[]"):
+            self.add_error(f"Type error: value of type {target.type} is not an array", ctx)
+            return CodeFragment([], None, "unknown")
+        if index.type != "integer":
+            self.add_error(f"Type error: array index must be integer, got {index.type}", ctx)
+            return CodeFragment([], None, "unknown")
+
+        temp = self.cg.new_temp()
+        code = target.code + index.code + [f"{temp} = {target.place}[{index.place}]"]
+        return CodeFragment(code, temp, target.type.replace("[]", "", 1))
+
     def visitProgram(self, ctx:CompiscriptParser.ProgramContext):
         code = []
 
         for stmt in ctx.statement():
             frag = self.visit(stmt)
             if isinstance(frag, CodeFragment):
-                code.extend(frag.code)
+                code.extend(tag_lines(frag.code, stmt.start.line))
+        if self.catch_code[0]:
+            # Top-level catch blocks go after the program, which jumps over them to finish
+            exit_label = self.cg.new_label()
+            code += [TacLine(f"goto {exit_label}", ctx.stop.line)] + self.catch_code[0]
+            code.append(TacLine(f"{exit_label}:", ctx.stop.line))
+        if self.virtual_calls:
+            code = self.devirtualize(code)
+        if self.eliminate_checks and not self.errors:
+            elimination = BoundsCheckElimination(code, self.symbol_table)
+            code = elimination.run()
+            self.bounds_checks = elimination.stats
+        if self.pure_calls and not self.errors:
+            optimizer = PureCallOptimizer(code, self.symbol_table, self.cg.new_temp)
+            code = optimizer.run()
+            self.purity = optimizer.stats
 
         tac_code = "\n".join(code)
         self.generated_code = tac_code
+        self.source_lines = [text.line for text in code]
         print(tac_code)
         return tac_code
\ No newline at end of file
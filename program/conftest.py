@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The tests in tests/ import the compiler's modules, which live in this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -17,11 +17,17 @@ def index():
     image_url = None
     symbol_table = None
     intermediate_code = None  # 🔹 Nuevo
+    mips_code = None
+    allocation_stats = None
+    backend_errors = None
+    program_output = None
+    runtime_error = None
 
     if request.method == "POST":
         code = request.form.get("code", "")
         try:
-            parse_result = parse_text(code)
+            # The "Ejecutar" button also runs the program with the TAC interpreter
+            parse_result = parse_text(code, run=request.form.get("action") == "run")
             
             all_errors = parse_result["syntax_errors"] + parse_result["semantic_errors"]
             
@@ -31,6 +37,11 @@ def index():
                 result = {"status": "ok", "messages": ["OK"]}
                 symbol_table = parse_result["symbol_table"]
                 intermediate_code = parse_result["intermediate_code"]  # 🔹 Capturamos el TAC
+                mips_code = parse_result["mips_code"]
+                allocation_stats = parse_result["allocation_stats"]
+                backend_errors = parse_result["backend_errors"]
+                program_output = parse_result["program_output"]
+                runtime_error = parse_result["runtime_error"]
             
             image_url = "/static_result/" + os.path.basename(parse_result["image_path"])
             
@@ -42,7 +53,12 @@ def index():
         result=result, 
         image_url=image_url, 
         symbol_table=symbol_table, 
-        intermediate_code=intermediate_code  # 🔹 Enviamos al HTML
+        intermediate_code=intermediate_code,  # 🔹 Enviamos al HTML
+        mips_code=mips_code,
+        allocation_stats=allocation_stats,
+        backend_errors=backend_errors,
+        program_output=program_output,
+        runtime_error=runtime_error
     )
 
 
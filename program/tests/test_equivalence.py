@@ -0,0 +1,49 @@
+import io
+import os
+import contextlib
+import pytest
+from antlr4 import FileStream, InputStream
+from Driver import analyze, generate_mips
+from Equivalence import compare, program_paths
+from MipsSimulator import MipsSimulator, SimulationError
+
+
+def analyzed(source):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(source)
+    return visitor if not syntax_errors and not visitor.errors else None
+
+
+@pytest.mark.parametrize("path", program_paths(None), ids=os.path.basename)
+def test_backends_print_what_the_interpreter_prints(path):
+    visitor = analyzed(FileStream(path, encoding="utf-8"))
+    if visitor is None:
+        pytest.skip("front end errors")
+    _, problems = compare(visitor, os.path.basename(path))
+    assert not problems, "\n".join(problems)
+
+
+@pytest.mark.parametrize("translate", [False, True], ids=["interpreter", "translated"])
+def test_mips_step_limit_stops_a_loop_that_ends_on_not_equal(translate):
+    # i only takes even values, so the bne back edge is taken forever
+    visitor = analyzed(InputStream("let i: integer = 0;\nwhile (i != 7) { i = i + 2; }\nprint(i);\n"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assembly, generator = generate_mips(visitor, "linear")
+    assert not generator.errors
+    with pytest.raises(SimulationError, match="step limit"):
+        MipsSimulator(assembly, translate=translate).run(max_steps=100_000)
+
+
+@pytest.mark.parametrize("literal", ["2147483648", "4611686018427387904", "-(2147483648)"])
+def test_integer_literals_past_32_bits_are_front_end_errors(literal):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(InputStream(f"let x: integer = {literal};\nprint(x);\n"))
+    assert not syntax_errors
+    assert any("does not fit in 32 bits" in error for error in visitor.errors)
+
+
+def test_a_function_named_main_is_a_front_end_error():
+    source = "function main(): integer { return 1; }\nprint(main());\n"
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, _, visitor = analyze(InputStream(source))
+    assert any("'main' is reserved" in error for error in visitor.errors)
@@ -0,0 +1,58 @@
+import io
+import contextlib
+import pytest
+from antlr4 import InputStream
+from Driver import analyze
+from PureCalls import memoizable_functions
+from TacInterpreter import TacInterpreter
+
+FUNCTIONS = """
+function fib(n: integer): integer {
+  if (n < 2) { return n; }
+  return fib(n - 1) + fib(n - 2);
+}
+
+function paths(r: integer, c: integer): integer {
+  if (r == 0 || c == 0) { return 1; }
+  return (paths(r - 1, c) + paths(r, c - 1)) % 1000003;
+}
+"""
+
+
+def compiled(statements):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, syntax_errors, visitor = analyze(InputStream(FUNCTIONS + statements))
+    assert not syntax_errors and not visitor.errors
+    return visitor.generated_code, visitor.symbol_table
+
+
+def run(statements, memoize, **options):
+    code, symbol_table = compiled(statements)
+    memoized = memoizable_functions(code, symbol_table) if memoize else ()
+    interpreter = TacInterpreter(code, symbol_table, memoize=memoized, **options)
+    return interpreter.run(), interpreter
+
+
+@pytest.mark.parametrize("statements", ["print(fib(20));", "print(paths(8, 8));"], ids=["fib", "paths"])
+def test_memoized_calls_print_the_same(statements):
+    output, plain = run(statements, memoize=False)
+    memoized_output, memoized = run(statements, memoize=True)
+    assert memoized_output == output
+    assert memoized.steps < plain.steps
+    assert memoized.memo_stats["hits"] > 0
+
+
+def test_memoized_steps_grow_linearly():
+    _, twenty = run("print(fib(20));", memoize=True)
+    _, forty = run("print(fib(40));", memoize=True)
+    assert twenty.steps < 400
+    # Every fib(k) runs its body once, so twice the argument is about twice the steps
+    assert forty.steps < 2.5 * twenty.steps
+
+
+def test_small_memo_table_evicts_and_prints_the_same():
+    output, _ = run("print(paths(6, 6));", memoize=False)
+    memoized_output, memoized = run("print(paths(6, 6));", memoize=True, memo_entries=4)
+    assert memoized_output == output
+    assert memoized.memo_stats["evicted"] > 0
+    assert len(memoized.memo) <= 4
@@ -0,0 +1,16 @@
+import pytest
+from MipsInstruction import Mem
+from Peephole import RULES, optimize, i
+
+
+@pytest.mark.parametrize("rule", RULES, ids=lambda rule: rule.name)
+def test_rule_rewrites_its_example(rule):
+    # Every rule by itself on its example window
+    result = [str(instruction) for instruction in optimize(rule.example, rules=[rule])]
+    assert result == [str(instruction) for instruction in rule.expected]
+
+
+def test_load_store_keeps_store_through_loaded_register():
+    # The load replaces the base register, so the store goes somewhere else
+    window = [i("lw", "$t0", Mem(0, "$t0")), i("sw", "$t0", Mem(0, "$t0"))]
+    assert [str(instruction) for instruction in optimize(window)] == [str(instruction) for instruction in window]